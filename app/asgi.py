@@ -12,6 +12,7 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import whisper_pool
 from app.utils import utils
 
 
@@ -80,3 +81,4 @@ def shutdownEvent():
 @app.on_event("startup")
 def startupEvent():
     logger.info("Startup event")
+    whisper_pool.preload_in_background()
@@ -4,7 +4,7 @@ from loguru import logger
 from app.config import config
 
 def __init_logger():
-    _lvl = config.log_level
+    _lvl = config.logLevel
     root_dir = os.path.dirname(
         os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     )
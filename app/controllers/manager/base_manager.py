@@ -1,68 +1,160 @@
 import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Any, Callable, Dict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
 from loguru import logger
 
+from app.models import const
+
 
 class TaskManager(ABC):
-    def __init__(self, maxConcurrentTasks: int):
+    """
+    Fixed pool of long-lived worker threads draining a priority queue
+
+    Lower priority values run first, tasks with the same priority run in
+    the order they were added. At most maxConcurrentTasks tasks are in
+    flight, a task that returns a Future stays in flight until it resolves
+    """
+
+    def __init__(self, maxConcurrentTasks: int, pollInterval: float = 1.0,
+                 startWorkers: bool = True):
         self.maxConcurrentTasks = maxConcurrentTasks
+        self.pollInterval = pollInterval
         self.currentTasks = 0
         self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.slots = threading.BoundedSemaphore(maxConcurrentTasks)
         self.queue = self.createQueue()
+        self.metrics = {
+            "completed": 0,
+            "failed": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "started": 0,
+        }
+        self.workers = []
+        for i in range(maxConcurrentTasks if startWorkers else 0):
+            worker = threading.Thread(
+                target=self.workerLoop, name=f"task-worker-{i}", daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
 
     @abstractmethod
     def createQueue(self):
         pass
 
     def addTask(self, func: Callable, *args: Any, **kwargs: Any):
-        with self.lock:
-            if self.currentTasks < self.maxConcurrentTasks:
-                logger.info(f"Executing task: {func.__name__}, current tasks: {self.currentTasks}")
-                self.executeTask(func, *args, **kwargs)
-            else:
-                logger.info(f"Queueing task: {func.__name__}, current tasks: {self.currentTasks}")
-                self.enqueue({"func": func, "args": args, "kwargs": kwargs})
-
-    def executeTask(self, func: Callable, *args: Any, **kwargs: Any):
-        thread = threading.Thread(
-            target=self.runTask, args=(func, *args), kwargs=kwargs
+        # the priority stays in kwargs so the task can pass it on to the stage queues
+        priority = kwargs.get("priority", const.TASK_PRIORITY_NORMAL)
+        logger.info(
+            f"Queueing task: {func.__name__}, priority: {priority}, "
+            f"running: {self.currentTasks}, queued: {self.queueDepth()}"
         )
-        thread.start()
+        self.enqueue({
+            "func": func,
+            "args": args,
+            "kwargs": kwargs,
+            "priority": priority,
+            "enqueued_at": time.time(),
+        })
 
-    def runTask(self, func: Callable, *args: Any, **kwargs: Any):
-        try:
+    def workerLoop(self):
+        while not self.stopEvent.is_set():
+            # only take a task when it can start right away
+            if not self.slots.acquire(timeout=self.pollInterval):
+                continue
+            try:
+                taskInfo = self.dequeue(timeout=self.pollInterval)
+            except Exception as e:
+                logger.error(f"Failed to dequeue task: {str(e)}")
+                taskInfo = None
+                self.stopEvent.wait(self.pollInterval)
+            if not taskInfo:
+                self.slots.release()
+                continue
+
+            waited = time.time() - taskInfo.get("enqueued_at", time.time())
             with self.lock:
-                self.currentTasks += 1
-            func(*args, **kwargs)
-        finally:
-            self.taskDone()
+                self.metrics["started"] += 1
+                self.metrics["wait_seconds_total"] += waited
+                self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], waited)
+
+            logger.info(f"Executing task: {taskInfo['func'].__name__}, waited: {waited:.1f}s")
+            self.runTask(taskInfo)
 
-    def checkQueue(self):
+    def runTask(self, taskInfo: Dict):
+        func = taskInfo["func"]
         with self.lock:
-            if (
-                self.currentTasks < self.maxConcurrentTasks
-                and not self.isQueueEmpty()
-            ):
-                taskInfo = self.dequeue()
-                func = taskInfo["func"]
-                args = taskInfo.get("args", ())
-                kwargs = taskInfo.get("kwargs", {})
-                self.executeTask(func, *args, **kwargs)
-
-    def taskDone(self):
+            self.currentTasks += 1
+        try:
+            result = func(*taskInfo.get("args", ()), **taskInfo.get("kwargs", {}))
+        except Exception as e:
+            logger.exception(f"Task {func.__name__} failed: {str(e)}")
+            self.taskDone(taskInfo, failed=True)
+            return
+
+        if isinstance(result, Future):
+            # the worker is free again, the slot is released when the task resolves
+            result.add_done_callback(
+                lambda f: self.taskDone(taskInfo, failed=f.exception() is not None)
+            )
+        else:
+            self.taskDone(taskInfo)
+
+    def taskDone(self, taskInfo: Dict, failed: bool = False):
+        try:
+            self.ack(taskInfo, failed)
+        except Exception as e:
+            logger.error(f"Failed to acknowledge task: {str(e)}")
         with self.lock:
             self.currentTasks -= 1
-        self.checkQueue()
+            self.metrics["failed" if failed else "completed"] += 1
+        self.slots.release()
+
+    def ack(self, taskInfo: Dict, failed: bool):
+        """
+        Called once a dequeued task has finished, queues that hand out leases release them here
+        """
+        pass
+
+    def getMetrics(self) -> Dict[str, Any]:
+        with self.lock:
+            started = self.metrics["started"]
+            return {
+                "workers": self.maxConcurrentTasks,
+                "running": self.currentTasks,
+                "queue_depth": self.queueDepth(),
+                "completed": self.metrics["completed"],
+                "failed": self.metrics["failed"],
+                "avg_wait_seconds": self.metrics["wait_seconds_total"] / started if started else 0.0,
+                "max_wait_seconds": self.metrics["wait_seconds_max"],
+            }
+
+    def shutdown(self, wait: bool = False):
+        self.stopEvent.set()
+        if wait:
+            for worker in self.workers:
+                worker.join()
 
     @abstractmethod
     def enqueue(self, task: Dict):
         pass
 
     @abstractmethod
-    def dequeue(self):
+    def dequeue(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Take the next task, waiting up to timeout seconds for one
+
+        Returns:
+            The task, or None when the queue stayed empty
+        """
         pass
 
     @abstractmethod
-    def isQueueEmpty(self):
+    def queueDepth(self) -> int:
         pass
+
+    def isQueueEmpty(self):
+        return self.queueDepth() == 0
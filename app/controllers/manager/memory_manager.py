@@ -1,18 +1,24 @@
-from queue import Queue
-from typing import Dict
+import itertools
+from queue import Empty, PriorityQueue
+from typing import Dict, Optional
 
 from app.controllers.manager.base_manager import TaskManager
 
 
 class InMemoryTaskManager(TaskManager):
     def createQueue(self):
-        return Queue()
+        # the counter keeps equal priorities in FIFO order and never compares the dicts
+        self.sequence = itertools.count()
+        return PriorityQueue()
 
     def enqueue(self, task: Dict):
-        self.queue.put(task)
+        self.queue.put((task["priority"], next(self.sequence), task))
 
-    def dequeue(self):
-        return self.queue.get()
+    def dequeue(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        try:
+            return self.queue.get(timeout=timeout)[2]
+        except Empty:
+            return None
 
-    def isQueueEmpty(self):
-        return self.queue.empty()
+    def queueDepth(self) -> int:
+        return self.queue.qsize()
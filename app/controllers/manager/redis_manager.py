@@ -1,53 +1,284 @@
 import json
-from typing import Dict
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
 
 import redis
+from loguru import logger
 
+from app.config import config
 from app.controllers.manager.base_manager import TaskManager
-from app.models.schema import VideoParams
+from app.models import const
+from app.models.schema import AudioRequest, SubtitleRequest, TaskVideoRequest, VideoParams
 from app.services import task as tm
 
 FUNC_MAP = {
     "start": tm.start,
+    "submit": tm.submit,
 }
 
+PARAMS_MAP = {
+    cls.__name__: cls
+    for cls in (VideoParams, TaskVideoRequest, SubtitleRequest, AudioRequest)
+}
+
+# Moves the first task of the highest non-empty priority list into the
+# processing list and leases it, unless the cluster is at its global limit
+# KEYS: processing, leases, priority lists   ARGV: global limit, visibility timeout
+CLAIM_SCRIPT = """
+local limit = tonumber(ARGV[1])
+if limit > 0 and redis.call('ZCARD', KEYS[2]) >= limit then
+    return false
+end
+for i = 3, #KEYS do
+    local item = redis.call('LMOVE', KEYS[i], KEYS[1], 'LEFT', 'RIGHT')
+    if item then
+        local now = redis.call('TIME')
+        redis.call('ZADD', KEYS[2], tonumber(now[1]) + tonumber(ARGV[2]), item)
+        return item
+    end
+end
+return false
+"""
+
+# Pushes the leased tasks whose deadline passed back to the front of their queue,
+# a task that keeps killing its worker goes to the dead list after max attempts
+# KEYS: processing, leases, attempts, dead   ARGV: max attempts, queue prefix
+REQUEUE_SCRIPT = """
+local now = redis.call('TIME')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', tonumber(now[1]))
+-- walk backwards so the requeued tasks keep their order at the front
+for i = #expired, 1, -1 do
+    local item = expired[i]
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('LREM', KEYS[1], 1, item)
+    local task = cjson.decode(item)
+    if redis.call('HINCRBY', KEYS[3], task.id, 1) >= tonumber(ARGV[1]) then
+        redis.call('HDEL', KEYS[3], task.id)
+        redis.call('RPUSH', KEYS[4], item)
+    else
+        redis.call('LPUSH', ARGV[2] .. ':' .. task.priority, item)
+    end
+end
+return #expired
+"""
+
+# Pushes the deadline of leases that are still held
+# KEYS: leases   ARGV: visibility timeout, items
+EXTEND_SCRIPT = """
+local now = redis.call('TIME')
+local deadline = tonumber(now[1]) + tonumber(ARGV[1])
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], 'XX', deadline, ARGV[i])
+end
+return #ARGV - 1
+"""
+
+
+def getRedisUrl() -> str:
+    redisHost = config.app.get("redis_host", "localhost")
+    redisPort = config.app.get("redis_port", 6379)
+    redisDb = config.app.get("redis_db", 0)
+    redisPassword = config.app.get("redis_password", None)
+    return f"redis://:{redisPassword}@{redisHost}:{redisPort}/{redisDb}"
+
 
 class RedisTaskManager(TaskManager):
-    def __init__(self, maxConcurrentTasks: int, redisUrl: str):
+    """
+    Task queue shared by any number of API processes and worker nodes
+
+    A dequeued task moves to a processing list and holds a lease that the
+    worker's heartbeat keeps extending. When a worker dies its leases expire
+    and any other worker puts the tasks back in their queue, so a task runs
+    at least once. The number of leases is the cluster-wide count of running
+    tasks and is capped by maxGlobalTasks
+    """
+
+    def __init__(self, maxConcurrentTasks: int, redisUrl: str,
+                 startWorkers: bool = True, maxGlobalTasks: int = 0,
+                 visibilityTimeout: float = 120, maxAttempts: int = 3):
         self.redisClient = redis.Redis.from_url(redisUrl)
-        super().__init__(maxConcurrentTasks)
+        self.workerId = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.maxGlobalTasks = maxGlobalTasks
+        self.visibilityTimeout = visibilityTimeout
+        self.maxAttempts = maxAttempts
+        self.leased: Dict[str, bytes] = {}
+        self.claimScript = self.redisClient.register_script(CLAIM_SCRIPT)
+        self.requeueScript = self.redisClient.register_script(REQUEUE_SCRIPT)
+        self.extendScript = self.redisClient.register_script(EXTEND_SCRIPT)
+        super().__init__(maxConcurrentTasks, startWorkers=startWorkers)
+
+        if startWorkers:
+            heartbeat = threading.Thread(target=self.heartbeatLoop, name="task-heartbeat", daemon=True)
+            heartbeat.start()
+            self.workers.append(heartbeat)
 
     def createQueue(self):
         return "task_queue"
 
+    def queueKey(self, priority: int) -> str:
+        return f"{self.queue}:{priority}"
+
+    def queueKeys(self):
+        # the claim script takes from the first non-empty key, so listing them in priority order does the scheduling
+        return [self.queueKey(p) for p in const.TASK_PRIORITIES]
+
+    @property
+    def processingKey(self) -> str:
+        return f"{self.queue}:processing"
+
+    @property
+    def leasesKey(self) -> str:
+        return f"{self.queue}:leases"
+
+    @property
+    def attemptsKey(self) -> str:
+        return f"{self.queue}:attempts"
+
+    @property
+    def deadKey(self) -> str:
+        return f"{self.queue}:dead"
+
+    def workerKey(self, workerId: str) -> str:
+        return f"task_worker:{workerId}"
+
     def enqueue(self, task: Dict):
         taskWithSerializableParams = task.copy()
+        taskWithSerializableParams["kwargs"] = dict(task["kwargs"])
 
-        if "params" in task["kwargs"] and isinstance(
-            task["kwargs"]["params"], VideoParams
-        ):
-            taskWithSerializableParams["kwargs"]["params"] = task["kwargs"][
-                "params"
-            ].dict()
+        params = task["kwargs"].get("params")
+        if type(params).__name__ in PARAMS_MAP:
+            taskWithSerializableParams["kwargs"]["params"] = params.dict()
+            taskWithSerializableParams["params_type"] = type(params).__name__
 
+        priority = min(const.TASK_PRIORITIES, key=lambda p: abs(p - task["priority"]))
+        taskWithSerializableParams["id"] = uuid.uuid4().hex
+        taskWithSerializableParams["priority"] = priority
         taskWithSerializableParams["func"] = task["func"].__name__
-        self.redisClient.rpush(self.queue, json.dumps(taskWithSerializableParams))
-
-    def dequeue(self):
-        taskJson = self.redisClient.lpop(self.queue)
-        if taskJson:
-            taskInfo = json.loads(taskJson)
-            taskInfo["func"] = FUNC_MAP[taskInfo["func"]]
-
-            if "params" in taskInfo["kwargs"] and isinstance(
-                taskInfo["kwargs"]["params"], dict
-            ):
-                taskInfo["kwargs"]["params"] = VideoParams(
-                    **taskInfo["kwargs"]["params"]
-                )
-
-            return taskInfo
-        return None
-
-    def isQueueEmpty(self):
-        return self.redisClient.llen(self.queue) == 0
+        self.redisClient.rpush(
+            self.queueKey(priority), json.dumps(taskWithSerializableParams)
+        )
+
+    def dequeue(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Claim the next task
+
+        BLMOVE can neither check the global limit nor span the priority lists,
+        so the claim is an LMOVE inside a script and idle workers poll
+        """
+        deadline = time.time() + (timeout or 0)
+        while True:
+            item = self.claimScript(
+                keys=[self.processingKey, self.leasesKey] + self.queueKeys(),
+                args=[self.maxGlobalTasks, self.visibilityTimeout],
+            )
+            if item or time.time() >= deadline or self.stopEvent.is_set():
+                break
+            self.stopEvent.wait(min(0.5, max(0.0, deadline - time.time())))
+
+        if not item:
+            return None
+
+        taskInfo = json.loads(item)
+        taskInfo["raw"] = item
+        taskInfo["func"] = FUNC_MAP[taskInfo["func"]]
+
+        paramsType = PARAMS_MAP.get(taskInfo.get("params_type"), VideoParams)
+        if "params" in taskInfo["kwargs"] and isinstance(
+            taskInfo["kwargs"]["params"], dict
+        ):
+            taskInfo["kwargs"]["params"] = paramsType(
+                **taskInfo["kwargs"]["params"]
+            )
+
+        with self.lock:
+            self.leased[taskInfo["id"]] = item
+        return taskInfo
+
+    def ack(self, taskInfo: Dict, failed: bool):
+        with self.lock:
+            self.leased.pop(taskInfo["id"], None)
+        pipe = self.redisClient.pipeline()
+        pipe.lrem(self.processingKey, 1, taskInfo["raw"])
+        pipe.zrem(self.leasesKey, taskInfo["raw"])
+        pipe.hdel(self.attemptsKey, taskInfo["id"])
+        pipe.execute()
+
+    def heartbeat(self):
+        with self.lock:
+            items = list(self.leased.values())
+            running = self.currentTasks
+        if items:
+            self.extendScript(keys=[self.leasesKey], args=[self.visibilityTimeout] + items)
+        self.redisClient.set(
+            self.workerKey(self.workerId),
+            json.dumps({"running": running, "slots": self.maxConcurrentTasks, "seen_at": time.time()}),
+            ex=max(1, int(self.visibilityTimeout)),
+        )
+
+        requeued = self.requeueScript(
+            keys=[self.processingKey, self.leasesKey, self.attemptsKey, self.deadKey],
+            args=[self.maxAttempts, self.queue],
+        )
+        if requeued:
+            logger.warning(f"Requeued {requeued} tasks whose worker stopped responding")
+
+    def heartbeatLoop(self):
+        interval = max(0.5, self.visibilityTimeout / 3)
+        # keep beating while tasks are still running after a shutdown was requested
+        while not self.stopEvent.is_set() or self.leased:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {str(e)}")
+            time.sleep(interval)
+        self.redisClient.delete(self.workerKey(self.workerId))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop taking tasks and wait for the running ones
+
+        Returns:
+            Whether every running task finished in time
+        """
+        self.stopEvent.set()
+        deadline = time.time() + timeout if timeout else None
+        while self.leased:
+            if deadline and time.time() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    def queueDepth(self) -> int:
+        pipe = self.redisClient.pipeline()
+        for key in self.queueKeys():
+            pipe.llen(key)
+        return sum(pipe.execute())
+
+    def getMetrics(self) -> Dict[str, Any]:
+        metrics = super().getMetrics()
+        pipe = self.redisClient.pipeline()
+        pipe.zcard(self.leasesKey)
+        pipe.llen(self.deadKey)
+        inFlight, dead = pipe.execute()
+        metrics["cluster"] = {
+            "running": inFlight,
+            "max_running": self.maxGlobalTasks,
+            "workers": sum(1 for _ in self.redisClient.scan_iter(self.workerKey("*"))),
+            "dead": dead,
+        }
+        return metrics
+
+
+def fromConfig(startWorkers: bool = True) -> RedisTaskManager:
+    return RedisTaskManager(
+        maxConcurrentTasks=config.app.get("max_concurrent_tasks", 5),
+        redisUrl=getRedisUrl(),
+        startWorkers=startWorkers,
+        maxGlobalTasks=config.app.get("max_global_tasks", 0),
+        visibilityTimeout=config.app.get("task_visibility_timeout", 120),
+        maxAttempts=config.app.get("task_max_attempts", 3),
+    )
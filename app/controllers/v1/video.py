@@ -6,43 +6,45 @@ from typing import Union
 
 from fastapi import BackgroundTasks, Depends, Path, Query, Request, UploadFile
 from fastapi.params import File
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from loguru import logger
 
 from app.config import config
 from app.controllers import base
 from app.controllers.manager.memory_manager import InMemoryTaskManager
-from app.controllers.manager.redis_manager import RedisTaskManager
 from app.controllers.v1.base import new_router
+from app.models import const
 from app.models.exception import HttpException
 from app.models.schema import (
     AudioRequest,
     BgmRetrieveResponse,
     BgmUploadResponse,
+    QueueStatusResponse,
     SubtitleRequest,
     TaskDeletionResponse,
     TaskQueryRequest,
     TaskQueryResponse,
     TaskResponse,
     TaskVideoRequest,
+    VoiceListResponse,
 )
+from app.services import stages
 from app.services import state as sm
 from app.services import task as tm
+from app.services import voice_catalog
 from app.utils import utils
 
 router = new_router()
 
 enableRedis = config.app.get("enable_redis", False)
-redisHost = config.app.get("redis_host", "localhost")
-redisPort = config.app.get("redis_port", 6379)
-redisDb = config.app.get("redis_db", 0)
-redisPassword = config.app.get("redis_password", None)
 maxConcurrentTasks = config.app.get("max_concurrent_tasks", 5)
 
-redisUrl = f"redis://:{redisPassword}@{redisHost}:{redisPort}/{redisDb}"
 if enableRedis:
-    taskManager = RedisTaskManager(
-        maxConcurrentTasks=maxConcurrentTasks, redisUrl=redisUrl
+    from app.controllers.manager import redis_manager
+
+    # turn the embedded workers off when standalone workers (worker.py) run the queue
+    taskManager = redis_manager.fromConfig(
+        startWorkers=config.app.get("redis_embedded_workers", True)
     )
 else:
     taskManager = InMemoryTaskManager(maxConcurrentTasks=maxConcurrentTasks)
@@ -50,29 +52,39 @@ else:
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
 def createVideo(
-    backgroundTasks: BackgroundTasks, request: Request, body: TaskVideoRequest
+    backgroundTasks: BackgroundTasks,
+    request: Request,
+    body: TaskVideoRequest,
+    batch: bool = Query(False, description="Queue behind interactive requests"),
 ):
-    return createTask(request, body, stopAt="video")
+    return createTask(request, body, stopAt="video", batch=batch)
 
 
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
 def createSubtitle(
-    backgroundTasks: BackgroundTasks, request: Request, body: SubtitleRequest
+    backgroundTasks: BackgroundTasks,
+    request: Request,
+    body: SubtitleRequest,
+    batch: bool = Query(False, description="Queue behind interactive requests"),
 ):
-    return createTask(request, body, stopAt="subtitle")
+    return createTask(request, body, stopAt="subtitle", batch=batch)
 
 
 @router.post("/audio", response_model=TaskResponse, summary="Generate audio only")
 def createAudio(
-    backgroundTasks: BackgroundTasks, request: Request, body: AudioRequest
+    backgroundTasks: BackgroundTasks,
+    request: Request,
+    body: AudioRequest,
+    batch: bool = Query(False, description="Queue behind interactive requests"),
 ):
-    return createTask(request, body, stopAt="audio")
+    return createTask(request, body, stopAt="audio", batch=batch)
 
 
 def createTask(
     request: Request,
     body: Union[TaskVideoRequest, SubtitleRequest, AudioRequest],
     stopAt: str,
+    batch: bool = False,
 ):
     taskId = utils.getUuid()
     requestId = base.get_task_id(request)
@@ -83,7 +95,10 @@ def createTask(
             "params": body.model_dump(),
         }
         sm.state.update_task(taskId)
-        taskManager.addTask(tm.start, task_id=taskId, params=body, stop_at=stopAt)
+        priority = const.TASK_PRIORITY_LOW if batch else const.TASK_PRIORITY_NORMAL
+        taskManager.addTask(
+            tm.submit, taskId=taskId, params=body, stopAt=stopAt, priority=priority
+        )
         logger.success(f"Task created: {utils.toJson(task)}")
         return utils.getResponse(200, task)
     except ValueError as e:
@@ -91,6 +106,14 @@ def createTask(
             taskId=taskId, statusCode=400, message=f"{requestId}: {str(e)}"
         )
 
+
+@router.get("/queue", response_model=QueueStatusResponse, summary="Get task queue metrics")
+def getQueueStatus(request: Request):
+    response = taskManager.getMetrics()
+    response["stages"] = stages.get_scheduler().stats()
+    return utils.getResponse(200, response)
+
+
 @router.get("/tasks", response_model=TaskQueryResponse, summary="Get all tasks")
 def getAllTasks(request: Request, page: int = Query(1, ge=1), pageSize: int = Query(10, ge=1)):
     requestId = base.get_task_id(request)
@@ -194,6 +217,33 @@ def getBgmList(request: Request):
     return utils.getResponse(200, response)
 
 
+@router.get(
+    "/voices", response_model=VoiceListResponse, summary="Retrieve the available TTS voices"
+)
+def getVoiceList(
+    request: Request,
+    prefix: str = Query("", description="Voice id prefix, e.g. en or en-US-Jenny"),
+    locale: str = Query("", description="Locale, e.g. en-US"),
+    gender: str = Query("", description="Male or Female"),
+    provider: str = Query("", description="azure-tts-v1, azure-tts-v2 or siliconflow"),
+):
+    catalog = voice_catalog.get_catalog()
+    # the catalog never changes while the process runs, so its hash tags every filtered view
+    etag = f'"{catalog.etag}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    voices = catalog.filter(
+        prefixes=[prefix] if prefix else None,
+        locale=locale,
+        gender=gender,
+        provider=provider,
+    )
+    response = {"voices": [v.to_dict() for v in voices], "total": len(voices)}
+    return JSONResponse(content=utils.getResponse(200, response), headers=headers)
+
+
 @router.post(
     "/musics",
     response_model=BgmUploadResponse,
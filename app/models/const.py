@@ -21,5 +21,11 @@ TASK_STATE_FAILED = -1
 TASK_STATE_COMPLETE = 1
 TASK_STATE_PROCESSING = 4
 
+# lower runs first, interactive requests go ahead of bulk batch jobs
+TASK_PRIORITY_HIGH = 0
+TASK_PRIORITY_NORMAL = 5
+TASK_PRIORITY_LOW = 10
+TASK_PRIORITIES = [TASK_PRIORITY_HIGH, TASK_PRIORITY_NORMAL, TASK_PRIORITY_LOW]
+
 FILE_TYPE_VIDEOS = ["mp4", "mov", "mkv", "webm"]
 FILE_TYPE_IMAGES = ["jpg", "jpeg", "png", "bmp"]
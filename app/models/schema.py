@@ -80,7 +80,8 @@ class VideoParams(BaseVideoParams):
     fontSize: int = 60
     strokeColor: Optional[str] = "#000000"
     strokeWidth: float = 1.5
-    nThreads: Optional[int] = 2
+    nThreads: Optional[int] = None
+    encoderProfile: Optional[str] = ""
     paragraphNumber: Optional[int] = 1
 
 
@@ -234,6 +235,57 @@ class BgmRetrieveResponse(BaseResponse):
         }
 
 
+class QueueStatusResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "workers": 5,
+                    "running": 2,
+                    "queue_depth": 3,
+                    "completed": 40,
+                    "failed": 1,
+                    "avg_wait_seconds": 12.5,
+                    "max_wait_seconds": 95.0,
+                    "stages": {
+                        "render": {
+                            "limit": 2,
+                            "running": 2,
+                            "waiting": 1,
+                            "completed": 17,
+                            "avg_wait_seconds": 30.2,
+                        },
+                    },
+                },
+            },
+        }
+
+
+class VoiceListResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "voices": [
+                        {
+                            "id": "en-US-JennyNeural-Female",
+                            "name": "en-US-JennyNeural",
+                            "gender": "Female",
+                            "provider": "azure-tts-v1",
+                            "locale": "en-US",
+                            "v2": False,
+                        }
+                    ],
+                    "total": 1,
+                },
+            },
+        }
+
+
 class BgmUploadResponse(BaseResponse):
     class Config:
         json_schema_extra = {
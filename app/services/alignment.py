@@ -0,0 +1,233 @@
+"""
+Alignment Module - Fast edit distance for matching script lines to transcripts
+Uses the bit-parallel Levenshtein algorithm (Myers 1999, Hyyrö 2001) on Python
+integers, so a whole column of the DP matrix is updated with a handful of
+integer operations, and a candidate string can be extended one character at a
+time without recomputing what was already aligned
+"""
+
+import random
+import re
+import string
+from timeit import default_timer as timer
+from typing import Dict, List
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+class IncrementalDistance:
+    """
+    Edit distance between a fixed pattern and a text that grows at the end
+    """
+
+    def __init__(self, pattern: str):
+        self.length = len(pattern)
+        self.full = (1 << self.length) - 1
+        self.last = 1 << (self.length - 1) if self.length else 0
+        self.peq: Dict[str, int] = {}
+        for i, c in enumerate(pattern):
+            self.peq[c] = self.peq.get(c, 0) | (1 << i)
+
+        self.vp = self.full
+        self.vn = 0
+        self.distance = self.length
+        self.text_length = 0
+
+    def copy(self) -> "IncrementalDistance":
+        clone = IncrementalDistance.__new__(IncrementalDistance)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def extend(self, text: str) -> int:
+        """
+        Append text and return the distance between the pattern and all text so far
+        """
+        self.text_length += len(text)
+        if not self.length:
+            self.distance = self.text_length
+            return self.distance
+
+        full, last, peq = self.full, self.last, self.peq
+        vp, vn, distance = self.vp, self.vn, self.distance
+        for c in text:
+            eq = peq.get(c, 0)
+            xv = eq | vn
+            xh = (((eq & vp) + vp) ^ vp) | eq
+            hp = vn | (~(xh | vp) & full)
+            hn = vp & xh
+            if hp & last:
+                distance += 1
+            elif hn & last:
+                distance -= 1
+            # the first row of the matrix grows by one per text character
+            hp = ((hp << 1) | 1) & full
+            hn = (hn << 1) & full
+            vp = hn | (~(xv | hp) & full)
+            vn = hp & xv
+
+        self.vp, self.vn, self.distance = vp, vn, distance
+        return distance
+
+    def similarity(self) -> float:
+        max_length = max(self.length, self.text_length)
+        if not max_length:
+            return 1.0
+        return 1 - (self.distance / max_length)
+
+
+def edit_distance(s1: str, s2: str) -> int:
+    """
+    Levenshtein distance between two strings
+    """
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    return IncrementalDistance(s2).extend(s1)
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Case-insensitive similarity between 0 and 1
+    """
+    max_length = max(len(a), len(b))
+    if not max_length:
+        return 1.0
+    return 1 - (edit_distance(a.lower(), b.lower()) / max_length)
+
+
+def normalize(text: str) -> str:
+    """
+    Lower case text with everything but letters and digits removed
+    """
+    return _NON_WORD.sub("", text).lower()
+
+
+def align_words_to_lines(words: List[str], lines: List[str], window: int = 64) -> List[int]:
+    """
+    Assign each spoken word to the script line it belongs to
+
+    Words and lines are compared as normalized character streams. Each word
+    is matched at the current script position, or resynced to the nearest
+    match within the next `window` characters when the TTS engine skipped
+    part of the script. Words that are not in the script at all (numbers
+    read out, expanded abbreviations) stay on the current line without
+    consuming script characters. The alignment never fails and runs in
+    linear time.
+
+    Args:
+        words: Word boundary texts in spoken order
+        lines: Script lines in order
+        window: Characters searched ahead for a resync
+
+    Returns:
+        Line index for every word
+    """
+    if not lines:
+        return [0] * len(words)
+
+    tokens = [normalize(line) for line in lines]
+    script = "".join(tokens)
+    line_ends = []
+    total = 0
+    for token in tokens:
+        total += len(token)
+        line_ends.append(total)
+
+    indexes = []
+    position = 0
+    line_index = 0
+    for word in words:
+        token = normalize(word)
+        matched = script.startswith(token, position)
+        if token and not matched:
+            found = script.find(token, position, position + window + len(token))
+            if found >= 0:
+                position = found
+                matched = True
+
+        while line_index < len(lines) - 1 and position >= line_ends[line_index]:
+            line_index += 1
+        indexes.append(line_index)
+        if matched:
+            position += len(token)
+    return indexes
+
+
+def _reference_distance(s1, s2):
+    # The plain O(n*m) dynamic program, kept for the benchmark
+    if len(s1) < len(s2):
+        return _reference_distance(s2, s1)
+    if len(s2) == 0:
+        return len(s1)
+    previous_row = range(len(s2) + 1)
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            current_row.append(min(previous_row[j + 1] + 1, current_row[j] + 1, previous_row[j] + (c1 != c2)))
+        previous_row = current_row
+    return previous_row[-1]
+
+
+def benchmark(minutes: int = 10, words_per_minute: int = 150, seed: int = 1):
+    """
+    Time the greedy subtitle merge of a synthetic script with both engines
+
+    Every script line is matched against a transcript split into a few
+    shorter, slightly misspelled pieces, the way whisper tends to split it
+
+    Run with: python -m app.services.alignment
+    """
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+             for _ in range(minutes * words_per_minute)]
+    lines = []
+    while words:
+        n = rng.randint(8, 20)
+        lines.append(" ".join(words[:n]))
+        words = words[n:]
+
+    def noisy(text):
+        chars = list(text)
+        for _ in range(max(1, len(chars) // 25)):
+            chars[rng.randrange(len(chars))] = rng.choice(string.ascii_lowercase)
+        return "".join(chars)
+
+    pieces = []
+    for line in lines:
+        tokens = line.split()
+        cut = rng.randint(1, len(tokens) - 1)
+        pieces.append([noisy(" ".join(tokens[:cut])), noisy(" ".join(tokens[cut:]))])
+
+    def reference_sim(a, b):
+        return 1 - _reference_distance(a, b) / max(len(a), len(b))
+
+    start = timer()
+    reference_scores = []
+    for line, parts in zip(lines, pieces):
+        combined = parts[0]
+        for part in parts[1:]:
+            if reference_sim(line, combined + " " + part) > reference_sim(line, combined):
+                combined += " " + part
+        reference_scores.append(reference_sim(line, combined))
+    reference_elapsed = timer() - start
+
+    start = timer()
+    scores = []
+    for line, parts in zip(lines, pieces):
+        aligner = IncrementalDistance(line)
+        aligner.extend(parts[0])
+        for part in parts[1:]:
+            candidate = aligner.copy()
+            candidate.extend(" " + part)
+            if candidate.similarity() > aligner.similarity():
+                aligner = candidate
+        scores.append(aligner.similarity())
+    elapsed = timer() - start
+
+    assert scores == reference_scores
+    print(f"{len(lines)} lines, {minutes} minute script")
+    print(f"reference dynamic program: {reference_elapsed:.3f} s")
+    print(f"bit-parallel incremental:  {elapsed:.3f} s ({reference_elapsed / elapsed:.0f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()
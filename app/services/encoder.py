@@ -0,0 +1,151 @@
+"""
+Encoder Module - Named x264 profiles shared by every ffmpeg invocation
+A profile sets the preset, CRF, threads, keyframe interval and faststart for
+the final encode and for the intermediate segments, so a task can trade CPU
+time for file size deliberately
+"""
+
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+
+PROFILE_DRAFT = "draft"
+PROFILE_BALANCED = "balanced"
+PROFILE_ARCHIVE = "archive"
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    PROFILE_DRAFT: {
+        "preset": "ultrafast",
+        "crf": 28,
+        "intermediate_preset": "ultrafast",
+        "intermediate_crf": 23,
+    },
+    PROFILE_BALANCED: {
+        "preset": "medium",
+        "crf": 23,
+        "intermediate_preset": "ultrafast",
+        "intermediate_crf": 18,
+    },
+    PROFILE_ARCHIVE: {
+        "preset": "slow",
+        "crf": 18,
+        "intermediate_preset": "veryfast",
+        "intermediate_crf": 14,
+        "lossless_intermediates": True,
+    },
+}
+
+
+class EncoderProfile:
+    """
+    x264 settings for one task
+
+    Intermediates are encoded again by the final render, so they use a faster
+    preset with a lower CRF to keep the generation loss small. Lossless
+    intermediates skip that loss entirely, at the cost of about 5.5x the
+    intermediate I/O and slightly more CPU than the lossy ultrafast preset
+    """
+
+    def __init__(self, name: str, preset: str = "medium", crf: int = 23,
+                 intermediate_preset: str = "ultrafast", intermediate_crf: int = 18,
+                 threads: int = 0, keyint: float = 2.0, tune: str = "",
+                 faststart: bool = True, lossless_intermediates: bool = False):
+        """
+        Args:
+            name: Profile name
+            preset: x264 preset of the final encode
+            crf: Constant rate factor of the final encode
+            intermediate_preset: x264 preset of trimmed and resized segments
+            intermediate_crf: Constant rate factor of trimmed and resized segments
+            threads: x264 threads, 0 lets x264 decide
+            keyint: Keyframe interval in seconds, 0 keeps the x264 default
+            tune: x264 tune (optional)
+            faststart: Move the moov atom to the front of the final file
+            lossless_intermediates: Encode intermediates with ultrafast -qp 0
+        """
+        self.name = name
+        self.preset = preset
+        self.crf = crf
+        self.intermediate_preset = intermediate_preset
+        self.intermediate_crf = intermediate_crf
+        self.threads = threads
+        self.keyint = keyint
+        self.tune = tune
+        self.faststart = faststart
+        self.lossless_intermediates = lossless_intermediates
+
+    def video_args(self, intermediate: bool = False, lossless: Optional[bool] = None) -> List[str]:
+        """
+        Output arguments for an x264 encode
+
+        Args:
+            intermediate: Encode a segment that is rendered again later
+            lossless: Override lossless_intermediates, for intermediates that
+                have to stay stream compatible with lossy parts
+
+        Returns:
+            ffmpeg arguments, to be placed before the output file
+        """
+        if lossless is None:
+            lossless = self.lossless_intermediates
+        if intermediate and lossless:
+            args = ["-c:v", "libx264", "-preset", "ultrafast", "-qp", "0"]
+        else:
+            args = [
+                "-c:v", "libx264",
+                "-preset", self.intermediate_preset if intermediate else self.preset,
+                "-crf", str(self.intermediate_crf if intermediate else self.crf),
+            ]
+        if self.tune:
+            args.extend(["-tune", self.tune])
+        if self.threads:
+            args.extend(["-threads", str(self.threads)])
+        if self.keyint:
+            # in seconds so it holds for any frame rate
+            args.extend(["-force_key_frames", f"expr:gte(t,n_forced*{self.keyint})"])
+        # intermediates are never streamed, rewriting them for faststart is wasted I/O
+        if self.faststart and not intermediate:
+            args.extend(["-movflags", "+faststart"])
+        return args
+
+    def cache_key(self) -> str:
+        """
+        Identifies the intermediate encode settings, segments encoded with
+        other settings are not interchangeable
+        """
+        if self.lossless_intermediates:
+            return f"lossless:{self.keyint}"
+        return f"{self.intermediate_preset}:{self.intermediate_crf}:{self.keyint}:{self.tune}"
+
+    def __str__(self):
+        return f"EncoderProfile(name={self.name}, preset={self.preset}, crf={self.crf}, threads={self.threads})"
+
+
+def get_profile(name: str = "", threads: Optional[int] = None) -> EncoderProfile:
+    """
+    Build a profile from the built-in presets and the encoder_profiles overrides in config.toml
+
+    Args:
+        name: Profile name, falls back to the encoder_profile setting
+        threads: x264 threads, overrides the profile when set
+
+    Returns:
+        The EncoderProfile, the default one when the name is unknown
+    """
+    default_name = config.app.get("encoder_profile", PROFILE_BALANCED)
+    profiles = {key: dict(value) for key, value in PROFILES.items()}
+    for key, value in config.app.get("encoder_profiles", {}).items():
+        profiles.setdefault(key, {}).update(value)
+
+    name = name or default_name
+    if name not in profiles:
+        logger.warning(f"unknown encoder profile: {name}, using {default_name}")
+        name = default_name
+
+    settings = profiles.get(name, profiles[PROFILE_BALANCED])
+    profile = EncoderProfile(name, **settings)
+    if threads:
+        profile.threads = threads
+    return profile
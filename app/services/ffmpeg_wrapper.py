@@ -3,15 +3,25 @@ FFmpeg Wrapper Module - Direct FFmpeg operations for video processing
 Provides a more efficient alternative to MoviePy by using FFmpeg directly
 """
 
-import json
 import os
-import shutil
 import subprocess
-import tempfile
-from typing import List, Dict, Any, Optional, Tuple, Union
+from fractions import Fraction
+from typing import List, Dict, Any, Optional, Tuple
 
 from loguru import logger
 
+from app.services import probe_cache
+from app.services.encoder import EncoderProfile, get_profile
+
+# ffprobe H.264 profile names and the x264 profile producing compatible streams
+X264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
+
+
 class FFmpegWrapper:
     """
     Wrapper around FFmpeg command line tools for efficient video processing
@@ -20,7 +30,8 @@ class FFmpegWrapper:
     @staticmethod
     def probe(file_path: str) -> Dict[str, Any]:
         """
-        Get video/audio file metadata using ffprobe
+        Get video/audio file metadata using ffprobe, served from the probe
+        cache when the file is unchanged
         
         Args:
             file_path: Path to the video/audio file
@@ -28,20 +39,7 @@ class FFmpegWrapper:
         Returns:
             Dictionary containing file metadata
         """
-        cmd = [
-            "ffprobe", "-v", "quiet", "-print_format", "json",
-            "-show_format", "-show_streams", file_path
-        ]
-        
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            return json.loads(result.stdout)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error probing file {file_path}: {e.stderr}")
-            raise RuntimeError(f"Error probing file: {e.stderr}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing ffprobe output: {e}")
-            raise RuntimeError(f"Error parsing ffprobe output: {e}")
+        return probe_cache.probe(file_path)
     
     @staticmethod
     def get_video_duration(file_path: str) -> float:
@@ -84,7 +82,8 @@ class FFmpegWrapper:
     
     @staticmethod
     def trim_video(input_file: str, output_file: str, start_time: float, 
-                   duration: Optional[float] = None, fast_seek: bool = True) -> bool:
+                   duration: Optional[float] = None, fast_seek: bool = True,
+                   profile: Optional[EncoderProfile] = None) -> bool:
         """
         Cut a segment from a video file
         
@@ -94,6 +93,7 @@ class FFmpegWrapper:
             start_time: Start time in seconds
             duration: Duration in seconds (optional)
             fast_seek: Use faster seeking method
+            profile: Encoder profile (optional)
             
         Returns:
             True if successful, False otherwise
@@ -113,12 +113,9 @@ class FFmpegWrapper:
         if duration:
             cmd.extend(["-t", str(duration)])
             
-        # Copy streams without re-encoding for speed
-        cmd.extend([
-            "-c:v", "libx264", "-preset", "ultrafast",
-            "-c:a", "aac", 
-            output_file
-        ])
+        # Re-encode with the intermediate preset so cuts are frame accurate
+        cmd.extend((profile or get_profile()).video_args(intermediate=True))
+        cmd.extend(["-c:a", "aac", output_file])
         
         try:
             subprocess.run(cmd, check=True)
@@ -127,9 +124,195 @@ class FFmpegWrapper:
             logger.error(f"Error trimming video: {e}")
             return False
     
+    @staticmethod
+    def get_video_stream(file_path: str) -> Dict[str, Any]:
+        """
+        Get the metadata of the first video stream of a file
+        
+        Args:
+            file_path: Path to the video file
+            
+        Returns:
+            Stream metadata, empty if the file has no video stream
+        """
+        try:
+            info = FFmpegWrapper.probe(file_path)
+            for stream in info["streams"]:
+                if stream["codec_type"] == "video":
+                    return stream
+        except (KeyError, RuntimeError) as e:
+            logger.error(f"Error getting video stream: {e}")
+        return {}
+    
+    @staticmethod
+    def get_keyframes(file_path: str) -> List[float]:
+        """
+        Get the keyframe timestamps of the first video stream
+        
+        Packets are read without decoding, so this is cheap even for long files
+        
+        Args:
+            file_path: Path to the video file
+            
+        Returns:
+            Sorted list of keyframe timestamps in seconds
+        """
+        return probe_cache.get_keyframes(file_path)
+    
+    @staticmethod
+    def is_stream_copy_compatible(file_path: str, width: int, height: int) -> bool:
+        """
+        Check whether a video can be cut with stream copy for a width x height output
+        
+        Args:
+            file_path: Path to the video file
+            width: Target width
+            height: Target height
+            
+        Returns:
+            True if the video is H.264 at exactly the target resolution
+        """
+        stream = FFmpegWrapper.get_video_stream(file_path)
+        if not stream:
+            return False
+        return (
+            stream.get("codec_name") == "h264"
+            and int(stream.get("width", 0)) == width
+            and int(stream.get("height", 0)) == height
+        )
+    
+    @staticmethod
+    def smart_trim_video(input_file: str, output_file: str, start_time: float,
+                         duration: float, width: int, height: int,
+                         profile: Optional[EncoderProfile] = None) -> bool:
+        """
+        Cut a segment on GOP boundaries with stream copy and only re-encode
+        the partial GOPs at the edges (smart-cut). The output has no audio.
+        
+        The cut points are counted in frames, so the segment holds exactly
+        the frames of the requested range. The edges are encoded with the
+        source's H.264 profile and level, and every part carries its SPS/PPS
+        in-band (Annex B), so the copied GOPs never decode with the
+        parameter sets of an edge. The decode timestamps are rebuilt from the
+        frame count after joining, so they stay monotonic across the seams.
+        
+        Falls back to trim_video when the source does not match the target
+        codec and resolution, has no frame rate or an H.264 profile x264
+        cannot produce, or when the segment holds no complete GOP.
+        
+        Args:
+            input_file: Input video file path
+            output_file: Output video file path
+            start_time: Start time in seconds
+            duration: Duration in seconds
+            width: Target width
+            height: Target height
+            profile: Encoder profile of the re-encoded edges (optional)
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        def fallback() -> bool:
+            return FFmpegWrapper.trim_video(input_file, output_file, start_time, duration, profile=profile)
+        
+        if not FFmpegWrapper.is_stream_copy_compatible(input_file, width, height):
+            return fallback()
+        
+        stream = FFmpegWrapper.get_video_stream(input_file)
+        x264_profile = X264_PROFILES.get(stream.get("profile", ""))
+        try:
+            fps = Fraction(stream.get("avg_frame_rate", "0"))
+        except (ValueError, ZeroDivisionError):
+            fps = Fraction(0)
+        if not x264_profile or fps <= 0:
+            return fallback()
+        
+        # frame numbers, the frame at start_time is the first one kept and the one at end_time the first one dropped
+        first_frame = round(start_time * fps)
+        end_frame = round((start_time + duration) * fps)
+        keyframes = sorted({round(k * fps) for k in FFmpegWrapper.get_keyframes(input_file)})
+        inner = [k for k in keyframes if first_frame <= k <= end_frame]
+        if len(inner) < 2:
+            return fallback()
+        copy_start, copy_end = inner[0], inner[-1]
+        
+        # the edges are joined with the copied lossy GOPs, so they stay lossy
+        encode_args = (profile or get_profile()).video_args(intermediate=True, lossless=False) + [
+            "-pix_fmt", stream.get("pix_fmt", "yuv420p"),
+            "-profile:v", x264_profile,
+            "-bsf:v", "dump_extra=freq=keyframe",
+        ]
+        if stream.get("level", 0) > 0:
+            encode_args.extend(["-level", f"{stream['level'] / 10:.1f}"])
+        # edges without B-frames never reorder more than the copied GOPs
+        encode_args.extend(["-bf", "0"])
+        # one frame more than the source's reorder depth keeps every dts below its pts
+        dts_delay = int(stream.get("has_b_frames", 0)) + 1
+        
+        def seek_args(frame: float) -> List[str]:
+            return ["-ss", f"{max(0.0, float(frame / fps)):.6f}", "-i", input_file]
+        
+        base_cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+        # (file, frames) of every part, NUT keeps the Annex B packets with their timestamps
+        parts = []
+        commands = []
+        
+        if copy_start > first_frame:
+            head_file = f"{output_file}.head.nut"
+            # half a frame early so rounding never skips the first frame
+            commands.append(base_cmd + seek_args(first_frame - 0.5) + [
+                "-an", "-frames:v", str(copy_start - first_frame),
+            ] + encode_args + ["-f", "nut", head_file])
+            parts.append((head_file, copy_start - first_frame))
+        
+        middle_file = f"{output_file}.middle.nut"
+        # half a frame late, a stream copy starts at the keyframe before the seek point
+        commands.append(base_cmd + seek_args(copy_start + 0.5) + [
+            "-an", "-frames:v", str(copy_end - copy_start),
+            "-c:v", "copy", "-bsf:v", "h264_mp4toannexb",
+            "-f", "nut", middle_file
+        ])
+        parts.append((middle_file, copy_end - copy_start))
+        
+        if end_frame > copy_end:
+            tail_file = f"{output_file}.tail.nut"
+            commands.append(base_cmd + seek_args(copy_end - 0.5) + [
+                "-an", "-frames:v", str(end_frame - copy_end),
+            ] + encode_args + ["-f", "nut", tail_file])
+            parts.append((tail_file, end_frame - copy_end))
+        
+        # the concat demuxer places each part at the given duration, not at its probed length
+        list_file = f"{output_file}.parts.txt"
+        with open(list_file, "w", encoding="utf-8") as f:
+            for part_file, frames in parts:
+                f.write(f"file '{os.path.abspath(part_file)}'\nduration {float(frames / fps):.6f}\n")
+        commands.append(base_cmd + [
+            "-f", "concat", "-safe", "0", "-i", list_file,
+            "-c", "copy",
+            "-bsf:v", f"setts=pts=PTS:dts=round((N-{dts_delay})*{fps.denominator}/({fps.numerator}*TB))",
+            output_file
+        ])
+        
+        try:
+            for cmd in commands:
+                subprocess.run(cmd, check=True)
+            
+            logger.debug(
+                f"Smart-cut {input_file}: copied {copy_end - copy_start} of {end_frame - first_frame} frames"
+            )
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error smart-cutting video: {e}")
+            return fallback()
+        finally:
+            for file_path in [list_file] + [part_file for part_file, _ in parts]:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+    
     @staticmethod
     def resize_video(input_file: str, output_file: str, width: int, height: int, 
-                    maintain_aspect_ratio: bool = True, pad: bool = True) -> bool:
+                    maintain_aspect_ratio: bool = True, pad: bool = True,
+                    profile: Optional[EncoderProfile] = None) -> bool:
         """
         Resize a video to specified dimensions
         
@@ -140,6 +323,7 @@ class FFmpegWrapper:
             height: Target height
             maintain_aspect_ratio: Whether to maintain the aspect ratio
             pad: Whether to pad the video to the target dimensions
+            profile: Encoder profile (optional)
             
         Returns:
             True if successful, False otherwise
@@ -156,7 +340,7 @@ class FFmpegWrapper:
             "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
             "-i", input_file,
             "-vf", filter_complex,
-            "-c:v", "libx264", "-preset", "ultrafast", 
+        ] + (profile or get_profile()).video_args(intermediate=True) + [
             "-c:a", "copy",
             output_file
         ]
@@ -229,20 +413,59 @@ class FFmpegWrapper:
             # Clean up the temporary list file
             if os.path.exists(list_file):
                 os.remove(list_file)
-    
+
     @staticmethod
-    def add_subtitles(video_file: str, subtitle_file: str, output_file: str, 
-                     font: str = "", font_size: int = 24, 
-                     font_color: str = "white", position: str = "bottom",
-                     outline_color: str = "black", outline_width: float = 1.0,
-                     background_color: str = "") -> bool:
+    def concat_audio(input_files: List[str], output_file: str) -> bool:
         """
-        Add subtitles to a video file
+        Concatenate audio files that share a codec without re-encoding
+
+        Args:
+            input_files: List of input audio file paths
+            output_file: Output audio file path
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not input_files:
+            logger.error("No input files provided for concatenation")
+            return False
+
+        list_file = f"{output_file}.concat.txt"
+
+        try:
+            with open(list_file, "w") as f:
+                for file_path in input_files:
+                    f.write(f"file '{os.path.abspath(file_path)}'\n")
+
+            cmd = [
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0",
+                "-i", list_file,
+                "-map", "0:a", "-c", "copy",
+                output_file
+            ]
+
+            subprocess.run(cmd, check=True)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error concatenating audio: {e}")
+            return False
+        finally:
+            if os.path.exists(list_file):
+                os.remove(list_file)
+
+    @staticmethod
+    def build_subtitle_style(width: int, height: int, font: str = "", font_size: int = 24,
+                             font_color: str = "white", position: str = "bottom",
+                             outline_color: str = "black", outline_width: float = 1.0,
+                             background_color: str = "") -> Tuple[str, int]:
+        """
+        Build the libass force_style string used when burning subtitles
         
         Args:
-            video_file: Input video file path
-            subtitle_file: Subtitle file path (srt format)
-            output_file: Output video file path
+            width: Video width
+            height: Video height
             font: Font name
             font_size: Font size
             font_color: Font color (hex or named color)
@@ -252,19 +475,8 @@ class FFmpegWrapper:
             background_color: Background color (optional)
             
         Returns:
-            True if successful, False otherwise
+            Tuple of (style, adjusted font size)
         """
-        logger.info(f"Adding subtitles: font={font}, size={font_size}, position={position}")
-        
-        # Verify files exist
-        if not os.path.exists(video_file):
-            logger.error(f"Input video file not found: {video_file}")
-            return False
-            
-        if not os.path.exists(subtitle_file):
-            logger.error(f"Subtitle file not found: {subtitle_file}")
-            return False
-            
         # Set alignment based on position
         alignment = "2"  # Default: bottom center
         if position == "top":
@@ -274,16 +486,15 @@ class FFmpegWrapper:
         
         # Scale font size based on video resolution (assuming height is usually 1080 or 1920)
         # For 1080p, font_size is used as-is; for higher resolutions, we scale proportionally
-        actual_width, actual_height = FFmpegWrapper.get_video_dimensions(video_file)
-        if actual_height <= 0:
-            actual_height = 1080  # Default to 1080p if we can't get dimensions
+        if height <= 0:
+            height = 1080  # Default to 1080p if we can't get dimensions
             
         # Adjust font size based on video resolution - use much smaller base size
         # Use a maximum of 24 points for 1080p video, scale down for larger resolutions
         base_size = 24  # Base size for 1080p
         # Hard limit the font size to reasonable values regardless of input
-        adjusted_font_size = min(font_size // 3, int(base_size * (actual_height / 1080)))
-        logger.info(f"Adjusted font size from {font_size} to {adjusted_font_size} for {actual_width}x{actual_height} video")
+        adjusted_font_size = min(font_size // 3, int(base_size * (height / 1080)))
+        logger.info(f"Adjusted font size from {font_size} to {adjusted_font_size} for {width}x{height} video")
         
         # Limit outline width to a reasonable value
         adjusted_outline_width = min(outline_width, 0.8)
@@ -301,6 +512,52 @@ class FFmpegWrapper:
             # No background, just outline
             style += ",BorderStyle=1,Shadow=0"
 
+        return style, adjusted_font_size
+    
+    @staticmethod
+    def add_subtitles(video_file: str, subtitle_file: str, output_file: str, 
+                     font: str = "", font_size: int = 24, 
+                     font_color: str = "white", position: str = "bottom",
+                     outline_color: str = "black", outline_width: float = 1.0,
+                     background_color: str = "",
+                     profile: Optional[EncoderProfile] = None) -> bool:
+        """
+        Add subtitles to a video file
+        
+        Args:
+            video_file: Input video file path
+            subtitle_file: Subtitle file path (srt format)
+            output_file: Output video file path
+            font: Font name
+            font_size: Font size
+            font_color: Font color (hex or named color)
+            position: Subtitle position (top, bottom, center)
+            outline_color: Outline color
+            outline_width: Outline width
+            background_color: Background color (optional)
+            profile: Encoder profile (optional)
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        logger.info(f"Adding subtitles: font={font}, size={font_size}, position={position}")
+        profile = profile or get_profile()
+        
+        # Verify files exist
+        if not os.path.exists(video_file):
+            logger.error(f"Input video file not found: {video_file}")
+            return False
+            
+        if not os.path.exists(subtitle_file):
+            logger.error(f"Subtitle file not found: {subtitle_file}")
+            return False
+            
+        actual_width, actual_height = FFmpegWrapper.get_video_dimensions(video_file)
+        style, adjusted_font_size = FFmpegWrapper.build_subtitle_style(
+            actual_width, actual_height, font, font_size, font_color, position,
+            outline_color, outline_width, background_color
+        )
+
         # Create a temporary subtitle filter file
         temp_dir = os.path.dirname(output_file)
         filter_file = os.path.join(temp_dir, "subtitle_filter.txt")
@@ -316,7 +573,7 @@ class FFmpegWrapper:
                 "ffmpeg", "-y", "-hide_banner", "-loglevel", "info",
                 "-i", video_file,
                 "-filter_complex_script", filter_file,
-                "-c:v", "libx264", "-preset", "medium", 
+            ] + profile.video_args() + [
                 "-c:a", "copy",
                 output_file
             ]
@@ -330,14 +587,14 @@ class FFmpegWrapper:
             if process.returncode != 0:
                 logger.error(f"Error adding subtitles: {process.stderr}")
                 # Try alternative hard-coded subtitle
-                return FFmpegWrapper._add_subtitles_hardcoded(video_file, subtitle_file, output_file, font, adjusted_font_size, font_color, position)
+                return FFmpegWrapper._add_subtitles_hardcoded(video_file, subtitle_file, output_file, font, adjusted_font_size, font_color, position, profile)
             
             return True
             
         except Exception as e:
             logger.error(f"Error adding subtitles: {e}")
             # Try alternative approach
-            return FFmpegWrapper._add_subtitles_hardcoded(video_file, subtitle_file, output_file, font, adjusted_font_size, font_color, position)
+            return FFmpegWrapper._add_subtitles_hardcoded(video_file, subtitle_file, output_file, font, adjusted_font_size, font_color, position, profile)
         finally:
             if os.path.exists(filter_file):
                 os.remove(filter_file)
@@ -345,9 +602,11 @@ class FFmpegWrapper:
     @staticmethod
     def _add_subtitles_hardcoded(video_file: str, subtitle_file: str, output_file: str,
                               font: str = "", font_size: int = 24,
-                              font_color: str = "white", position: str = "bottom") -> bool:
+                              font_color: str = "white", position: str = "bottom",
+                              profile: Optional[EncoderProfile] = None) -> bool:
         """Fallback method for adding subtitles using direct subtitle burning"""
         logger.info("Trying alternative subtitle method with hardcoded subtitles")
+        profile = profile or get_profile()
         
         # Reduce font size to ensure it's not too large
         # Use a very conservative size (16-20pt is good for most videos)
@@ -392,7 +651,7 @@ class FFmpegWrapper:
                 "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
                 "-i", video_file,
                 "-vf", f"ass={temp_srt}",
-                "-c:v", "libx264", "-preset", "medium",
+            ] + profile.video_args() + [
                 "-c:a", "copy",
                 output_file
             ]
@@ -414,7 +673,7 @@ class FFmpegWrapper:
                     "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
                     "-i", video_file,
                     "-vf", f"subtitles={subtitle_file}:force_style='FontSize={min(16, adjusted_font_size)}'",
-                    "-c:v", "libx264", "-preset", "medium",
+                ] + profile.video_args() + [
                     "-c:a", "copy",
                     output_file
                 ]
@@ -495,7 +754,8 @@ class FFmpegWrapper:
     
     @staticmethod
     def add_zoom_effect(image_file: str, output_file: str, duration: int = 5, 
-                       zoom_factor: float = 1.2) -> bool:
+                       zoom_factor: float = 1.2,
+                       profile: Optional[EncoderProfile] = None) -> bool:
         """
         Create a video with zoom effect from a static image
         
@@ -504,6 +764,7 @@ class FFmpegWrapper:
             output_file: Output video file path
             duration: Video duration in seconds
             zoom_factor: Final zoom factor
+            profile: Encoder profile (optional)
             
         Returns:
             True if successful, False otherwise
@@ -517,7 +778,8 @@ class FFmpegWrapper:
             "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
             "-loop", "1", "-i", image_file, "-t", str(duration),
             "-vf", f"zoompan=z='min({zoom_start}+(in/{duration*25})*{zoom_end-zoom_start},{zoom_end})':d=1:s=1920x1080",
-            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-r", "30",
+        ] + (profile or get_profile()).video_args() + [
+            "-pix_fmt", "yuv420p", "-r", "30",
             output_file
         ]
         
@@ -530,7 +792,8 @@ class FFmpegWrapper:
     
     @staticmethod
     def apply_transition(input_file: str, output_file: str, 
-                        transition_type: str = "fade", duration: float = 1.0) -> bool:
+                        transition_type: str = "fade", duration: float = 1.0,
+                        profile: Optional[EncoderProfile] = None) -> bool:
         """
         Apply transition effect to a video
         
@@ -539,6 +802,7 @@ class FFmpegWrapper:
             output_file: Output video file path
             transition_type: Type of transition (fade, fadein, fadeout, slide)
             duration: Transition duration in seconds
+            profile: Encoder profile (optional)
             
         Returns:
             True if successful, False otherwise
@@ -554,7 +818,9 @@ class FFmpegWrapper:
             fade_start = max(0, video_duration - duration)
             filter_complex = f"fade=t=out:st={fade_start}:d={duration}"
         elif transition_type == "fade":
-            filter_complex = f"fade=t=in:st=0:d={duration},fade=t=out:st=outpts-{duration}:d={duration}"
+            video_duration = FFmpegWrapper.get_video_duration(input_file)
+            fade_start = max(0, video_duration - duration)
+            filter_complex = f"fade=t=in:st=0:d={duration},fade=t=out:st={fade_start}:d={duration}"
         
         if not filter_complex:
             logger.error(f"Unsupported transition type: {transition_type}")
@@ -564,6 +830,7 @@ class FFmpegWrapper:
             "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
             "-i", input_file,
             "-vf", filter_complex,
+        ] + (profile or get_profile()).video_args(intermediate=True) + [
             "-c:a", "copy",
             output_file
         ]
@@ -574,129 +841,3 @@ class FFmpegWrapper:
         except subprocess.CalledProcessError as e:
             logger.error(f"Error applying transition: {e}")
             return False
-    
-    @staticmethod
-    def generate_video_from_script(
-        video_clips: List[str],
-        audio_file: str,
-        subtitle_file: str,
-        output_file: str,
-        width: int = 1080,
-        height: int = 1920,
-        max_clip_duration: int = 5,
-        font: str = "",
-        font_size: int = 60,
-        font_color: str = "#FFFFFF",
-        subtitle_position: str = "bottom",
-        outline_color: str = "#000000",
-        outline_width: float = 1.5,
-        background_music: str = "",
-        voice_volume: float = 1.0,
-        bgm_volume: float = 0.3
-    ) -> bool:
-        """
-        Generate a complete video from script and clips
-        
-        Args:
-            video_clips: List of video clip paths
-            audio_file: Audio file path
-            subtitle_file: Subtitle file path
-            output_file: Output video file path
-            width: Video width
-            height: Video height
-            max_clip_duration: Maximum duration for each clip in seconds
-            font: Font name for subtitles
-            font_size: Font size for subtitles
-            font_color: Font color for subtitles
-            subtitle_position: Subtitle position
-            outline_color: Outline color for subtitles
-            outline_width: Outline width for subtitles
-            background_music: Background music file path (optional)
-            voice_volume: Voice volume factor
-            bgm_volume: Background music volume factor
-            
-        Returns:
-            True if successful, False otherwise
-        """
-        if not video_clips:
-            logger.error("No video clips provided")
-            return False
-            
-        # Create temporary directory for intermediate files
-        temp_dir = os.path.dirname(output_file)
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        try:
-            # 1. Process and prepare all clips
-            processed_clips = []
-            
-            for i, clip_path in enumerate(video_clips):
-                # a. Trim clip if needed
-                duration = min(FFmpegWrapper.get_video_duration(clip_path), max_clip_duration)
-                if duration <= 0:
-                    continue
-                    
-                trimmed_clip = os.path.join(temp_dir, f"trimmed_{i}.mp4")
-                if not FFmpegWrapper.trim_video(clip_path, trimmed_clip, 0, duration):
-                    continue
-                
-                # b. Resize clip
-                resized_clip = os.path.join(temp_dir, f"resized_{i}.mp4")
-                if not FFmpegWrapper.resize_video(trimmed_clip, resized_clip, width, height):
-                    continue
-                
-                processed_clips.append(resized_clip)
-            
-            if not processed_clips:
-                logger.error("No valid clips after processing")
-                return False
-                
-            # 2. Concatenate clips
-            combined_video = os.path.join(temp_dir, "combined.mp4")
-            if not FFmpegWrapper.concat_videos(processed_clips, combined_video):
-                return False
-                
-            # 3. Add audio/music and subtitles
-            with_audio = os.path.join(temp_dir, "with_audio.mp4")
-            
-            if background_music and os.path.exists(background_music):
-                # Add voice and background music
-                logger.info(f"Adding background music: {background_music}")
-                if not FFmpegWrapper.add_background_music(
-                    combined_video, audio_file, background_music, 
-                    with_audio, voice_volume, bgm_volume
-                ):
-                    return False
-            else:
-                # Add just the voice audio
-                logger.info("Adding voice audio without background music")
-                if not FFmpegWrapper.add_audio(combined_video, audio_file, with_audio, voice_volume):
-                    return False
-            
-            # Always add subtitles as a final step
-            if subtitle_file and os.path.exists(subtitle_file):
-                logger.info(f"Adding subtitles with font: {font}, size: {font_size}, position: {subtitle_position}")
-                return FFmpegWrapper.add_subtitles(
-                    with_audio, subtitle_file, output_file,
-                    font, font_size, font_color, subtitle_position,
-                    outline_color, outline_width
-                )
-            else:
-                # Just use the audio version if no subtitles
-                logger.warning("No subtitle file found, copying audio version as final output")
-                shutil.copy(with_audio, output_file)
-                return True
-                    
-        except Exception as e:
-            logger.error(f"Error generating video: {e}")
-            return False
-        finally:
-            # Clean up temporary files
-            for pattern in ["trimmed_*.mp4", "resized_*.mp4", "combined.mp4", "with_audio.mp4"]:
-                for file in [f for f in os.listdir(temp_dir) if f.startswith(pattern.replace("*", ""))]:
-                    try:
-                        os.remove(os.path.join(temp_dir, file))
-                    except:
-                        pass
-        
-        return True 
\ No newline at end of file
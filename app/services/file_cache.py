@@ -0,0 +1,180 @@
+"""
+File Cache Module - Content-addressed on-disk caches under storage/
+Entries are written atomically and evicted least-recently-used first once the
+cache grows beyond its size limit
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+
+from app.utils import utils
+
+# Entries used this recently are never evicted, covers the gap between a lookup
+# in another process and its use, long readers in this process pin their entries
+EVICTION_GRACE_SECONDS = 60
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+_fingerprints = {}
+
+
+def fingerprint_file(file_path: str) -> str:
+    """
+    Hash a file by its size and its first and last megabyte
+
+    Args:
+        file_path: Path to the file
+
+    Returns:
+        Hex digest identifying the file content
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _fingerprints:
+        return _fingerprints[memo_key]
+
+    size = stat.st_size
+    digest = hashlib.md5(str(size).encode("utf-8"))
+    with open(file_path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+        if size > FINGERPRINT_SAMPLE_SIZE:
+            f.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+            digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+
+    _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def make_key(*parts) -> str:
+    return utils.md5("|".join(str(part) for part in parts))
+
+
+class FileCache:
+    """
+    Size-bounded LRU cache of files stored in one directory
+    """
+
+    def __init__(self, name: str, max_size_mb: int = 2048):
+        """
+        Args:
+            name: Sub directory of storage/ holding the entries
+            max_size_mb: Total size the cache is trimmed back to after each write
+        """
+        self.cache_dir = utils.storageDir(name, create=True)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.pins: Dict[str, int] = {}
+
+    def path_for(self, key: str, suffix: str = ".mp4") -> str:
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+
+    def get(self, key: str, suffix: str = ".mp4", pin: bool = False) -> Optional[str]:
+        """
+        Look up an entry and mark it as recently used
+
+        Args:
+            key: Cache key
+            suffix: File extension of the entry
+            pin: Keep the entry from being evicted until unpin() is called
+
+        Returns:
+            Path of the cached file, or None on a miss
+        """
+        path = self.path_for(key, suffix)
+        with self.lock:
+            try:
+                if os.path.getsize(path) > 0:
+                    os.utime(path)
+                    if pin:
+                        self.pins[path] = self.pins.get(path, 0) + 1
+                    return path
+            except OSError:
+                pass
+        return None
+
+    def unpin(self, path: str):
+        with self.lock:
+            count = self.pins.get(path, 0) - 1
+            if count > 0:
+                self.pins[path] = count
+            else:
+                self.pins.pop(path, None)
+
+    def touch(self, path: str):
+        """
+        Mark an entry as recently used, so other processes sharing the cache keep it
+        """
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def put(self, key: str, file_path: str, suffix: str = ".mp4", move: bool = True,
+            pin: bool = False) -> str:
+        """
+        Store a file in the cache atomically
+
+        Args:
+            key: Cache key
+            file_path: File to store
+            suffix: File extension of the entry
+            move: Move the file into the cache instead of copying it
+            pin: Keep the entry from being evicted until unpin() is called
+
+        Returns:
+            Path of the cached file
+        """
+        path = self.path_for(key, suffix)
+        temp_path = f"{path}.{utils.getUuid(True)}.tmp"
+        try:
+            if move:
+                shutil.move(file_path, temp_path)
+            else:
+                shutil.copyfile(file_path, temp_path)
+            os.replace(temp_path, path)
+            if pin:
+                with self.lock:
+                    self.pins[path] = self.pins.get(path, 0) + 1
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its size limit
+        """
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            if total <= self.max_size:
+                return
+
+            now = time.time()
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if now - mtime < EVICTION_GRACE_SECONDS:
+                    break
+                if path in self.pins:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.debug(f"evicted cache entry: {path}")
+                except OSError as e:
+                    logger.warning(f"failed to evict cache entry {path}: {str(e)}")
@@ -0,0 +1,121 @@
+"""
+Manifest Module - Per-task record of the finished pipeline stages
+Each stage stores the hash of its inputs, its outputs and the checksums of the
+files it wrote, so a retried task skips every stage that is still valid
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.utils import utils
+
+MANIFEST_FILE = "manifest.json"
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+_checksums = {}
+
+
+def checksum_file(file_path: str) -> str:
+    """
+    SHA-256 of a file, memoized while its size and mtime stay the same
+    """
+    stat = os.stat(file_path)
+    memo_key = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _checksums:
+        return _checksums[memo_key]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            digest.update(block)
+
+    _checksums[memo_key] = digest.hexdigest()
+    return _checksums[memo_key]
+
+
+def hash_inputs(inputs: Dict[str, Any]) -> str:
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TaskManifest:
+    """
+    manifest.json in a task directory
+
+    A stage entry holds the inputs hash, the outputs and the checksum of
+    every file it produced. The digest of an entry covers the inputs and
+    the file checksums, later stages put it in their inputs so that
+    redoing a stage invalidates everything after it
+    """
+
+    def __init__(self, task_id: str):
+        self.path = os.path.join(utils.taskDir(task_id), MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.verified: Dict[str, bool] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.stages = json.load(f).get("stages", {})
+        except (OSError, ValueError):
+            self.stages = {}
+
+    def digest(self, stage: str) -> str:
+        entry = self.stages.get(stage)
+        return entry["digest"] if entry else ""
+
+    def lookup(self, stage: str, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Outputs of a stage that ran with the same inputs and whose files are intact
+
+        Returns:
+            The recorded outputs, or None when the stage has to run again
+        """
+        entry = self.stages.get(stage)
+        if not entry or entry["inputs"] != hash_inputs(inputs):
+            return None
+
+        if entry["digest"] not in self.verified:
+            self.verified[entry["digest"]] = self._verify(stage, entry["files"])
+        return entry["outputs"] if self.verified[entry["digest"]] else None
+
+    def _verify(self, stage: str, files: Dict[str, Dict[str, Any]]) -> bool:
+        for file_path, expected in files.items():
+            try:
+                if os.path.getsize(file_path) != expected["size"] or checksum_file(file_path) != expected["sha256"]:
+                    logger.info(f"{stage} output changed, running it again: {file_path}")
+                    return False
+            except OSError:
+                logger.info(f"{stage} output is missing, running it again: {file_path}")
+                return False
+        return True
+
+    def record(self, stage: str, inputs: Dict[str, Any], outputs: Dict[str, Any], files: List[str]):
+        files = {
+            file_path: {"size": os.path.getsize(file_path), "sha256": checksum_file(file_path)}
+            for file_path in files if file_path
+        }
+        inputs_hash = hash_inputs(inputs)
+        entry = {
+            "inputs": inputs_hash,
+            "digest": hash_inputs({"inputs": inputs_hash, "files": files}),
+            "outputs": outputs,
+            "files": files,
+        }
+        self.verified[entry["digest"]] = True
+
+        with self.lock:
+            self.stages[stage] = entry
+            temp_path = f"{self.path}.{utils.getUuid(True)}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"stages": self.stages}, f, ensure_ascii=False, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"failed to write task manifest: {str(e)}")
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
@@ -1,20 +1,91 @@
 import os
 import random
-from typing import List
-from urllib.parse import urlencode
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from typing import Callable, List, Optional
+from urllib.parse import urlencode, urlparse
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import probe_cache
+from app.services.file_cache import make_key
+from app.services.search_cache import SearchCache
 from app.utils import utils
 
-requested_count = 0
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds a key rests after a 429 that carries no Retry-After/reset header
+DEFAULT_RATE_LIMIT_COOLDOWN = 60
+# Reset headers above this are unix timestamps, below it seconds to wait
+EPOCH_THRESHOLD = 1e9
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_key_rotators = {}
+_search_cache = None
+
+
+class ApiKeyRotator:
+    """
+    Round-robin over the configured API keys, skipping keys that are rate limited
+    """
+
+    def __init__(self, api_keys: List[str]):
+        self.api_keys = list(api_keys)
+        self.lock = threading.Lock()
+        self.index = 0
+        self.cooldown_until = {key: 0.0 for key in self.api_keys}
+
+    def next_key(self) -> str:
+        with self.lock:
+            now = time.time()
+            for _ in range(len(self.api_keys)):
+                key = self.api_keys[self.index % len(self.api_keys)]
+                self.index += 1
+                if self.cooldown_until.get(key, 0.0) <= now:
+                    return key
+
+            # every key is limited, use the one that recovers first
+            key = min(self.api_keys, key=lambda k: self.cooldown_until.get(k, 0.0))
+            logger.warning("all api keys are rate limited, retrying the one that recovers first")
+            return key
+
+    def report(self, api_key: str, response: requests.Response):
+        """
+        Put a key on cooldown when the response says it is out of quota
+
+        Pexels sends X-Ratelimit-Reset as a unix timestamp, Pixabay sends
+        X-RateLimit-Reset as seconds until the window resets
+        """
+        headers = response.headers
+        remaining = headers.get("X-Ratelimit-Remaining")
+        if response.status_code != 429 and remaining not in ("0", 0):
+            return
+
+        now = time.time()
+        cooldown = DEFAULT_RATE_LIMIT_COOLDOWN
+        retry_after = headers.get("Retry-After")
+        reset = headers.get("X-Ratelimit-Reset")
+        try:
+            if retry_after:
+                cooldown = float(retry_after)
+            elif reset:
+                reset = float(reset)
+                # an epoch that is already past (clock skew) means the window has reset
+                cooldown = max(reset - now, 0) if reset > EPOCH_THRESHOLD else reset
+        except ValueError:
+            pass
 
+        with self.lock:
+            self.cooldown_until[api_key] = now + max(cooldown, 1)
+        logger.warning(f"api key rate limited, cooling down for {int(cooldown)} seconds")
 
-def get_api_key(cfg_key: str):
+
+def get_key_rotator(cfg_key: str) -> ApiKeyRotator:
     api_keys = config.app.get(cfg_key)
     if not api_keys:
         raise ValueError(
@@ -22,41 +93,97 @@ def get_api_key(cfg_key: str):
             f"{utils.toJson(config.app)}"
         )
 
-    # if only one key is provided, return it
     if isinstance(api_keys, str):
-        return api_keys
+        api_keys = [api_keys]
+
+    with _session_lock:
+        rotator = _key_rotators.get(cfg_key)
+        # rebuild when the keys were edited in the web UI
+        if rotator is None or rotator.api_keys != list(api_keys):
+            rotator = ApiKeyRotator(api_keys)
+            _key_rotators[cfg_key] = rotator
+        return rotator
+
+
+def get_api_key(cfg_key: str):
+    return get_key_rotator(cfg_key).next_key()
+
+
+def get_search_cache() -> Optional[SearchCache]:
+    global _search_cache
+    if not config.app.get("enable_search_cache", True):
+        return None
+    if _search_cache is None:
+        with _session_lock:
+            if _search_cache is None:
+                _search_cache = SearchCache(ttl=config.app.get("search_cache_ttl", 86400))
+    return _search_cache
+
+
+def cached_search(provider: str, search_term: str, video_aspect: VideoAspect,
+                  minimum_duration: int, fetch) -> List[MaterialInfo]:
+    """
+    Run a search through the search cache, concurrent identical queries share one request
+    """
+    cache = get_search_cache()
+    if cache is None:
+        return fetch()
+
+    key = make_key(provider, search_term.strip().lower(), VideoAspect(video_aspect).name, minimum_duration)
+    results = cache.get_or_fetch(
+        key, lambda: [{"provider": i.provider, "url": i.url, "duration": i.duration} for i in fetch()]
+    )
 
-    global requested_count
-    requested_count += 1
-    return api_keys[requested_count % len(api_keys)]
+    video_items = []
+    for result in results:
+        item = MaterialInfo()
+        item.provider = result["provider"]
+        item.url = result["url"]
+        item.duration = result["duration"]
+        video_items.append(item)
+    return video_items
 
 
 def search_videos_pexels(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    return cached_search(
+        "pexels", search_term, video_aspect, minimum_duration,
+        lambda: _search_videos_pexels(search_term, minimum_duration, video_aspect),
+    )
+
+
+def _search_videos_pexels(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
     video_orientation = aspect.name
     video_width, video_height = aspect.to_resolution()
-    api_key = get_api_key("pexels_api_keys")
+    rotator = get_key_rotator("pexels_api_keys")
+    api_key = rotator.next_key()
     headers = {
         "Authorization": api_key,
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36",
     }
     # Build URL
     params = {"query": search_term, "per_page": 20, "orientation": video_orientation}
-    query_url = f"https://api.pexels.com/videos/search?{urlencode(params)}"
+    base_url = config.app.get("pexels_api_url", "https://api.pexels.com").rstrip("/")
+    query_url = f"{base_url}/videos/search?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url,
             headers=headers,
             proxies=config.proxy,
             verify=False,
             timeout=(30, 60),
         )
+        rotator.report(api_key, r)
         response = r.json()
         video_items = []
         if "videos" not in response:
@@ -92,12 +219,24 @@ def search_videos_pixabay(
     search_term: str,
     minimum_duration: int,
     video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    return cached_search(
+        "pixabay", search_term, video_aspect, minimum_duration,
+        lambda: _search_videos_pixabay(search_term, minimum_duration, video_aspect),
+    )
+
+
+def _search_videos_pixabay(
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
 ) -> List[MaterialInfo]:
     aspect = VideoAspect(video_aspect)
 
     video_width, video_height = aspect.to_resolution()
 
-    api_key = get_api_key("pixabay_api_keys")
+    rotator = get_key_rotator("pixabay_api_keys")
+    api_key = rotator.next_key()
     # Build URL
     params = {
         "q": search_term,
@@ -105,13 +244,15 @@ def search_videos_pixabay(
         "per_page": 50,
         "key": api_key,
     }
-    query_url = f"https://pixabay.com/api/videos/?{urlencode(params)}"
+    base_url = config.app.get("pixabay_api_url", "https://pixabay.com").rstrip("/")
+    query_url = f"{base_url}/api/videos/?{urlencode(params)}"
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = get_session().get(
             query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
         )
+        rotator.report(api_key, r)
         response = r.json()
         video_items = []
         if "hits" not in response:
@@ -144,7 +285,38 @@ def search_videos_pixabay(
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+def get_session() -> requests.Session:
+    """
+    Shared requests session, so downloads reuse pooled keep-alive connections
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = config.app.get("download_workers", 8)
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=pool_size, pool_maxsize=pool_size
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_host_semaphore(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _session_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.Semaphore(
+                config.app.get("max_downloads_per_host", 4)
+            )
+        return _host_semaphores[host]
+
+
+def save_video(
+    video_url: str, save_dir: str = "", cancel_event: threading.Event = None
+) -> str:
     if not save_dir:
         save_dir = utils.storageDir("cache_videos")
 
@@ -165,32 +337,43 @@ def save_video(video_url: str, save_dir: str = "") -> str:
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
     }
 
-    # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
+    # if video does not exist, stream it to a .part file and rename it once valid
+    part_path = f"{video_path}.{utils.getUuid(True)}.part"
+    try:
+        with get_host_semaphore(video_url):
+            if cancel_event and cancel_event.is_set():
+                return ""
+            with get_session().get(
                 video_url,
                 headers=headers,
                 proxies=config.proxy,
                 verify=False,
                 timeout=(60, 240),
-            ).content
-        )
-
-    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
-        try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
-                return video_path
-        except Exception as e:
+                stream=True,
+            ) as r:
+                r.raise_for_status()
+                with open(part_path, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if cancel_event and cancel_event.is_set():
+                            logger.info(f"download cancelled: {video_url}")
+                            return ""
+                        f.write(chunk)
+
+        if os.path.getsize(part_path) > 0:
+            try:
+                info = probe_cache.media_info(part_path)
+                if info.duration > 0 and info.fps > 0:
+                    os.replace(part_path, video_path)
+                    return video_path
+                logger.warning(f"invalid video file: {video_url} => duration: {info.duration}, fps: {info.fps}")
+            except Exception as e:
+                logger.warning(f"invalid video file: {video_url} => {str(e)}")
+    finally:
+        if os.path.exists(part_path):
             try:
-                os.remove(video_path)
+                os.remove(part_path)
             except Exception:
                 pass
-            logger.warning(f"invalid video file: {video_path} => {str(e)}")
     return ""
 
 
@@ -202,75 +385,157 @@ def download_videos(
     video_contact_mode: VideoConcatMode = VideoConcatMode.random,
     audio_duration: float = 0.0,
     max_clip_duration: int = 5,
+    on_downloaded: Optional[Callable[[str], None]] = None,
 ) -> List[str]:
+    """
+    Search and download enough footage for audio_duration seconds
+
+    on_downloaded is called with each saved file as soon as it arrives, in
+    completion order, so the caller can start preparing it during the
+    remaining downloads
+    """
     valid_video_items = []
-    valid_video_urls = []
+    valid_video_urls = set()
     found_duration = 0.0
+    required_duration = audio_duration * 1.5
+    deadline = time.time() + config.app.get("search_timeout", 90)
     search_videos = search_videos_pexels
     if source == "pixabay":
         search_videos = search_videos_pixabay
 
-    # First, try searching with all terms combined
-    combined_search_term = " ".join(search_terms)
-    video_items = search_videos(
-        search_term=combined_search_term,
-        minimum_duration=max_clip_duration,
-        video_aspect=video_aspect,
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(config.app.get("search_workers", 4), len(search_terms)))
     )
-    logger.info(f"found {len(video_items)} videos for combined search: '{combined_search_term}'")
-
-    # Add results from combined search
-    for item in video_items:
-        if item.url not in valid_video_urls:
-            valid_video_items.append(item)
-            valid_video_urls.append(item.url)
-            found_duration += item.duration
-    
-    # If we didn't find enough videos, search for each term individually
-    if found_duration < audio_duration * 1.5:
-        logger.info("Not enough videos found with combined search, trying individual terms...")
-        for search_term in search_terms:
-            video_items = search_videos(
-                search_term=search_term,
-                minimum_duration=max_clip_duration,
-                video_aspect=video_aspect,
-            )
-            logger.info(f"found {len(video_items)} videos for '{search_term}'")
+    try:
+        # First, try searching with all terms combined, under the same deadline as the fan-out
+        combined_search_term = " ".join(search_terms)
+        combined = executor.submit(
+            search_videos,
+            search_term=combined_search_term,
+            minimum_duration=max_clip_duration,
+            video_aspect=video_aspect,
+        )
+        try:
+            video_items = combined.result(timeout=max(deadline - time.time(), 0))
+            logger.info(f"found {len(video_items)} videos for combined search: '{combined_search_term}'")
+        except TimeoutError:
+            logger.warning(f"search deadline reached during combined search: '{combined_search_term}'")
+            video_items = []
+        except Exception as e:
+            logger.error(f"search videos failed for '{combined_search_term}': {str(e)}")
+            video_items = []
+
+        # Add results from combined search
+        for item in video_items:
+            if item.url not in valid_video_urls:
+                valid_video_items.append(item)
+                valid_video_urls.add(item.url)
+                found_duration += item.duration
+
+        # If we didn't find enough videos, search for each term individually
+        if found_duration < required_duration and search_terms and time.time() < deadline:
+            logger.info("Not enough videos found with combined search, trying individual terms...")
+            futures = {
+                executor.submit(
+                    search_videos,
+                    search_term=search_term,
+                    minimum_duration=max_clip_duration,
+                    video_aspect=video_aspect,
+                ): index
+                for index, search_term in enumerate(search_terms)
+            }
+            # merged in search_terms order whatever order the searches finish in,
+            # so sequential concat mode picks the same footage on every run
+            term_results = {}
+            merged = 0
+
+            def merge_finished() -> bool:
+                nonlocal merged, found_duration
+                while merged in term_results and found_duration < required_duration:
+                    for item in term_results.pop(merged):
+                        if item.url not in valid_video_urls:
+                            valid_video_items.append(item)
+                            valid_video_urls.add(item.url)
+                            found_duration += item.duration
+                    merged += 1
+                return found_duration >= required_duration
 
-            for item in video_items:
-                if item.url not in valid_video_urls:
-                    valid_video_items.append(item)
-                    valid_video_urls.append(item.url)
-                    found_duration += item.duration
+            try:
+                for future in as_completed(futures, timeout=max(deadline - time.time(), 0)):
+                    index = futures[future]
+                    try:
+                        term_results[index] = future.result()
+                        logger.info(f"found {len(term_results[index])} videos for '{search_terms[index]}'")
+                    except Exception as e:
+                        logger.error(f"search videos failed for '{search_terms[index]}': {str(e)}")
+                        term_results[index] = []
+
+                    if merge_finished():
+                        logger.info("found enough videos, skip remaining searches")
+                        break
+            except TimeoutError:
+                logger.warning("search deadline reached, continuing with the videos found so far")
+                # terms after a search that missed the deadline still count, in order
+                for index in sorted(term_results):
+                    merged = index
+                    if merge_finished():
+                        break
+    finally:
+        # don't wait for searches that are still running
+        executor.shutdown(wait=False, cancel_futures=True)
 
     logger.info(
         f"found total videos: {len(valid_video_items)}, required duration: {audio_duration} seconds, found duration: {found_duration} seconds"
     )
-    video_paths = []
-
     material_directory = utils.taskDir(task_id)
 
     if video_contact_mode.value == VideoConcatMode.random.value:
         random.shuffle(valid_video_items)
 
+    # Download concurrently, stop as soon as enough footage has arrived
+    logger.info(f"downloading up to {len(valid_video_items)} videos")
+    downloaded = {}
     total_duration = 0.0
-    for item in valid_video_items:
-        try:
-            logger.info(f"downloading video: {item.url}")
-            saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
+    cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=config.app.get("download_workers", 8)) as executor:
+        futures = {}
+        for index, item in enumerate(valid_video_items):
+            future = executor.submit(
+                save_video,
+                video_url=item.url,
+                save_dir=material_directory,
+                cancel_event=cancel_event,
             )
-            if saved_video_path:
-                logger.info(f"video saved: {saved_video_path}")
-                video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
-                total_duration += seconds
-                if total_duration > audio_duration:
-                    logger.info(
-                        f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
-                    )
-                    break
-        except Exception as e:
-            logger.error(f"failed to download video: {utils.toJson(item)} => {str(e)}")
+            futures[future] = (index, item)
+
+        for future in as_completed(futures):
+            index, item = futures[future]
+            try:
+                saved_video_path = future.result()
+            except Exception as e:
+                logger.error(f"failed to download video: {utils.toJson(item)} => {str(e)}")
+                continue
+            if not saved_video_path:
+                continue
+
+            logger.info(f"video saved: {saved_video_path}")
+            downloaded[index] = saved_video_path
+            if on_downloaded:
+                try:
+                    on_downloaded(saved_video_path)
+                except Exception as e:
+                    logger.error(f"failed to hand over downloaded video {saved_video_path}: {str(e)}")
+            seconds = min(max_clip_duration, item.duration)
+            total_duration += seconds
+            if total_duration > audio_duration and not cancel_event.is_set():
+                logger.info(
+                    f"total duration of downloaded videos: {total_duration} seconds, skip downloading more"
+                )
+                cancel_event.set()
+                for pending in futures:
+                    pending.cancel()
+
+    # Keep the search order, sequential concat mode relies on it
+    video_paths = [downloaded[index] for index in sorted(downloaded)]
     logger.success(f"downloaded {len(video_paths)} videos")
     return video_paths
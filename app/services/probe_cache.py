@@ -0,0 +1,331 @@
+"""
+Probe Cache Module - Process-wide ffprobe metadata cache
+Results are keyed on (path, size, mtime) and persisted in a small SQLite index
+under storage/, so warm files are never probed twice
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+# SQLite rows are pruned every this many stores
+PRUNE_INTERVAL = 500
+
+
+class MediaInfo:
+    """
+    Commonly used fields of an ffprobe result
+    """
+
+    def __init__(self, file_path: str, info: Dict[str, Any], keyframes: Optional[List[float]] = None):
+        self.file_path = file_path
+        self.info = info
+        self.keyframes = keyframes
+
+        streams = info.get("streams", [])
+        video_stream = next((s for s in streams if s.get("codec_type") == "video"), {})
+        self.has_video = bool(video_stream)
+        self.has_audio = any(s.get("codec_type") == "audio" for s in streams)
+        self.width = int(video_stream.get("width", 0) or 0)
+        self.height = int(video_stream.get("height", 0) or 0)
+        self.codec = video_stream.get("codec_name", "")
+        self.pix_fmt = video_stream.get("pix_fmt", "")
+        self.time_base = video_stream.get("time_base", "")
+        self.fps = _parse_rate(video_stream.get("avg_frame_rate") or video_stream.get("r_frame_rate", ""))
+        try:
+            self.duration = float(info.get("format", {}).get("duration", 0) or 0)
+        except ValueError:
+            self.duration = 0.0
+
+    def __str__(self):
+        return f"MediaInfo(file_path={self.file_path}, duration={self.duration}, width={self.width}, height={self.height}, codec={self.codec}, fps={self.fps})"
+
+
+def _parse_rate(rate: str) -> float:
+    try:
+        if "/" in rate:
+            num, den = rate.split("/")
+            return float(num) / float(den) if float(den) else 0.0
+        return float(rate)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _run_ffprobe(file_path: str) -> Dict[str, Any]:
+    cmd = [
+        "ffprobe", "-v", "quiet", "-print_format", "json",
+        "-show_format", "-show_streams", file_path
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error probing file {file_path}: {e.stderr}")
+        raise RuntimeError(f"Error probing file: {e.stderr}")
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing ffprobe output: {e}")
+        raise RuntimeError(f"Error parsing ffprobe output: {e}")
+
+
+def _run_keyframe_scan(file_path: str) -> List[float]:
+    # Packets are read without decoding, so this is cheap even for long files
+    cmd = [
+        "ffprobe", "-v", "quiet", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0",
+        file_path
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error reading keyframes of {file_path}: {e.stderr}")
+        return []
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) >= 2 and "K" in parts[1]:
+            try:
+                keyframes.append(float(parts[0]))
+            except ValueError:
+                continue
+    keyframes.sort()
+    return keyframes
+
+
+class ProbeCache:
+    """
+    ffprobe results kept in memory and in a SQLite index
+    """
+
+    def __init__(self, db_file: str, max_memory_entries: int = 1024, max_age_days: float = 30):
+        """
+        Args:
+            db_file: SQLite index path
+            max_memory_entries: Entries kept in memory, least recently used go first
+            max_age_days: Rows not used for this long are pruned, as are rows
+                whose file is gone
+        """
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+        self.max_memory_entries = max(1, max_memory_entries)
+        self.max_age = max_age_days * 86400
+        self.stores = 0
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "info TEXT, keyframes TEXT, used_at REAL)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(probes)")]
+            if "used_at" not in columns:
+                self.conn.execute("ALTER TABLE probes ADD COLUMN used_at REAL")
+            self.conn.commit()
+        self.prune()
+
+    def prune(self):
+        """
+        Drop rows whose file is gone or that were not used within max_age
+        """
+        with self.lock:
+            now = time.time()
+            rows = self.conn.execute("SELECT path, used_at FROM probes").fetchall()
+            stale = [
+                (path,) for path, used_at in rows
+                if (used_at or 0) < now - self.max_age or not os.path.exists(path)
+            ]
+            if stale:
+                self.conn.executemany("DELETE FROM probes WHERE path = ?", stale)
+                self.conn.commit()
+                logger.debug(f"pruned {len(stale)} probe cache rows")
+
+    def _remember(self, key: Tuple[str, int, int], entry: Dict[str, Any]):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    @staticmethod
+    def file_key(file_path: str) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns
+
+    def _load(self, key: Tuple[str, int, int]) -> Dict[str, Any]:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+
+            row = self.conn.execute(
+                "SELECT info, keyframes FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                key,
+            ).fetchone()
+            if row:
+                self.conn.execute("UPDATE probes SET used_at = ? WHERE path = ?", (time.time(), key[0]))
+                self.conn.commit()
+        if not row:
+            return {}
+
+        entry = {"info": json.loads(row[0]) if row[0] else None,
+                 "keyframes": json.loads(row[1]) if row[1] else None}
+        self._remember(key, entry)
+        return entry
+
+    def _store(self, key: Tuple[str, int, int], entry: Dict[str, Any]):
+        self._remember(key, entry)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, info, keyframes, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                key + (
+                    json.dumps(entry.get("info")) if entry.get("info") is not None else None,
+                    json.dumps(entry.get("keyframes")) if entry.get("keyframes") is not None else None,
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+            self.stores += 1
+            prune = self.stores % PRUNE_INTERVAL == 0
+        # temp files and downloads leave rows behind that are never read again
+        if prune:
+            self.prune()
+
+    def probe(self, file_path: str) -> Dict[str, Any]:
+        key = self.file_key(file_path)
+        if key is None:
+            return _run_ffprobe(file_path)
+
+        entry = self._load(key)
+        if entry.get("info") is None:
+            entry = dict(entry, info=_run_ffprobe(file_path))
+            self._store(key, entry)
+        return entry["info"]
+
+    def keyframes(self, file_path: str) -> List[float]:
+        key = self.file_key(file_path)
+        if key is None:
+            return _run_keyframe_scan(file_path)
+
+        entry = self._load(key)
+        if entry.get("keyframes") is None:
+            keyframes = _run_keyframe_scan(file_path)
+            if not keyframes:
+                return keyframes
+            entry = dict(entry, keyframes=keyframes)
+            self._store(key, entry)
+        return entry["keyframes"]
+
+
+_cache: Optional[ProbeCache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> Optional[ProbeCache]:
+    global _cache
+    if not config.app.get("enable_probe_cache", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ProbeCache(
+                    os.path.join(utils.storageDir(create=True), "probe_cache.db"),
+                    max_memory_entries=config.app.get("probe_cache_memory_entries", 1024),
+                    max_age_days=config.app.get("probe_cache_max_age_days", 30),
+                )
+    return _cache
+
+
+def probe(file_path: str) -> Dict[str, Any]:
+    """
+    Get the ffprobe format and stream metadata of a file
+
+    Args:
+        file_path: Path to the video/audio file
+
+    Returns:
+        Dictionary containing file metadata
+    """
+    cache = _get_cache()
+    if cache is None:
+        return _run_ffprobe(file_path)
+    return cache.probe(file_path)
+
+
+def get_keyframes(file_path: str) -> List[float]:
+    """
+    Get the keyframe timestamps of the first video stream
+
+    Args:
+        file_path: Path to the video file
+
+    Returns:
+        Sorted list of keyframe timestamps in seconds
+    """
+    cache = _get_cache()
+    if cache is None:
+        return _run_keyframe_scan(file_path)
+    return cache.keyframes(file_path)
+
+
+def media_info(file_path: str, with_keyframes: bool = False) -> MediaInfo:
+    """
+    Get duration, dimensions, codec, fps and optionally keyframes of a file
+
+    Args:
+        file_path: Path to the video/audio file
+        with_keyframes: Also scan the keyframe positions
+
+    Returns:
+        MediaInfo of the file
+    """
+    keyframes = get_keyframes(file_path) if with_keyframes else None
+    return MediaInfo(file_path, probe(file_path), keyframes)
+
+
+def probe_many(file_paths: List[str], with_keyframes: bool = False,
+               max_workers: int = 8) -> Dict[str, MediaInfo]:
+    """
+    Probe many files concurrently
+
+    Args:
+        file_paths: Paths to probe
+        with_keyframes: Also scan the keyframe positions
+        max_workers: Number of ffprobe processes run in parallel
+
+    Returns:
+        Dictionary of path to MediaInfo, files that could not be probed are left out
+    """
+    def _probe(file_path):
+        try:
+            return file_path, media_info(file_path, with_keyframes)
+        except Exception as e:
+            logger.error(f"Error probing file {file_path}: {str(e)}")
+            return file_path, None
+
+    unique_paths = list(dict.fromkeys(file_paths))
+    if not unique_paths:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_paths))) as executor:
+        results = executor.map(_probe, unique_paths)
+    return {file_path: info for file_path, info in results if info is not None}
@@ -0,0 +1,224 @@
+"""
+Render Graph Module - Single-pass FFmpeg rendering
+Builds one filter_complex covering segment trimming, scaling/padding, fades,
+voice/BGM mixing and subtitle burning so every output is encoded exactly once
+"""
+
+import os
+import subprocess
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from app.services.encoder import EncoderProfile, get_profile
+
+
+class RenderSegment:
+    """
+    A time range of a source file that becomes one piece of the output video
+    """
+
+    def __init__(self, file_path: str, start_time: float, duration: float):
+        self.file_path = file_path
+        self.start_time = start_time
+        self.duration = duration
+
+    def __str__(self):
+        return f"RenderSegment(file_path={self.file_path}, start_time={self.start_time}, duration={self.duration})"
+
+
+class RenderGraph:
+    """
+    Describes a complete output video and renders it with a single ffmpeg invocation
+    """
+
+    def __init__(self, width: int, height: int, fps: int = 30,
+                 duration: Optional[float] = None,
+                 profile: Optional[EncoderProfile] = None):
+        """
+        Args:
+            width: Output width
+            height: Output height
+            fps: Output frame rate
+            duration: Output duration in seconds (optional). When set, the video
+                is padded with its last frame if the segments are too short
+            profile: Encoder profile, the configured default when not set
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.duration = duration
+        self.profile = profile or get_profile()
+        self.segments: List[RenderSegment] = []
+        self.transition_type = ""
+        self.transition_duration = 1.0
+        self.voice_file = ""
+        self.voice_volume = 1.0
+        self.bgm_file = ""
+        self.bgm_volume = 0.3
+        self.bgm_fade_duration = 3
+        self.subtitle_file = ""
+        self.subtitle_style = ""
+        self.fonts_dir = ""
+
+    def add_segment(self, file_path: str, start_time: float, duration: float):
+        self.segments.append(RenderSegment(file_path, start_time, duration))
+        return self
+
+    def set_transition(self, transition_type: str, duration: float = 1.0):
+        """
+        Args:
+            transition_type: fadein, fadeout or fade, applied to every segment
+            duration: Transition duration in seconds
+        """
+        self.transition_type = transition_type or ""
+        self.transition_duration = duration
+        return self
+
+    def set_audio(self, voice_file: str, voice_volume: float = 1.0,
+                  bgm_file: str = "", bgm_volume: float = 0.3,
+                  fade_duration: int = 3):
+        self.voice_file = voice_file
+        self.voice_volume = voice_volume
+        self.bgm_file = bgm_file if bgm_file and os.path.exists(bgm_file) else ""
+        self.bgm_volume = bgm_volume
+        self.bgm_fade_duration = fade_duration
+        return self
+
+    def set_subtitles(self, subtitle_file: str, style: str, fonts_dir: str = ""):
+        self.subtitle_file = subtitle_file if subtitle_file and os.path.exists(subtitle_file) else ""
+        self.subtitle_style = style
+        self.fonts_dir = fonts_dir
+        return self
+
+    def _segment_filter(self, index: int, segment: RenderSegment) -> str:
+        filters = [
+            "setpts=PTS-STARTPTS",
+            f"scale={self.width}:{self.height}:force_original_aspect_ratio=decrease",
+            f"pad={self.width}:{self.height}:(ow-iw)/2:(oh-ih)/2",
+            "setsar=1",
+            f"fps={self.fps}",
+            "format=yuv420p",
+        ]
+
+        fade = min(self.transition_duration, segment.duration)
+        if self.transition_type in ("fadein", "fade"):
+            filters.append(f"fade=t=in:st=0:d={fade}")
+        if self.transition_type in ("fadeout", "fade"):
+            filters.append(f"fade=t=out:st={max(0, segment.duration - fade)}:d={fade}")
+
+        return f"[{index}:v]{','.join(filters)}[v{index}]"
+
+    def build(self, filter_script: str) -> Tuple[List[str], str]:
+        """
+        Build the ffmpeg arguments and the filter graph
+
+        Args:
+            filter_script: Path the filter graph will be written to
+
+        Returns:
+            Tuple of (input and filter arguments, filter graph text)
+        """
+        if not self.segments:
+            raise ValueError("render graph has no segments")
+
+        args = []
+        chains = []
+        for i, segment in enumerate(self.segments):
+            if segment.start_time > 0:
+                args.extend(["-ss", str(segment.start_time)])
+            args.extend(["-t", str(segment.duration), "-i", segment.file_path])
+            chains.append(self._segment_filter(i, segment))
+
+        labels = "".join(f"[v{i}]" for i in range(len(self.segments)))
+        video_chain = f"{labels}concat=n={len(self.segments)}:v=1:a=0"
+
+        total = sum(segment.duration for segment in self.segments)
+        if self.duration and total < self.duration:
+            video_chain += f",tpad=stop_mode=clone:stop_duration={self.duration - total}"
+
+        if self.subtitle_file:
+            subtitle_path = self.subtitle_file.replace("\\", "/")
+            video_chain += f",subtitles='{subtitle_path}'"
+            if self.fonts_dir:
+                video_chain += f":fontsdir='{self.fonts_dir.replace(chr(92), '/')}'"
+            if self.subtitle_style:
+                video_chain += f":force_style='{self.subtitle_style}'"
+        chains.append(f"{video_chain}[vout]")
+
+        next_input = len(self.segments)
+        if self.voice_file:
+            args.extend(["-i", self.voice_file])
+            voice_input = next_input
+            next_input += 1
+
+            if self.bgm_file:
+                args.extend(["-stream_loop", "-1", "-i", self.bgm_file])
+                bgm_filters = [f"volume={self.bgm_volume}"]
+                if self.duration and self.duration > self.bgm_fade_duration:
+                    fade_start = self.duration - self.bgm_fade_duration
+                    bgm_filters.append(f"afade=t=out:st={fade_start}:d={self.bgm_fade_duration}")
+                chains.append(f"[{voice_input}:a]volume={self.voice_volume}[a1]")
+                chains.append(f"[{next_input}:a]{','.join(bgm_filters)}[a2]")
+                chains.append("[a1][a2]amix=inputs=2:duration=first[aout]")
+            else:
+                chains.append(f"[{voice_input}:a]volume={self.voice_volume}[aout]")
+
+        args.extend(["-filter_complex_script", filter_script, "-map", "[vout]"])
+        if self.voice_file:
+            args.extend(["-map", "[aout]"])
+
+        return args, ";\n".join(chains)
+
+    def render(self, output_file: str) -> bool:
+        """
+        Render the graph into output_file with one ffmpeg invocation. When
+        that fails with subtitles, it is rendered once more without them
+
+        Args:
+            output_file: Output video file path
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if self._render(output_file):
+            return True
+        if not self.subtitle_file:
+            return False
+
+        # a broken .srt or a missing font should not cost the whole video
+        logger.warning(f"Rendering with subtitles failed, retrying without them: {self.subtitle_file}")
+        self.subtitle_file = ""
+        return self._render(output_file)
+
+    def _render(self, output_file: str) -> bool:
+        filter_script = f"{output_file}.filter.txt"
+
+        try:
+            args, graph = self.build(filter_script)
+            with open(filter_script, "w", encoding="utf-8") as f:
+                f.write(graph)
+
+            cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"] + args
+            cmd.extend(self.profile.video_args())
+            cmd.extend(["-pix_fmt", "yuv420p", "-r", str(self.fps)])
+            if self.voice_file:
+                cmd.extend(["-c:a", "aac", "-b:a", "192k"])
+            if self.duration:
+                cmd.extend(["-t", str(self.duration)])
+            cmd.append(output_file)
+
+            logger.info(f"Rendering {len(self.segments)} segments in a single pass: {output_file}")
+            logger.debug(f"FFmpeg render command: {' '.join(cmd)}")
+
+            process = subprocess.run(cmd, capture_output=True, text=True)
+            if process.returncode != 0:
+                logger.error(f"Error rendering video: {process.stderr}")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"Error rendering video: {e}")
+            return False
+        finally:
+            if os.path.exists(filter_script):
+                os.remove(filter_script)
@@ -0,0 +1,134 @@
+"""
+Search Cache Module - Persistent cache of stock footage search results
+Entries expire after a TTL, and concurrent identical queries are coalesced
+into a single remote request
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+
+from app.utils import utils
+
+# expired entries are pruned every this many stores
+PRUNE_INTERVAL = 200
+
+
+class SearchCache:
+    """
+    Search results stored as JSON files under storage/, one file per query
+    """
+
+    def __init__(self, name: str = "cache_search", ttl: int = 86400):
+        """
+        Args:
+            name: Sub directory of storage/ holding the entries
+            ttl: Seconds a result stays valid
+        """
+        self.cache_dir = utils.storageDir(name, create=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.inflight: Dict[str, Future] = {}
+        self.stores = 0
+        self.prune()
+
+    def prune(self):
+        """
+        Delete the entries older than the TTL, distinct queries never overwrite each other's files
+        """
+        now = time.time()
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("created", 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("items")
+
+    def put(self, key: str, items: List[dict]):
+        path = self._path(key)
+        temp_path = f"{path}.{utils.getUuid(True)}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "items": items}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"failed to write search cache entry: {str(e)}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self.lock:
+            self.stores += 1
+            prune = self.stores % PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], List[dict]]) -> List[dict]:
+        """
+        Return a cached result, or run fetch once no matter how many callers
+        ask for the same key at the same time. Empty results are not cached.
+
+        Args:
+            key: Cache key
+            fetch: Callable doing the remote request
+
+        Returns:
+            List of result items
+        """
+        items = self.get(key)
+        if items is not None:
+            logger.debug(f"search cache hit: {key}")
+            return items
+
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+
+        if not owner:
+            logger.debug(f"search coalesced with in-flight request: {key}")
+            return future.result()
+
+        try:
+            items = fetch()
+            if items:
+                self.put(key, items)
+            future.set_result(items)
+            return items
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
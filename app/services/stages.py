@@ -0,0 +1,190 @@
+"""
+Stages Module - Pipeline scheduler for the stages of a task
+Every stage has its own queue and worker pool sized to the resource it uses,
+a task moves to the next queue when a stage finishes, so while one task is
+encoding others keep synthesizing, transcribing and downloading
+"""
+
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import PriorityQueue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import config
+from app.models import const
+
+STAGE_TTS = "tts"
+STAGE_SUBTITLE = "subtitle"
+STAGE_MATERIALS = "materials"
+STAGE_RENDER = "render"
+
+
+def default_limits() -> Dict[str, int]:
+    if config.app.get("subtitle_provider", "edge").strip().lower() == "whisper":
+        # one slot per pooled whisper model
+        subtitle_limit = config.whisper.get("pool_size", 1)
+    else:
+        # edge alignment is cheap, a whisper fallback still waits for a pooled model
+        subtitle_limit = os.cpu_count() or 4
+    return {
+        # network bound
+        STAGE_TTS: 4,
+        STAGE_MATERIALS: 4,
+        STAGE_SUBTITLE: subtitle_limit,
+        # ffmpeg already spreads one encode over several cores
+        STAGE_RENDER: max(1, (os.cpu_count() or 1) // 4),
+    }
+
+
+class StagePool:
+    """
+    Fixed number of workers draining one stage's priority queue
+    """
+
+    def __init__(self, stage: str, size: int):
+        self.stage = stage
+        self.size = max(1, size)
+        self.queue = PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        for i in range(self.size):
+            threading.Thread(
+                target=self._work, name=f"stage-{stage}-{i}", daemon=True
+            ).start()
+
+    def submit(self, priority: int, fn: Callable, *args: Any) -> Future:
+        future = Future()
+        self.queue.put((priority, next(self.sequence), time.time(), future, fn, args))
+        return future
+
+    def _work(self):
+        while True:
+            _, _, enqueued_at, future, fn, args = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            waited = time.time() - enqueued_at
+            if waited > 1:
+                logger.info(f"waited {waited:.1f}s for a {self.stage} slot")
+            with self.lock:
+                self.running += 1
+                self.wait_seconds_total += waited
+
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "limit": self.size,
+                "running": self.running,
+                "waiting": self.queue.qsize(),
+                "completed": self.completed,
+                "avg_wait_seconds": self.wait_seconds_total / self.completed if self.completed else 0.0,
+            }
+
+
+class PipelineScheduler:
+    """
+    Runs a task as a chain of stage jobs
+
+    A step is a (stage, fn) pair, fn takes no arguments and returns True to
+    continue with the next step, or a Future of that flag when it started work
+    elsewhere, so the next step is queued once the work resolves without a slot
+    being held meanwhile. Steps with an unknown stage, such as None,
+    run inline in the thread that finished the previous step. A step can
+    carry a third element, a predicate that runs the step inline when it
+    returns True, so work that is already done does not wait for a slot
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.pools = {stage: StagePool(stage, limit) for stage, limit in limits.items()}
+
+    def run(self, steps: List[Tuple],
+            context: Dict[str, Any], priority: int = const.TASK_PRIORITY_NORMAL) -> Future:
+        """
+        Start a pipeline without blocking
+
+        Returns:
+            A future resolved with context["result"] once a step stops the
+            pipeline or the last step finishes
+        """
+        done = Future()
+        done.set_running_or_notify_cancel()
+
+        def advance(index: int):
+            # walk inline steps here, hand the first pooled one to its queue
+            while index < len(steps):
+                stage, fn = steps[index][:2]
+                ready = steps[index][2] if len(steps[index]) > 2 else None
+                pool = self.pools.get(stage)
+                try:
+                    if pool is not None and not (ready and ready()):
+                        pool.submit(priority, fn).add_done_callback(
+                            lambda f, i=index: finished(f, i)
+                        )
+                        return
+                    result = fn()
+                    if isinstance(result, Future):
+                        result.add_done_callback(lambda f, i=index: finished(f, i))
+                        return
+                    if not result:
+                        break
+                except BaseException as e:
+                    done.set_exception(e)
+                    return
+                index += 1
+            done.set_result(context.get("result"))
+
+        def finished(future: Future, index: int):
+            if future.exception() is not None:
+                done.set_exception(future.exception())
+            elif isinstance(future.result(), Future):
+                future.result().add_done_callback(lambda f: finished(f, index))
+            elif not future.result():
+                done.set_result(context.get("result"))
+            else:
+                advance(index + 1)
+
+        advance(0)
+        return done
+
+    def submit(self, stage: str, priority: int, fn: Callable, *args: Any) -> Future:
+        """
+        Queue a single job on a stage's pool, for work a step fans out that has
+        to stay within the limit of that stage
+        """
+        return self.pools[stage].submit(priority, fn, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        return {stage: pool.stats() for stage, pool in self.pools.items()}
+
+
+_scheduler: Optional[PipelineScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PipelineScheduler:
+    """
+    The process-wide scheduler, its worker threads start on first use rather than on import
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = PipelineScheduler({**default_limits(), **config.app.get("stage_limits", {})})
+    return _scheduler
@@ -69,22 +69,19 @@ class RedisState(BaseState):
         start = (page - 1) * page_size
         end = start + page_size
         tasks = []
-        cursor = 0
         total = 0
-        while True:
-            cursor, keys = self._redis.scan(cursor, count=page_size)
-            total += len(keys)
-            if total > start:
-                for key in keys[max(0, start - total):end - total]:
-                    task_data = self._redis.hgetall(key)
-                    task = {
-                        k.decode("utf-8"): self._convert_to_original_type(v) for k, v in task_data.items()
-                    }
-                    tasks.append(task)
-                    if len(tasks) >= page_size:
-                        break
-            if cursor == 0 or len(tasks) >= page_size:
-                break
+        # the task queue keeps its lists, leases and worker keys in the same db,
+        # task hashes are the only keys named by a bare task id
+        for key in self._redis.scan_iter(count=page_size, _type="hash"):
+            if b":" in key:
+                continue
+            if start <= total < end:
+                task_data = self._redis.hgetall(key)
+                task = {
+                    k.decode("utf-8"): self._convert_to_original_type(v) for k, v in task_data.items()
+                }
+                tasks.append(task)
+            total += 1
         return tasks, total
 
     def update_task(
@@ -0,0 +1,219 @@
+"""
+Stream Chain Module - FFmpeg stages connected by pipes
+Every stage is its own ffmpeg process reading the NUT stream of the previous
+one from stdin, so only the last stage writes a file and intermediate bytes
+never touch the disk
+"""
+
+import os
+import subprocess
+import tempfile
+from typing import List, Optional
+
+from loguru import logger
+
+from app.services import probe_cache
+from app.services.encoder import EncoderProfile, get_profile
+
+# raw frames and PCM cost no encode time and NUT carries them without a seekable output
+PIPE_VIDEO_ARGS = ["-c:v", "rawvideo"]
+PIPE_AUDIO_ARGS = ["-c:a", "pcm_s16le"]
+PIPE_FORMAT_ARGS = ["-f", "nut"]
+
+
+class ChainStage:
+    """
+    One ffmpeg process of a StreamChain
+    """
+
+    def __init__(self, name: str, input_args: Optional[List[str]] = None,
+                 video_filter: str = "", decodes_video: bool = True):
+        """
+        Args:
+            name: Stage name used in logs
+            input_args: Options placed before the main input, such as -ss
+            video_filter: Filter for the video stream (optional)
+            decodes_video: Whether the stage changes the video frames, False
+                for stages that pass the video stream through untouched
+        """
+        self.name = name
+        self.input_args = input_args or []
+        self.video_filter = video_filter
+        self.decodes_video = decodes_video
+
+
+class StreamChain:
+    """
+    Composes trim, resize and transition stages over one input and runs
+    them as a pipeline of ffmpeg processes
+
+    Stages that change the frames hand raw video to the next one, stages that
+    do not keep the original stream, so a chain without filters stays a copy
+    """
+
+    def __init__(self, input_file: str, input_args: Optional[List[str]] = None,
+                 duration: Optional[float] = None):
+        """
+        Args:
+            input_file: Input file path
+            input_args: Options for reading the input, such as -f
+            duration: Input duration in seconds, probed when needed and not set
+        """
+        self.input_file = input_file
+        self.input_args = input_args or []
+        self.duration = duration
+        self.stages: List[ChainStage] = []
+
+    def get_duration(self) -> float:
+        if self.duration is None:
+            self.duration = probe_cache.media_info(self.input_file).duration
+        return self.duration
+
+    def add_stage(self, stage: ChainStage) -> "StreamChain":
+        self.stages.append(stage)
+        return self
+
+    def trim(self, start_time: float, duration: Optional[float] = None) -> "StreamChain":
+        input_args = ["-ss", str(start_time)] if start_time > 0 else []
+        if duration:
+            input_args.extend(["-t", str(duration)])
+            self.duration = duration
+        else:
+            self.duration = max(0.0, self.get_duration() - start_time)
+        return self.add_stage(ChainStage("trim", input_args=input_args))
+
+    def resize(self, width: int, height: int, maintain_aspect_ratio: bool = True,
+               pad: bool = True) -> "StreamChain":
+        video_filter = f"scale={width}:{height}"
+        if maintain_aspect_ratio:
+            video_filter = f"scale={width}:{height}:force_original_aspect_ratio=decrease"
+            if pad:
+                video_filter += f",pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+        return self.add_stage(ChainStage("resize", video_filter=video_filter))
+
+    def transition(self, transition_type: str = "fade", duration: float = 1.0) -> "StreamChain":
+        filters = []
+        if transition_type in ("fadein", "fade"):
+            filters.append(f"fade=t=in:st=0:d={duration}")
+        if transition_type in ("fadeout", "fade"):
+            filters.append(f"fade=t=out:st={max(0.0, self.get_duration() - duration)}:d={duration}")
+        if not filters:
+            raise ValueError(f"unsupported transition type: {transition_type}")
+        return self.add_stage(ChainStage("transition", video_filter=",".join(filters)))
+
+    def commands(self, output_file: str, profile: Optional[EncoderProfile] = None,
+                 intermediate: bool = False, with_audio: bool = True) -> List[List[str]]:
+        """
+        Build one ffmpeg command per stage
+
+        Args:
+            output_file: Output file path, written by the last stage only
+            profile: Encoder profile of the output, the configured default when not set
+            intermediate: The output is rendered again later
+            with_audio: Whether to keep audio
+
+        Returns:
+            The commands, each reading the stdout of the previous one
+        """
+        profile = profile or get_profile()
+        stages = self.stages or [ChainStage("copy", decodes_video=False)]
+        commands = []
+        raw = False
+        for index, stage in enumerate(stages):
+            last = index == len(stages) - 1
+            cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+            cmd.extend(stage.input_args)
+            if index == 0:
+                cmd.extend(self.input_args + ["-i", self.input_file])
+            else:
+                cmd.extend(PIPE_FORMAT_ARGS + ["-i", "pipe:0"])
+
+            if stage.video_filter:
+                cmd.extend(["-vf", stage.video_filter])
+            raw = raw or stage.decodes_video
+
+            if not with_audio:
+                cmd.append("-an")
+
+            if not last:
+                cmd.extend(PIPE_VIDEO_ARGS if stage.decodes_video else ["-c:v", "copy"])
+                if with_audio:
+                    cmd.extend(PIPE_AUDIO_ARGS)
+                cmd.extend(PIPE_FORMAT_ARGS + ["pipe:1"])
+            else:
+                if raw:
+                    cmd.extend(profile.video_args(intermediate=intermediate))
+                else:
+                    cmd.extend(["-c:v", "copy"])
+                    if profile.faststart and not intermediate:
+                        cmd.extend(["-movflags", "+faststart"])
+                if with_audio:
+                    cmd.extend(["-c:a", "aac", "-b:a", "192k"])
+                cmd.append(output_file)
+            commands.append(cmd)
+        return commands
+
+    def run(self, output_file: str, profile: Optional[EncoderProfile] = None,
+            intermediate: bool = False, with_audio: bool = True) -> bool:
+        """
+        Run every stage at once, connected by pipes
+
+        Args:
+            output_file: Output file path
+            profile: Encoder profile of the output (optional)
+            intermediate: The output is rendered again later
+            with_audio: Whether to keep audio
+
+        Returns:
+            True if successful, False otherwise
+        """
+        stages = self.stages or [ChainStage("copy", decodes_video=False)]
+        processes = []
+        error_files = []
+        try:
+            commands = self.commands(output_file, profile, intermediate, with_audio)
+            logger.debug(f"FFmpeg chain: {' | '.join(' '.join(cmd) for cmd in commands)}")
+
+            upstream = None
+            for index, cmd in enumerate(commands):
+                # stderr goes to a file, a stage blocked on a full stderr pipe
+                # would stop reading stdin and stall the whole chain
+                error_file = tempfile.TemporaryFile()
+                error_files.append(error_file)
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=upstream.stdout if upstream else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE if index < len(commands) - 1 else subprocess.DEVNULL,
+                    stderr=error_file,
+                )
+                if upstream:
+                    # only the next stage holds the pipe, so it sees EOF and the
+                    # previous stage sees a broken pipe when either one exits
+                    upstream.stdout.close()
+                processes.append(process)
+                upstream = process
+
+            # a stage that exits early truncates its output without failing
+            # the stages after it, so every return code is checked
+            failed = False
+            for stage, process, error_file in zip(stages, processes, error_files):
+                process.wait()
+                error_file.seek(0)
+                error = error_file.read().decode("utf-8", errors="replace").strip()
+                if process.returncode != 0:
+                    failed = True
+                    logger.error(f"Error in {stage.name} stage: {error or process.returncode}")
+
+            if failed and os.path.exists(output_file):
+                os.remove(output_file)
+            return not failed
+        except Exception as e:
+            logger.error(f"Error running ffmpeg chain: {e}")
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            return False
+        finally:
+            for error_file in error_files:
+                error_file.close()
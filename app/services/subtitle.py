@@ -1,63 +1,65 @@
 import json
 import os.path
 import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from timeit import default_timer as timer
+from typing import Dict, List, Optional, Tuple
 
-from faster_whisper import WhisperModel
 from loguru import logger
 
 from app.config import config
+from app.services import alignment, whisper_pool
 from app.utils import utils
 
-model_size = config.whisper.get("model_size", "large-v3")
-device = config.whisper.get("device", "cpu")
-compute_type = config.whisper.get("compute_type", "int8")
-model = None
-
-
-def create(audio_file, subtitle_file: str = ""):
-    global model
-    if not model:
-        model_path = f"{utils.rootDir()}/models/whisper-{model_size}"
-        model_bin_file = f"{model_path}/model.bin"
-        if not os.path.isdir(model_path) or not os.path.isfile(model_bin_file):
-            model_path = model_size
-
-        logger.info(
-            f"loading model: {model_path}, device: {device}, compute_type: {compute_type}"
+# files waiting for the next create_batch run of create_queued
+_queued: List[Tuple[str, str, Future]] = []
+_queue_condition = threading.Condition()
+_batch_running = False
+
+
+def transcribe(model, audio_file, batch_size: int = 0):
+    """
+    Transcribe an audio file with word timestamps
+
+    Args:
+        model: WhisperModel borrowed from the whisper pool
+        audio_file: Audio file to transcribe
+        batch_size: Decode the speech chunks found by VAD in batches of this
+            size through faster-whisper's batched pipeline, 0 decodes sequentially
+
+    Returns:
+        List of segments
+    """
+    if batch_size > 0:
+        from faster_whisper import BatchedInferencePipeline
+
+        segments, info = BatchedInferencePipeline(model=model).transcribe(
+            audio_file,
+            beam_size=5,
+            word_timestamps=True,
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500),
+            batch_size=batch_size,
+        )
+    else:
+        segments, info = model.transcribe(
+            audio_file,
+            beam_size=5,
+            word_timestamps=True,
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=500),
         )
-        try:
-            model = WhisperModel(
-                model_size_or_path=model_path, device=device, compute_type=compute_type
-            )
-        except Exception as e:
-            logger.error(
-                f"failed to load model: {e} \n\n"
-                f"********************************************\n"
-                f"this may be caused by network issue. \n"
-                f"please download the model manually and put it in the 'models' folder. \n"
-                f"see [README.md FAQ](https://github.com/GiladLeef/ShortsTurbo) for more details.\n"
-                f"********************************************\n\n"
-            )
-            return None
-
-    logger.info(f"start, output file: {subtitle_file}")
-    if not subtitle_file:
-        subtitle_file = f"{audio_file}.srt"
-
-    segments, info = model.transcribe(
-        audio_file,
-        beam_size=5,
-        word_timestamps=True,
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=500),
-    )
 
     logger.info(
         f"detected language: '{info.language}', probability: {info.language_probability:.2f}"
     )
 
-    start = timer()
+    # segments is a generator, decoding happens while iterating it
+    return list(segments)
+
+
+def write_srt(segments, subtitle_file: str):
     subtitles = []
 
     def recognized(seg_text, seg_start, seg_end):
@@ -113,11 +115,6 @@ def create(audio_file, subtitle_file: str = ""):
 
         recognized(seg_text, seg_start, seg_end)
 
-    end = timer()
-
-    diff = end - start
-    logger.info(f"complete, elapsed: {diff:.2f} s")
-
     idx = 1
     lines = []
     for subtitle in subtitles:
@@ -136,6 +133,117 @@ def create(audio_file, subtitle_file: str = ""):
     logger.info(f"subtitle file created: {subtitle_file}")
 
 
+def create(audio_file, subtitle_file: str = ""):
+    logger.info(f"start, output file: {subtitle_file}")
+    if not subtitle_file:
+        subtitle_file = f"{audio_file}.srt"
+
+    start = timer()
+    try:
+        with whisper_pool.get_pool().acquire() as model:
+            segments = transcribe(model, audio_file)
+    except Exception as e:
+        logger.error(f"failed to transcribe {audio_file}: {str(e)}")
+        return None
+
+    logger.info(f"complete, elapsed: {timer() - start:.2f} s")
+    write_srt(segments, subtitle_file)
+
+
+def create_batch(audio_files: List[str], subtitle_files: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    Transcribe many audio files, tuned for throughput rather than per-file latency
+
+    Every model instance in the whisper pool gets its own worker, and each
+    file goes through the batched pipeline, which decodes the speech chunks
+    from its VAD pass in batches instead of one after another
+
+    Args:
+        audio_files: Audio files to transcribe
+        subtitle_files: Output SRT paths, defaults to "{audio_file}.srt"
+
+    Returns:
+        Dictionary of audio file to subtitle file, failed files are left out
+    """
+    if not subtitle_files:
+        subtitle_files = [f"{audio_file}.srt" for audio_file in audio_files]
+    if len(subtitle_files) != len(audio_files):
+        raise ValueError("audio_files and subtitle_files must have the same length")
+    if not audio_files:
+        return {}
+
+    pool = whisper_pool.get_pool()
+    batch_size = config.whisper.get("batch_size", 8)
+
+    def _create(audio_file, subtitle_file):
+        try:
+            with pool.acquire() as model:
+                segments = transcribe(model, audio_file, batch_size=batch_size)
+        except Exception as e:
+            logger.error(f"failed to transcribe {audio_file}: {str(e)}")
+            return None
+        write_srt(segments, subtitle_file)
+        return subtitle_file
+
+    start = timer()
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(pool.size, len(audio_files))) as executor:
+        futures = {
+            executor.submit(_create, audio_file, subtitle_file): audio_file
+            for audio_file, subtitle_file in zip(audio_files, subtitle_files)
+        }
+        for future in as_completed(futures):
+            subtitle_file = future.result()
+            if subtitle_file:
+                results[futures[future]] = subtitle_file
+
+    logger.info(
+        f"batch complete, {len(results)}/{len(audio_files)} files, elapsed: {timer() - start:.2f} s"
+    )
+    return results
+
+
+def create_queued(audio_file: str, subtitle_file: str = "") -> Optional[str]:
+    """
+    Transcribe one file through create_batch, together with the files other
+    tasks queue at the same time
+
+    While a batch runs, new files wait in a queue, the first caller to find
+    no batch running takes the whole queue as the next batch
+
+    Returns:
+        The subtitle file, None when the transcription failed
+    """
+    global _batch_running
+    subtitle_file = subtitle_file or f"{audio_file}.srt"
+    future = Future()
+    with _queue_condition:
+        _queued.append((audio_file, subtitle_file, future))
+        while _batch_running and not future.done():
+            _queue_condition.wait()
+        if future.done():
+            return future.result()
+        _batch_running = True
+        batch = list(_queued)
+        _queued.clear()
+
+    try:
+        results = create_batch(
+            [item[0] for item in batch], [item[1] for item in batch]
+        )
+        for queued_audio, _, queued_future in batch:
+            queued_future.set_result(results.get(queued_audio))
+    except Exception as e:
+        for _, _, queued_future in batch:
+            if not queued_future.done():
+                queued_future.set_exception(e)
+    finally:
+        with _queue_condition:
+            _batch_running = False
+            _queue_condition.notify_all()
+    return future.result()
+
+
 def file_to_subtitles(filename):
     if not filename or not os.path.isfile(filename):
         return []
@@ -159,29 +267,11 @@ def file_to_subtitles(filename):
 
 
 def levenshtein_distance(s1, s2):
-    if len(s1) < len(s2):
-        return levenshtein_distance(s2, s1)
-
-    if len(s2) == 0:
-        return len(s1)
-
-    previous_row = range(len(s2) + 1)
-    for i, c1 in enumerate(s1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(s2):
-            insertions = previous_row[j + 1] + 1
-            deletions = current_row[j] + 1
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
-
-    return previous_row[-1]
+    return alignment.edit_distance(s1, s2)
 
 
 def similarity(a, b):
-    distance = levenshtein_distance(a.lower(), b.lower())
-    max_length = max(len(a), len(b))
-    return 1 - (distance / max_length)
+    return alignment.similarity(a, b)
 
 
 def correct(subtitle_file, video_script):
@@ -207,18 +297,22 @@ def correct(subtitle_file, video_script):
             end_time = subtitle_items[subtitle_index][1].split(" --> ")[1]
             next_subtitle_index = subtitle_index + 1
 
+            # Grow the candidate one subtitle at a time, only the appended text is aligned
+            aligner = alignment.IncrementalDistance(script_line.lower())
+            aligner.extend(combined_subtitle.lower())
             while next_subtitle_index < len(subtitle_items):
                 next_subtitle = subtitle_items[next_subtitle_index][2].strip()
-                if similarity(
-                    script_line, combined_subtitle + " " + next_subtitle
-                ) > similarity(script_line, combined_subtitle):
+                candidate = aligner.copy()
+                candidate.extend(" " + next_subtitle.lower())
+                if candidate.similarity() > aligner.similarity():
+                    aligner = candidate
                     combined_subtitle += " " + next_subtitle
                     end_time = subtitle_items[next_subtitle_index][1].split(" --> ")[1]
                     next_subtitle_index += 1
                 else:
                     break
 
-            if similarity(script_line, combined_subtitle) > 0.8:
+            if aligner.similarity() > 0.8:
                 logger.warning(
                     f"Merged/Corrected - Script: {script_line}, Subtitle: {combined_subtitle}"
                 )
@@ -1,3 +1,4 @@
+import functools
 import math
 import os.path
 import re
@@ -8,8 +9,9 @@ from loguru import logger
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import material, subtitle, video, voice
+from app.services import material, stages, subtitle, video, voice
 from app.services import state as sm
+from app.services.manifest import TaskManifest
 from app.utils import utils
 
 
@@ -114,7 +116,8 @@ def generateSubtitle(taskId, params, videoScript, subMaker, audioFile):
             logger.warning("Subtitle file not found, fallback to whisper")
 
     if subtitleProvider == "whisper" or subtitleFallback:
-        subtitle.create(audio_file=audioFile, subtitle_file=subtitlePath)
+        # tasks in the subtitle stage at the same time share one batched transcription
+        subtitle.create_queued(audio_file=audioFile, subtitle_file=subtitlePath)
         logger.info("Correcting subtitle")
         subtitle.correct(subtitle_file=subtitlePath, video_script=videoScript)
 
@@ -126,7 +129,7 @@ def generateSubtitle(taskId, params, videoScript, subMaker, audioFile):
     return subtitlePath
 
 
-def getVideoMaterials(taskId, params, videoTerms, audioDuration):
+def getVideoMaterials(taskId, params, videoTerms, audioDuration, onDownloaded=None):
     if params.videoSource == "local":
         logger.info("Preprocessing local materials")
         materials = video.preprocess_video(
@@ -147,6 +150,7 @@ def getVideoMaterials(taskId, params, videoTerms, audioDuration):
             video_contact_mode=params.videoConcatMode,
             audio_duration=audioDuration * params.videoCount,
             max_clip_duration=params.videoClipDuration,
+            on_downloaded=onDownloaded,
         )
         if not downloadedVideos:
             sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
@@ -155,56 +159,118 @@ def getVideoMaterials(taskId, params, videoTerms, audioDuration):
         return downloadedVideos
 
 
-def generateFinalVideos(taskId, params, downloadedVideos, audioFile, subtitlePath):
+def generateFinalVideos(taskId, params, downloadedVideos, audioFile, subtitlePath, segmentPool=None):
     finalVideoPaths = []
-    combinedVideoPaths = []
     videoConcatMode = (
         params.videoConcatMode if params.videoCount == 1 else VideoConcatMode.random
     )
-    videoTransitionMode = params.videoTransitionMode
 
-    progress = 50
-    for i in range(params.videoCount):
-        index = i + 1
-        combinedVideoPath = path.join(
-            utils.taskDir(taskId), f"combined-{index}.mp4"
-        )
-        logger.info(f"Combining video: {index} => {combinedVideoPath}")
-        video.combine_videos(
-            combined_video_path=combinedVideoPath,
+    if params.videoCount > 1:
+        # Variants share one normalized segment pool and only differ in ordering
+        def onVariantRendered(count):
+            sm.state.update_task(taskId, progress=50 + 50 * count / params.videoCount)
+
+        finalVideoPaths = video.render_variants(
+            output_files=[
+                path.join(utils.taskDir(taskId), f"final-{i + 1}.mp4")
+                for i in range(params.videoCount)
+            ],
             video_paths=downloadedVideos,
             audio_file=audioFile,
-            video_aspect=params.videoAspect,
+            subtitle_path=subtitlePath,
+            params=params,
             video_concat_mode=videoConcatMode,
-            video_transition_mode=videoTransitionMode,
-            max_clip_duration=params.videoClipDuration,
-            threads=params.nThreads,
+            progress_callback=onVariantRendered,
+            segment_pool=segmentPool,
         )
+        return finalVideoPaths, []
 
-        progress += 50 / params.videoCount / 2
-        sm.state.update_task(taskId, progress=progress)
-
+    progress = 50
+    for i in range(params.videoCount):
+        index = i + 1
         finalVideoPath = path.join(utils.taskDir(taskId), f"final-{index}.mp4")
 
-        logger.info(f"Generating video: {index} => {finalVideoPath}")
-        video.generate_video(
-            video_path=combinedVideoPath,
-            audio_path=audioFile,
-            subtitle_path=subtitlePath,
+        logger.info(f"Rendering video: {index} => {finalVideoPath}")
+        if video.render_video(
             output_file=finalVideoPath,
+            video_paths=downloadedVideos,
+            audio_file=audioFile,
+            subtitle_path=subtitlePath,
             params=params,
-        )
+            video_concat_mode=videoConcatMode,
+        ):
+            finalVideoPaths.append(finalVideoPath)
 
-        progress += 50 / params.videoCount / 2
+        progress += 50 / params.videoCount
         sm.state.update_task(taskId, progress=progress)
 
-        finalVideoPaths.append(finalVideoPath)
-        combinedVideoPaths.append(combinedVideoPath)
+    # Final videos are rendered in a single pass, there are no combined intermediates
+    return finalVideoPaths, []
+
+
+def stopTask(taskId, ctx, **result):
+    sm.state.update_task(
+        taskId, state=const.TASK_STATE_COMPLETE, progress=100, **result
+    )
+    ctx["result"] = result
+    return False
+
+
+def failTask(taskId):
+    sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
+    return False
+
+
+def stageInputs(stage, params, ctx):
+    """
+    Everything a stage's output depends on, upstream stages enter through their digest
+    """
+    manifest = ctx["manifest"]
+    if stage == stages.STAGE_TTS:
+        return {
+            "script": ctx["script"],
+            "voice": params.voiceName,
+            "rate": params.voiceRate,
+        }
+    if stage == stages.STAGE_SUBTITLE:
+        return {
+            "audio": manifest.digest(stages.STAGE_TTS),
+            "enabled": params.subtitleEnabled,
+            "provider": config.app.get("subtitle_provider", "edge"),
+        }
+    if stage == stages.STAGE_MATERIALS:
+        return {
+            "terms": ctx["terms"],
+            "source": params.videoSource,
+            "materials": getattr(params, "videoMaterials", None),
+            "aspect": params.videoAspect,
+            "concat_mode": params.videoConcatMode,
+            "clip_duration": params.videoClipDuration,
+            "count": params.videoCount,
+            "audio_duration": ctx["audio_duration"],
+        }
+    return {
+        "audio": manifest.digest(stages.STAGE_TTS),
+        "subtitle": manifest.digest(stages.STAGE_SUBTITLE),
+        "materials": manifest.digest(stages.STAGE_MATERIALS),
+        "params": params.model_dump(warnings=False),
+        # the configured default profile is not part of params
+        "encoder": vars(video.get_task_profile(params)),
+    }
+
 
-    return finalVideoPaths, combinedVideoPaths
+def finishedStage(stage, params, ctx):
+    """
+    Outputs of an earlier run of this stage that are still valid, or None
+    """
+    return ctx["manifest"].lookup(stage, stageInputs(stage, params, ctx))
 
 
-def start(taskId, params: VideoParams, stopAt: str = "video"):
+def isStageFinished(stage, params, ctx):
+    return finishedStage(stage, params, ctx) is not None
+
+
+def prepareStep(taskId, params, stopAt, ctx):
     logger.info(f"Starting task: {taskId}, stop at: {stopAt}")
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=5)
 
@@ -213,100 +279,207 @@ def start(taskId, params: VideoParams, stopAt: str = "video"):
 
     videoScript = generateScript(taskId, params)
     if not videoScript or "Error: " in videoScript:
-        sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
-        return
+        return failTask(taskId)
+    ctx["script"] = videoScript
 
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=10)
 
     if stopAt == "script":
-        sm.state.update_task(
-            taskId, state=const.TASK_STATE_COMPLETE, progress=100, script=videoScript
-        )
-        return {"script": videoScript}
+        return stopTask(taskId, ctx, script=videoScript)
 
     videoTerms = ""
     if params.videoSource != "local":
         videoTerms = generateTerms(taskId, params, videoScript)
         if not videoTerms:
-            sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
-            return
+            return failTask(taskId)
+    ctx["terms"] = videoTerms
 
     saveScriptData(taskId, videoScript, videoTerms, params)
 
     if stopAt == "terms":
-        sm.state.update_task(
-            taskId, state=const.TASK_STATE_COMPLETE, progress=100, terms=videoTerms
-        )
-        return {"script": videoScript, "terms": videoTerms}
+        return stopTask(taskId, ctx, script=videoScript, terms=videoTerms)
 
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=20)
+    return True
 
-    audioFile, audioDuration, subMaker = generateAudio(taskId, params, videoScript)
-    if not audioFile:
-        sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
-        return
+
+def audioStep(taskId, params, stopAt, ctx):
+    outputs = finishedStage(stages.STAGE_TTS, params, ctx)
+    if outputs:
+        logger.info("Reusing the audio of an earlier run")
+        audioFile, audioDuration = outputs["audio_file"], outputs["audio_duration"]
+        subMaker = voice.sub_maker_from_dict(outputs["sub_maker"])
+    else:
+        audioFile, audioDuration, subMaker = generateAudio(taskId, params, ctx["script"])
+        if not audioFile:
+            return failTask(taskId)
+        ctx["manifest"].record(
+            stages.STAGE_TTS,
+            stageInputs(stages.STAGE_TTS, params, ctx),
+            {
+                "audio_file": audioFile,
+                "audio_duration": audioDuration,
+                "sub_maker": voice.sub_maker_to_dict(subMaker),
+            },
+            [audioFile],
+        )
+    ctx.update(audio_file=audioFile, audio_duration=audioDuration, sub_maker=subMaker)
 
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=30)
 
     if stopAt == "audio":
         sm.state.update_task(
-            taskId,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            audio_file=audioFile,
+            taskId, state=const.TASK_STATE_COMPLETE, progress=100, audio_file=audioFile
         )
-        return {"audio_file": audioFile, "audio_duration": audioDuration}
+        ctx["result"] = {"audio_file": audioFile, "audio_duration": audioDuration}
+        return False
+    return True
 
-    subtitlePath = generateSubtitle(taskId, params, videoScript, subMaker, audioFile)
 
-    if stopAt == "subtitle":
-        sm.state.update_task(
-            taskId,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitlePath,
+def subtitleStep(taskId, params, stopAt, ctx):
+    outputs = finishedStage(stages.STAGE_SUBTITLE, params, ctx)
+    if outputs:
+        logger.info("Reusing the subtitle of an earlier run")
+        ctx["subtitle_path"] = outputs["subtitle_path"]
+    else:
+        ctx["subtitle_path"] = generateSubtitle(
+            taskId, params, ctx["script"], ctx["sub_maker"], ctx["audio_file"]
         )
-        return {"subtitle_path": subtitlePath}
+        ctx["manifest"].record(
+            stages.STAGE_SUBTITLE,
+            stageInputs(stages.STAGE_SUBTITLE, params, ctx),
+            {"subtitle_path": ctx["subtitle_path"]},
+            [ctx["subtitle_path"]],
+        )
+
+    if stopAt == "subtitle":
+        return stopTask(taskId, ctx, subtitle_path=ctx["subtitle_path"])
 
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=40)
+    return True
 
-    downloadedVideos = getVideoMaterials(taskId, params, videoTerms, audioDuration)
-    if not downloadedVideos:
-        sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
-        return
 
-    if stopAt == "materials":
-        sm.state.update_task(
-            taskId,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloadedVideos,
+def materialsStep(taskId, params, stopAt, ctx):
+    outputs = finishedStage(stages.STAGE_MATERIALS, params, ctx)
+    if outputs:
+        logger.info("Reusing the materials of an earlier run")
+        downloadedVideos = outputs["materials"]
+    else:
+        segmentPool = None
+        if params.videoCount > 1 and params.videoSource != "local" and stopAt == "video":
+            # variants are rendered from a shared pool, normalize each clip while the rest downloads.
+            # The encodes queue on the render stage so they count against its CPU limit
+            segmentPool = video.create_segment_pool(
+                utils.taskDir(taskId), params,
+                submit=functools.partial(
+                    stages.get_scheduler().submit, stages.STAGE_RENDER, ctx["priority"]
+                ),
+            )
+            ctx["segment_pool"] = segmentPool
+        downloadedVideos = getVideoMaterials(
+            taskId, params, ctx["terms"], ctx["audio_duration"],
+            onDownloaded=segmentPool.add_source if segmentPool else None,
+        )
+        if segmentPool:
+            segmentPool.seal()
+        if not downloadedVideos:
+            return failTask(taskId)
+        ctx["manifest"].record(
+            stages.STAGE_MATERIALS,
+            stageInputs(stages.STAGE_MATERIALS, params, ctx),
+            {"materials": downloadedVideos},
+            downloadedVideos,
         )
-        return {"materials": downloadedVideos}
+    ctx["materials"] = downloadedVideos
+
+    if stopAt == "materials":
+        return stopTask(taskId, ctx, materials=downloadedVideos)
 
     sm.state.update_task(taskId, state=const.TASK_STATE_PROCESSING, progress=50)
+    if ctx.get("segment_pool"):
+        # render once the pool is complete, a render slot waiting for normalize
+        # jobs queued behind it on the same stage could wait forever
+        return ctx["segment_pool"].when_done()
+    return True
+
+
+def renderStep(taskId, params, stopAt, ctx):
+    outputs = finishedStage(stages.STAGE_RENDER, params, ctx)
+    if outputs:
+        logger.info("Reusing the videos of an earlier run")
+        finalVideoPaths, combinedVideoPaths = outputs["videos"], outputs["combined_videos"]
+    else:
+        finalVideoPaths, combinedVideoPaths = generateFinalVideos(
+            taskId, params, ctx["materials"], ctx["audio_file"], ctx["subtitle_path"],
+            segmentPool=ctx.pop("segment_pool", None),
+        )
+        if not finalVideoPaths:
+            return failTask(taskId)
+        ctx["manifest"].record(
+            stages.STAGE_RENDER,
+            stageInputs(stages.STAGE_RENDER, params, ctx),
+            {"videos": finalVideoPaths, "combined_videos": combinedVideoPaths},
+            finalVideoPaths + combinedVideoPaths,
+        )
+
+    logger.success(f"Task {taskId} finished, generated {len(finalVideoPaths)} videos")
 
-    finalVideoPaths, combinedVideoPaths = generateFinalVideos(
-        taskId, params, downloadedVideos, audioFile, subtitlePath
+    return stopTask(
+        taskId,
+        ctx,
+        videos=finalVideoPaths,
+        combined_videos=combinedVideoPaths,
+        script=ctx["script"],
+        terms=ctx["terms"],
+        audio_file=ctx["audio_file"],
+        audio_duration=ctx["audio_duration"],
+        subtitle_path=ctx["subtitle_path"],
+        materials=ctx["materials"],
     )
 
-    if not finalVideoPaths:
-        sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
-        return
 
-    logger.success(f"Task {taskId} finished, generated {len(finalVideoPaths)} videos")
+# Script and terms are cheap and run inline, every other step waits in the queue
+# of its stage unless the manifest shows it already finished
+PIPELINE = [
+    (None, prepareStep),
+    (stages.STAGE_TTS, audioStep),
+    (stages.STAGE_SUBTITLE, subtitleStep),
+    (stages.STAGE_MATERIALS, materialsStep),
+    (stages.STAGE_RENDER, renderStep),
+]
+
+
+def submit(taskId, params: VideoParams, stopAt: str = "video",
+           priority: int = const.TASK_PRIORITY_NORMAL):
+    """
+    Queue a task on the stage pipeline without waiting for it
+
+    Returns:
+        A future resolved with the same result start returns
+    """
+    ctx = {"result": None, "manifest": TaskManifest(taskId), "priority": priority}
+    steps = [
+        (
+            stage,
+            functools.partial(step, taskId, params, stopAt, ctx),
+            functools.partial(isStageFinished, stage, params, ctx),
+        )
+        for stage, step in PIPELINE
+    ]
+    future = stages.get_scheduler().run(steps, ctx, priority=priority)
+
+    def onDone(f):
+        # a pool filled during the download but never rendered from still holds temp clips
+        if ctx.get("segment_pool"):
+            ctx.pop("segment_pool").close()
+        if f.exception() is not None:
+            logger.opt(exception=f.exception()).error(f"Task {taskId} failed")
+            sm.state.update_task(taskId, state=const.TASK_STATE_FAILED)
 
-    kwargs = {
-        "videos": finalVideoPaths,
-        "combined_videos": combinedVideoPaths,
-        "script": videoScript,
-        "terms": videoTerms,
-        "audio_file": audioFile,
-        "audio_duration": audioDuration,
-        "subtitle_path": subtitlePath,
-        "materials": downloadedVideos,
-    }
-    sm.state.update_task(
-        taskId, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
-    )
-    return kwargs
+    future.add_done_callback(onDone)
+    return future
+
+
+def start(taskId, params: VideoParams, stopAt: str = "video",
+          priority: int = const.TASK_PRIORITY_NORMAL):
+    return submit(taskId, params, stopAt, priority).result()
@@ -1,12 +1,13 @@
 import glob
 import os
 import random
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from loguru import logger
 
-import ffmpeg
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
@@ -16,7 +17,17 @@ from app.models.schema import (
     VideoTransitionMode,
 )
 from app.utils import utils
+from app.services import probe_cache
+from app.services.encoder import EncoderProfile, get_profile
 from app.services.ffmpeg_wrapper import FFmpegWrapper
+from app.services.file_cache import FileCache, fingerprint_file, make_key
+from app.services.render_graph import RenderGraph
+from app.services.stream_chain import StreamChain
+
+segment_cache = FileCache(
+    "cache_segments", config.app.get("segment_cache_max_size_mb", 2048)
+)
+
 
 class SubClippedVideoClip:
     def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None):
@@ -64,269 +75,549 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
     return ""
 
 
-def combine_videos(
-    combined_video_path: str,
-    video_paths: List[str],
-    audio_file: str,
-    video_aspect: VideoAspect = VideoAspect.portrait,
+def get_transition_type(video_transition_mode: VideoTransitionMode = None) -> str:
+    if not video_transition_mode or video_transition_mode.value == VideoTransitionMode.none.value:
+        return ""
+    if video_transition_mode.value == VideoTransitionMode.fadeIn.value:
+        return "fadein"
+    if video_transition_mode.value == VideoTransitionMode.fadeOut.value:
+        return "fadeout"
+    return "fade"
+
+
+def split_source(
+    video_path: str,
+    info: probe_cache.MediaInfo,
     video_concat_mode: VideoConcatMode = VideoConcatMode.random,
-    video_transition_mode: VideoTransitionMode = None,
     max_clip_duration: int = 5,
-    threads: int = 2,
-) -> str:
-    # For performance, use direct FFMPEG concatenation instead of frame-by-frame processing
-    # when transitions are not needed
-    use_direct_ffmpeg = (video_transition_mode is None or 
-                        video_transition_mode.value == VideoTransitionMode.none.value)
-    
-    # Get audio duration using FFmpegWrapper
-    audio_duration = FFmpegWrapper.get_video_duration(audio_file)
-    logger.info(f"audio duration: {audio_duration} seconds")
-    logger.info(f"maximum clip duration: {max_clip_duration} seconds")
-    
-    output_dir = os.path.dirname(combined_video_path)
+) -> List[SubClippedVideoClip]:
+    # Split a source into clips of at most max_clip_duration seconds
+    subclipped_items = []
+    clip_duration = info.duration
+    start_time = 0
+    while start_time < clip_duration:
+        end_time = min(start_time + max_clip_duration, clip_duration)
+        if clip_duration - start_time >= 1.0:  # At least 1 second long segments
+            subclipped_items.append(SubClippedVideoClip(
+                file_path=video_path, 
+                start_time=start_time, 
+                end_time=end_time, 
+                width=info.width, 
+                height=info.height))
+        start_time = end_time
+        if video_concat_mode.value == VideoConcatMode.sequential.value:
+            break
+    return subclipped_items
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
 
-    # Prepare video clips information
-    subclipped_items = []
-    for video_path in video_paths:
-        try:
-            clip_info = ffmpeg.probe(video_path)
-            video_stream = next((s for s in clip_info['streams'] if s['codec_type'] == 'video'), None)
-            if video_stream:
-                clip_duration = float(clip_info['format']['duration'])
-                clip_w = int(video_stream['width'])
-                clip_h = int(video_stream['height'])
-                
-                start_time = 0
-                while start_time < clip_duration:
-                    end_time = min(start_time + max_clip_duration, clip_duration)
-                    if clip_duration - start_time >= 1.0:  # At least 1 second long segments
-                        subclipped_items.append(SubClippedVideoClip(
-                            file_path=video_path, 
-                            start_time=start_time, 
-                            end_time=end_time, 
-                            width=clip_w, 
-                            height=clip_h))
-                    start_time = end_time
-                    if video_concat_mode.value == VideoConcatMode.sequential.value:
-                        break
-        except Exception as e:
-            logger.error(f"Error analyzing video {video_path}: {str(e)}")
-            continue
+def select_segments(
+    subclipped_items: List[SubClippedVideoClip],
+    audio_duration: float,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    max_clip_duration: int = 5,
+) -> List[SubClippedVideoClip]:
+    subclipped_items = list(subclipped_items)
 
     # Random order for clips if requested
     if video_concat_mode.value == VideoConcatMode.random.value:
         random.shuffle(subclipped_items)
         
     logger.debug(f"total subclipped items: {len(subclipped_items)}")
-    
-    # Process as many clips as needed to match audio duration
-    processed_clips = []
+
+    # Keep as many clips as needed to match audio duration
+    planned_items = []
     video_duration = 0
-    
-    # Using optimized FFmpeg approach
-    logger.info("Using optimized direct FFMPEG concatenation")
-    
-    # Function to prepare a clip segment with FFMPEG
-    def prepare_clip_segment(idx, item):
-        try:
-            output_file = f"{output_dir}/temp-clip-{idx}.mp4"
-            
-            # Get segment duration
-            segment_duration = min(item.end_time - item.start_time, max_clip_duration)
-            
-            # Use FFmpegWrapper to trim the video
-            if not FFmpegWrapper.trim_video(
-                input_file=item.file_path,
-                output_file=output_file,
-                start_time=item.start_time,
-                duration=segment_duration,
-                fast_seek=True
-            ):
-                return idx, None, 0
-            
-            # Resize the video if needed
-            if item.width != video_width or item.height != video_height:
-                resized_file = f"{output_dir}/temp-resized-{idx}.mp4"
-                if not FFmpegWrapper.resize_video(
-                    input_file=output_file,
-                    output_file=resized_file,
-                    width=video_width,
-                    height=video_height,
-                    maintain_aspect_ratio=True,
-                    pad=True
-                ):
-                    return idx, None, 0
-                
-                # Replace the original output file with the resized one
-                delete_files(output_file)
-                os.rename(resized_file, output_file)
-            
-            # Apply transition if needed
-            if video_transition_mode and video_transition_mode.value != VideoTransitionMode.none.value:
-                transition_file = f"{output_dir}/temp-transition-{idx}.mp4"
-                
-                if video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                    transition_type = "fadein"
-                elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                    transition_type = "fadeout"
-                else:
-                    transition_type = "fade"
-                    
-                if not FFmpegWrapper.apply_transition(
-                    input_file=output_file,
-                    output_file=transition_file,
-                    transition_type=transition_type,
-                    duration=1.0
-                ):
-                    return idx, None, 0
-                
-                # Replace the original output file with the transitioned one
-                delete_files(output_file)
-                os.rename(transition_file, output_file)
-            
-            return idx, output_file, segment_duration
-        except Exception as e:
-            logger.error(f"Error preparing clip segment {idx}: {str(e)}")
-            return idx, None, 0
-    
-    # Process clips in parallel using ThreadPoolExecutor
-    max_workers = min(os.cpu_count() or 4, 8)  # Use up to 8 worker threads
-    logger.info(f"Processing video segments using {max_workers} parallel workers")
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for i, item in enumerate(subclipped_items):
-            if video_duration >= audio_duration:
-                break
-            futures.append(executor.submit(prepare_clip_segment, i, item))
-            video_duration += min(item.end_time - item.start_time, max_clip_duration)
-        
-        # Collect results as they complete
-        for future in as_completed(futures):
-            idx, output_file, duration = future.result()
-            if output_file:
-                processed_clips.append((idx, output_file, duration))
-    
-    # Sort clips by index to maintain order
-    processed_clips.sort()
-    processed_clips = [clip[1] for clip in processed_clips]
-    
-    if not processed_clips:
-        logger.warning("No clips available for combining")
+    for item in subclipped_items:
+        if video_duration >= audio_duration:
+            break
+        planned_items.append(item)
+        video_duration += min(item.end_time - item.start_time, max_clip_duration)
+    return planned_items
+
+
+def plan_segments(
+    video_paths: List[str],
+    audio_duration: float,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    max_clip_duration: int = 5,
+) -> List[SubClippedVideoClip]:
+    subclipped_items = []
+    media_infos = probe_cache.probe_many(video_paths)
+    for video_path in video_paths:
+        info = media_infos.get(video_path)
+        if not info or not info.has_video:
+            logger.error(f"Error analyzing video {video_path}")
+            continue
+        subclipped_items.extend(
+            split_source(video_path, info, video_concat_mode, max_clip_duration)
+        )
+
+    return select_segments(
+        subclipped_items, audio_duration, video_concat_mode, max_clip_duration
+    )
+
+
+def normalize_segment(
+    item: SubClippedVideoClip,
+    output_file: str,
+    width: int,
+    height: int,
+    duration: float,
+    transition_type: str = "",
+    profile: Optional[EncoderProfile] = None,
+) -> bool:
+    profile = profile or get_profile()
+    # Clips that already match the target only re-encode their edge GOPs
+    if not transition_type and item.width == width and item.height == height:
+        return FFmpegWrapper.smart_trim_video(
+            input_file=item.file_path,
+            output_file=output_file,
+            start_time=item.start_time,
+            duration=duration,
+            width=width,
+            height=height,
+            profile=profile
+        )
+
+    # Trim, resize and fade as one piped chain so only the segment is written
+    chain = StreamChain(item.file_path).trim(item.start_time, duration)
+    if item.width != width or item.height != height:
+        chain.resize(width, height, maintain_aspect_ratio=True, pad=True)
+    if transition_type:
+        chain.transition(transition_type, duration=1.0)
+    return chain.run(output_file, profile, intermediate=True)
+
+
+def is_cached_segment(file_path: str) -> bool:
+    return os.path.dirname(os.path.abspath(file_path)) == segment_cache.cache_dir
+
+
+def segment_cache_key(
+    item: SubClippedVideoClip,
+    width: int,
+    height: int,
+    duration: float,
+    transition_type: str,
+    profile: EncoderProfile,
+) -> str:
+    return make_key(
+        fingerprint_file(item.file_path),
+        item.start_time,
+        duration,
+        width,
+        height,
+        transition_type,
+        profile.cache_key(),
+    )
+
+
+def find_normalized_segment(
+    item: SubClippedVideoClip,
+    width: int,
+    height: int,
+    duration: float,
+    profile: EncoderProfile,
+) -> str:
+    """
+    Pinned path of an already normalized copy of a clip, or "" when it is not cached
+    """
+    if not config.app.get("enable_segment_cache", True):
         return ""
-    
-    # Concatenate clips using FFmpeg wrapper
-    logger.info("Concatenating video segments with FFmpeg")
-    
-    # If we have only one clip, just add audio to it
-    if len(processed_clips) == 1:
-        logger.info("Only one clip to process, adding audio directly")
-        if not FFmpegWrapper.add_audio(
-            video_file=processed_clips[0],
-            audio_file=audio_file,
-            output_file=combined_video_path,
-            volume=1.0
-        ):
-            logger.error("Failed to add audio to the single clip")
-            delete_files(processed_clips)
-            return ""
-        
-        logger.info("Video generation completed successfully")
-        delete_files(processed_clips)
-        return combined_video_path
-    
-    # For multiple clips, concatenate them first
-    temp_concat_video = f"{output_dir}/temp-concat-video.mp4"
-    if not FFmpegWrapper.concat_videos(
-        input_files=processed_clips,
-        output_file=temp_concat_video,
-        with_audio=False
-    ):
-        logger.error("Failed to concatenate video clips")
-        delete_files(processed_clips)
+    try:
+        cache_key = segment_cache_key(item, width, height, duration, "", profile)
+    except OSError:
         return ""
-    
-    # Add audio to the concatenated video
-    if not FFmpegWrapper.add_audio(
-        video_file=temp_concat_video,
-        audio_file=audio_file,
-        output_file=combined_video_path,
-        volume=1.0
-    ):
-        logger.error("Failed to add audio to the concatenated video")
-        delete_files(processed_clips + [temp_concat_video])
+    return segment_cache.get(cache_key, pin=True) or ""
+
+
+def get_normalized_segment(
+    item: SubClippedVideoClip,
+    output_file: str,
+    width: int,
+    height: int,
+    duration: float,
+    transition_type: str = "",
+    profile: Optional[EncoderProfile] = None,
+    pin: bool = False,
+) -> str:
+    """
+    Return a trimmed, resized and faded copy of a clip, served from the
+    segment cache when the same source range was normalized before
+
+    With pin, a cached result is kept from eviction until release_segment()
+    """
+    profile = profile or get_profile()
+    if not config.app.get("enable_segment_cache", True):
+        return output_file if normalize_segment(
+            item, output_file, width, height, duration, transition_type, profile
+        ) else ""
+
+    cache_key = segment_cache_key(item, width, height, duration, transition_type, profile)
+    cached_file = segment_cache.get(cache_key, pin=pin)
+    if cached_file:
+        logger.debug(f"segment cache hit: {item}")
+        return cached_file
+
+    if not normalize_segment(item, output_file, width, height, duration, transition_type, profile):
         return ""
-    
-    # Clean up temporary files
-    delete_files(processed_clips + [temp_concat_video])
-    
-    logger.info("Video combining completed successfully")
-    return combined_video_path
+    return segment_cache.put(cache_key, output_file, pin=pin)
 
 
-def generate_video(
-    video_path: str,
-    audio_path: str,
+def release_segment(file_path: str):
+    """
+    Unpin a cached segment, or delete a segment that was not cached
+    """
+    if is_cached_segment(file_path):
+        segment_cache.unpin(file_path)
+    else:
+        delete_files(file_path)
+
+
+class SegmentPool:
+    """
+    Normalized segments shared by every variant rendered for a task. Each
+    source range is trimmed and scaled once, variants only reorder the pool.
+
+    Sources can be added while they are still downloading, call seal() once
+    the last one has been added.
+
+    The encodes run on a private thread pool, or through submit when they have
+    to share a CPU limit with other work, such as the render stage's pool.
+    """
+
+    def __init__(self, output_dir: str, width: int, height: int,
+                 max_clip_duration: int = 5, max_workers: int = None,
+                 profile: Optional[EncoderProfile] = None,
+                 submit: Optional[Callable[..., Future]] = None):
+        self.output_dir = output_dir
+        self.width = width
+        self.height = height
+        self.max_clip_duration = max_clip_duration
+        self.profile = profile or get_profile()
+        self.executor = None
+        if submit is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers or min(os.cpu_count() or 4, 8)
+            )
+            submit = self.executor.submit
+        self.submit = submit
+        self.futures = []
+        self.sealed = False
+        self.done = Future()
+        self.condition = threading.Condition()
+
+    def add(self, item: SubClippedVideoClip):
+        with self.condition:
+            idx = len(self.futures)
+            future = self.submit(self._normalize, idx, item)
+            self.futures.append(future)
+        future.add_done_callback(self._notify)
+
+    def add_source(self, video_path: str,
+                   video_concat_mode: VideoConcatMode = VideoConcatMode.random):
+        """
+        Probe a downloaded source and queue its clips right away
+        """
+        try:
+            info = probe_cache.media_info(video_path)
+        except Exception as e:
+            logger.error(f"Error analyzing video {video_path}: {str(e)}")
+            return
+        if not info or not info.has_video:
+            logger.error(f"Error analyzing video {video_path}")
+            return
+        for item in split_source(video_path, info, video_concat_mode, self.max_clip_duration):
+            self.add(item)
+
+    def seal(self):
+        with self.condition:
+            self.sealed = True
+            self.condition.notify_all()
+        self._check_done()
+
+    def when_done(self) -> Future:
+        """
+        A future resolved with True once the pool is sealed and every added clip is done
+        """
+        return self.done
+
+    def _notify(self, future):
+        with self.condition:
+            self.condition.notify_all()
+        self._check_done()
+
+    def _check_done(self):
+        with self.condition:
+            if self.done.running() or self.done.done():
+                return
+            if not self.sealed or not all(future.done() for future in self.futures):
+                return
+            # claims the future, its callbacks then run outside the lock
+            self.done.set_running_or_notify_cancel()
+        self.done.set_result(True)
+
+    def _normalize(self, idx: int, item: SubClippedVideoClip):
+        try:
+            duration = min(item.end_time - item.start_time, self.max_clip_duration)
+            output_file = get_normalized_segment(
+                item,
+                f"{self.output_dir}/pool-clip-{idx}.mp4",
+                self.width,
+                self.height,
+                duration,
+                profile=self.profile,
+                pin=True,
+            )
+            if not output_file:
+                return None
+            return SubClippedVideoClip(
+                file_path=output_file,
+                start_time=0,
+                end_time=duration,
+                width=self.width,
+                height=self.height,
+            )
+        except Exception as e:
+            logger.error(f"Error normalizing pool segment {idx}: {str(e)}")
+            return None
+
+    def wait_for(self, duration: float) -> List[SubClippedVideoClip]:
+        """
+        Wait until the leading finished segments cover duration seconds, or
+        until every clip is done once the pool is sealed
+
+        Returns:
+            The normalized segments of that leading run, in insertion order
+        """
+        with self.condition:
+            while True:
+                ready = []
+                for future in self.futures:
+                    if not future.done():
+                        break
+                    ready.append(future.result())
+                segments = [item for item in ready if item]
+                covered = sum(item.end_time - item.start_time for item in segments)
+                if covered >= duration or (self.sealed and len(ready) == len(self.futures)):
+                    return self._touch(segments)
+                self.condition.wait()
+
+    def segments(self) -> List[SubClippedVideoClip]:
+        """
+        Wait for every added clip and return the normalized ones in insertion order
+        """
+        results = [future.result() for future in self.futures]
+        return self._touch([item for item in results if item])
+
+    def _touch(self, segments: List[SubClippedVideoClip]) -> List[SubClippedVideoClip]:
+        # pins only hold in this process, a fresh mtime keeps other workers from evicting them
+        for item in segments:
+            if is_cached_segment(item.file_path):
+                segment_cache.touch(item.file_path)
+        return segments
+
+    def close(self):
+        self.seal()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        for future in self.futures:
+            item = future.result()
+            if item:
+                release_segment(item.file_path)
+
+
+def get_task_profile(params: VideoParams) -> EncoderProfile:
+    return get_profile(params.encoderProfile, params.nThreads)
+
+
+def create_segment_pool(output_dir: str, params: VideoParams,
+                        submit: Optional[Callable[..., Future]] = None) -> SegmentPool:
+    aspect = VideoAspect(params.videoAspect)
+    video_width, video_height = aspect.to_resolution()
+    return SegmentPool(
+        output_dir, video_width, video_height, params.videoClipDuration,
+        profile=get_task_profile(params),
+        submit=submit,
+    )
+
+
+def build_render_graph(
+    segments: List[SubClippedVideoClip],
+    audio_file: str,
+    audio_duration: float,
     subtitle_path: str,
+    params: VideoParams,
+) -> RenderGraph:
+    aspect = VideoAspect(params.videoAspect)
+    video_width, video_height = aspect.to_resolution()
+
+    graph = RenderGraph(
+        video_width,
+        video_height,
+        duration=audio_duration or None,
+        profile=get_task_profile(params),
+    )
+    for item in segments:
+        graph.add_segment(
+            item.file_path,
+            item.start_time,
+            min(item.end_time - item.start_time, params.videoClipDuration),
+        )
+    graph.set_transition(get_transition_type(params.videoTransitionMode))
+    graph.set_audio(
+        audio_file,
+        voice_volume=params.voiceVolume,
+        bgm_file=get_bgm_file(bgm_type=params.bgmType, bgm_file=params.bgmFile),
+        bgm_volume=params.bgmVolume,
+    )
+
+    if params.subtitleEnabled and subtitle_path:
+        style, _ = FFmpegWrapper.build_subtitle_style(
+            video_width,
+            video_height,
+            font=params.fontName or "STHeitiMedium.ttc",
+            font_size=params.fontSize,
+            font_color=params.textForeColor,
+            position=params.subtitlePosition,
+            outline_color=params.strokeColor,
+            outline_width=params.strokeWidth,
+        )
+        graph.set_subtitles(subtitle_path, style, fonts_dir=utils.fontDir())
+
+    return graph
+
+
+def render_video(
     output_file: str,
+    video_paths: List[str],
+    audio_file: str,
+    subtitle_path: str,
     params: VideoParams,
-):
-    aspect = VideoAspect(params.video_aspect)
+    video_concat_mode: VideoConcatMode = None,
+) -> str:
+    """
+    Render the final video straight from the source clips in a single ffmpeg pass
+
+    Source ranges that an earlier task already normalized are read from the
+    segment cache instead, which skips decoding and scaling the full size
+    source. Misses are not normalized here, that would add an encode
+    """
+    aspect = VideoAspect(params.videoAspect)
     video_width, video_height = aspect.to_resolution()
+    if video_concat_mode is None:
+        video_concat_mode = params.videoConcatMode
 
-    logger.info(f"Generating video: {video_width} x {video_height}")
-    logger.info(f"  ① video: {video_path}")
-    logger.info(f"  ② audio: {audio_path}")
+    audio_duration = FFmpegWrapper.get_video_duration(audio_file)
+    logger.info(f"Rendering video: {video_width} x {video_height}, audio duration: {audio_duration} seconds")
+    logger.info(f"  ① sources: {len(video_paths)}")
+    logger.info(f"  ② audio: {audio_file}")
     logger.info(f"  ③ subtitle: {subtitle_path}")
     logger.info(f"  ④ output: {output_file}")
 
-    # Get directory for temp files
-    output_dir = os.path.dirname(output_file)
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Check if subtitles are enabled and font is available
-    font_path = ""
-    if params.subtitle_enabled:
-        if not params.font_name:
-            params.font_name = "STHeitiMedium.ttc"
-        font_path = os.path.join(utils.fontDir(), params.font_name)
-        # Use os.path.normpath for cross-platform path normalization
-        font_path = os.path.normpath(font_path)
-        logger.info(f"  ⑤ font: {font_path}")
-    
-    # Check for background music
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    
-    # Generate the video using FFmpegWrapper's complete video generation function
-    result = FFmpegWrapper.generate_video_from_script(
-        video_clips=[video_path],
-        audio_file=audio_path,
-        subtitle_file=subtitle_path if params.subtitle_enabled else None,
-        output_file=output_file,
-        width=video_width,
-        height=video_height,
-        max_clip_duration=100000,  # Use a large value since we're using the entire video
-        font=params.font_name,
-        font_size=params.font_size,
-        font_color=params.text_fore_color,
-        subtitle_position=params.subtitle_position,
-        outline_color=params.stroke_color,
-        outline_width=params.stroke_width,
-        background_music=bgm_file,
-        voice_volume=params.voice_volume,
-        bgm_volume=params.bgm_volume
+    segments = plan_segments(
+        video_paths, audio_duration, video_concat_mode, params.videoClipDuration
     )
-    
-    if result:
-        logger.info("Video generation completed successfully")
-    else:
-        logger.error("Failed to generate video")
-    
-    return
+    if not segments:
+        logger.warning("No clips available for rendering")
+        return ""
+
+    profile = get_task_profile(params)
+    cached = []
+    for index, item in enumerate(segments):
+        duration = min(item.end_time - item.start_time, params.videoClipDuration)
+        cached_file = find_normalized_segment(item, video_width, video_height, duration, profile)
+        if cached_file:
+            cached.append(cached_file)
+            segments[index] = SubClippedVideoClip(
+                file_path=cached_file,
+                start_time=0,
+                end_time=duration,
+                width=video_width,
+                height=video_height,
+            )
+    if cached:
+        logger.info(f"Using {len(cached)} of {len(segments)} segments from the segment cache")
+
+    try:
+        graph = build_render_graph(segments, audio_file, audio_duration, subtitle_path, params)
+        if not graph.render(output_file):
+            logger.error("Failed to render video")
+            return ""
+    finally:
+        for cached_file in cached:
+            release_segment(cached_file)
+
+    logger.info("Video rendering completed successfully")
+    return output_file
+
+
+def render_variants(
+    output_files: List[str],
+    video_paths: List[str],
+    audio_file: str,
+    subtitle_path: str,
+    params: VideoParams,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    progress_callback=None,
+    segment_pool: SegmentPool = None,
+) -> List[str]:
+    """
+    Render several variants of the same task. The sources are normalized once
+    into a shared pool, each variant is a different segment ordering over that
+    pool plus one final encode.
+
+    A segment_pool filled while the sources were downloading is used as is and
+    closed afterwards. A pool built here is filled from the planned clips, the
+    first variant starts encoding as soon as enough of it is normalized.
+    """
+    aspect = VideoAspect(params.videoAspect)
+    video_width, video_height = aspect.to_resolution()
+
+    audio_duration = FFmpegWrapper.get_video_duration(audio_file)
+    logger.info(f"Rendering {len(output_files)} variants: {video_width} x {video_height}, audio duration: {audio_duration} seconds")
+
+    pool = segment_pool
+    if pool is None:
+        candidates = plan_segments(
+            video_paths,
+            audio_duration * len(output_files),
+            video_concat_mode,
+            params.videoClipDuration,
+        )
+        if not candidates:
+            logger.warning("No clips available for rendering")
+            return []
+
+        pool = create_segment_pool(os.path.dirname(output_files[0]), params)
+        for item in candidates:
+            pool.add(item)
+        pool.seal()
+
+    try:
+        rendered = []
+        for index, output_file in enumerate(output_files):
+            # later variants draw from the whole pool, it is complete by then
+            normalized = pool.wait_for(audio_duration) if index == 0 else pool.segments()
+            if not normalized:
+                logger.warning("No clips could be normalized")
+                return []
+            logger.info(f"Rendering from {len(normalized)} shared segments")
+
+            segments = select_segments(
+                normalized, audio_duration, video_concat_mode, params.videoClipDuration
+            )
+            logger.info(f"Rendering variant {index + 1}: {output_file}")
+            graph = build_render_graph(segments, audio_file, audio_duration, subtitle_path, params)
+            if graph.render(output_file):
+                rendered.append(output_file)
+            else:
+                logger.error(f"Failed to render variant {index + 1}")
+
+            if progress_callback:
+                progress_callback(index + 1)
+        return rendered
+    finally:
+        pool.close()
 
 
 def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
@@ -1,1078 +1,221 @@
+from __future__ import annotations
+
 import asyncio
+import json
 import os
 import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Union
+from typing import TYPE_CHECKING, List, Union
 from xml.sax.saxutils import unescape
 
-import edge_tts
 import requests
-from edge_tts import SubMaker, submaker
-from edge_tts.submaker import mktimestamp
 from loguru import logger
-from moviepy.video.tools import subtitles
 
 from app.config import config
+from app.services import alignment, probe_cache, voice_catalog
+from app.services.ffmpeg_wrapper import FFmpegWrapper
+from app.services.file_cache import FileCache, make_key
 from app.utils import utils
 
+# A sentence with its ending punctuation and trailing whitespace
+_SENTENCE = re.compile(r".+?(?:[.!?;。！？；]+|\n|$)\s*", re.DOTALL)
+
+if TYPE_CHECKING:
+    from edge_tts import SubMaker, submaker
+
+_tts_semaphores = {}
+_tts_lock = threading.Lock()
+_tts_cache = None
+
 
 def get_siliconflow_voices() -> list[str]:
     """
     Get SiliconFlow voice list
 
     Returns:
-        Voice list in format ["siliconflow:FunAudioLLM/CosyVoice2-0.5B:alex", ...]
+        Voice list in format ["siliconflow:FunAudioLLM/CosyVoice2-0.5B:alex-Male", ...]
     """
-    voicesWithGender = [
-        ("FunAudioLLM/CosyVoice2-0.5B", "alex", "Male"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "anna", "Female"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "bella", "Female"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "benjamin", "Male"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "charles", "Male"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "claire", "Female"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "david", "Male"),
-        ("FunAudioLLM/CosyVoice2-0.5B", "diana", "Female"),
-    ]
-
-    return [
-        f"siliconflow:{model}:{voice}-{gender}"
-        for model, voice, gender in voicesWithGender
-    ]
+    catalog = voice_catalog.get_catalog()
+    return [v.id for v in catalog.by_provider.get(voice_catalog.PROVIDER_SILICONFLOW, [])]
 
 
 def get_all_azure_voices(filter_locals=None) -> list[str]:
-    azure_voices_str = """
-Name: af-ZA-AdriNeural
-Gender: Female
-
-Name: af-ZA-WillemNeural
-Gender: Male
-
-Name: am-ET-AmehaNeural
-Gender: Male
-
-Name: am-ET-MekdesNeural
-Gender: Female
-
-Name: ar-AE-FatimaNeural
-Gender: Female
-
-Name: ar-AE-HamdanNeural
-Gender: Male
-
-Name: ar-BH-AliNeural
-Gender: Male
-
-Name: ar-BH-LailaNeural
-Gender: Female
-
-Name: ar-DZ-AminaNeural
-Gender: Female
-
-Name: ar-DZ-IsmaelNeural
-Gender: Male
-
-Name: ar-EG-SalmaNeural
-Gender: Female
-
-Name: ar-EG-ShakirNeural
-Gender: Male
-
-Name: ar-IQ-BasselNeural
-Gender: Male
-
-Name: ar-IQ-RanaNeural
-Gender: Female
-
-Name: ar-JO-SanaNeural
-Gender: Female
-
-Name: ar-JO-TaimNeural
-Gender: Male
-
-Name: ar-KW-FahedNeural
-Gender: Male
-
-Name: ar-KW-NouraNeural
-Gender: Female
-
-Name: ar-LB-LaylaNeural
-Gender: Female
-
-Name: ar-LB-RamiNeural
-Gender: Male
-
-Name: ar-LY-ImanNeural
-Gender: Female
-
-Name: ar-LY-OmarNeural
-Gender: Male
-
-Name: ar-MA-JamalNeural
-Gender: Male
-
-Name: ar-MA-MounaNeural
-Gender: Female
-
-Name: ar-OM-AbdullahNeural
-Gender: Male
-
-Name: ar-OM-AyshaNeural
-Gender: Female
-
-Name: ar-QA-AmalNeural
-Gender: Female
-
-Name: ar-QA-MoazNeural
-Gender: Male
-
-Name: ar-SA-HamedNeural
-Gender: Male
-
-Name: ar-SA-ZariyahNeural
-Gender: Female
-
-Name: ar-SY-AmanyNeural
-Gender: Female
-
-Name: ar-SY-LaithNeural
-Gender: Male
-
-Name: ar-TN-HediNeural
-Gender: Male
-
-Name: ar-TN-ReemNeural
-Gender: Female
-
-Name: ar-YE-MaryamNeural
-Gender: Female
-
-Name: ar-YE-SalehNeural
-Gender: Male
-
-Name: az-AZ-BabekNeural
-Gender: Male
-
-Name: az-AZ-BanuNeural
-Gender: Female
-
-Name: bg-BG-BorislavNeural
-Gender: Male
-
-Name: bg-BG-KalinaNeural
-Gender: Female
-
-Name: bn-BD-NabanitaNeural
-Gender: Female
-
-Name: bn-BD-PradeepNeural
-Gender: Male
-
-Name: bn-IN-BashkarNeural
-Gender: Male
-
-Name: bn-IN-TanishaaNeural
-Gender: Female
-
-Name: bs-BA-GoranNeural
-Gender: Male
-
-Name: bs-BA-VesnaNeural
-Gender: Female
-
-Name: ca-ES-EnricNeural
-Gender: Male
-
-Name: ca-ES-JoanaNeural
-Gender: Female
-
-Name: cs-CZ-AntoninNeural
-Gender: Male
-
-Name: cs-CZ-VlastaNeural
-Gender: Female
-
-Name: cy-GB-AledNeural
-Gender: Male
-
-Name: cy-GB-NiaNeural
-Gender: Female
-
-Name: da-DK-ChristelNeural
-Gender: Female
-
-Name: da-DK-JeppeNeural
-Gender: Male
-
-Name: de-AT-IngridNeural
-Gender: Female
-
-Name: de-AT-JonasNeural
-Gender: Male
-
-Name: de-CH-JanNeural
-Gender: Male
-
-Name: de-CH-LeniNeural
-Gender: Female
-
-Name: de-DE-AmalaNeural
-Gender: Female
-
-Name: de-DE-ConradNeural
-Gender: Male
-
-Name: de-DE-FlorianMultilingualNeural
-Gender: Male
-
-Name: de-DE-KatjaNeural
-Gender: Female
-
-Name: de-DE-KillianNeural
-Gender: Male
-
-Name: de-DE-SeraphinaMultilingualNeural
-Gender: Female
-
-Name: el-GR-AthinaNeural
-Gender: Female
-
-Name: el-GR-NestorasNeural
-Gender: Male
-
-Name: en-AU-NatashaNeural
-Gender: Female
-
-Name: en-AU-WilliamNeural
-Gender: Male
-
-Name: en-CA-ClaraNeural
-Gender: Female
-
-Name: en-CA-LiamNeural
-Gender: Male
-
-Name: en-GB-LibbyNeural
-Gender: Female
-
-Name: en-GB-MaisieNeural
-Gender: Female
-
-Name: en-GB-RyanNeural
-Gender: Male
-
-Name: en-GB-SoniaNeural
-Gender: Female
-
-Name: en-GB-ThomasNeural
-Gender: Male
-
-Name: en-HK-SamNeural
-Gender: Male
-
-Name: en-HK-YanNeural
-Gender: Female
-
-Name: en-IE-ConnorNeural
-Gender: Male
-
-Name: en-IE-EmilyNeural
-Gender: Female
-
-Name: en-IN-NeerjaExpressiveNeural
-Gender: Female
-
-Name: en-IN-NeerjaNeural
-Gender: Female
-
-Name: en-IN-PrabhatNeural
-Gender: Male
-
-Name: en-KE-AsiliaNeural
-Gender: Female
-
-Name: en-KE-ChilembaNeural
-Gender: Male
-
-Name: en-NG-AbeoNeural
-Gender: Male
-
-Name: en-NG-EzinneNeural
-Gender: Female
-
-Name: en-NZ-MitchellNeural
-Gender: Male
-
-Name: en-NZ-MollyNeural
-Gender: Female
-
-Name: en-PH-JamesNeural
-Gender: Male
-
-Name: en-PH-RosaNeural
-Gender: Female
-
-Name: en-SG-LunaNeural
-Gender: Female
-
-Name: en-SG-WayneNeural
-Gender: Male
-
-Name: en-TZ-ElimuNeural
-Gender: Male
-
-Name: en-TZ-ImaniNeural
-Gender: Female
-
-Name: en-US-AnaNeural
-Gender: Female
-
-Name: en-US-AndrewMultilingualNeural
-Gender: Male
-
-Name: en-US-AndrewNeural
-Gender: Male
-
-Name: en-US-AriaNeural
-Gender: Female
-
-Name: en-US-AvaMultilingualNeural
-Gender: Female
-
-Name: en-US-AvaNeural
-Gender: Female
-
-Name: en-US-BrianMultilingualNeural
-Gender: Male
-
-Name: en-US-BrianNeural
-Gender: Male
-
-Name: en-US-ChristopherNeural
-Gender: Male
-
-Name: en-US-EmmaMultilingualNeural
-Gender: Female
-
-Name: en-US-EmmaNeural
-Gender: Female
-
-Name: en-US-EricNeural
-Gender: Male
-
-Name: en-US-GuyNeural
-Gender: Male
-
-Name: en-US-JennyNeural
-Gender: Female
-
-Name: en-US-MichelleNeural
-Gender: Female
-
-Name: en-US-RogerNeural
-Gender: Male
-
-Name: en-US-SteffanNeural
-Gender: Male
-
-Name: en-ZA-LeahNeural
-Gender: Female
-
-Name: en-ZA-LukeNeural
-Gender: Male
-
-Name: es-AR-ElenaNeural
-Gender: Female
-
-Name: es-AR-TomasNeural
-Gender: Male
-
-Name: es-BO-MarceloNeural
-Gender: Male
-
-Name: es-BO-SofiaNeural
-Gender: Female
-
-Name: es-CL-CatalinaNeural
-Gender: Female
-
-Name: es-CL-LorenzoNeural
-Gender: Male
-
-Name: es-CO-GonzaloNeural
-Gender: Male
-
-Name: es-CO-SalomeNeural
-Gender: Female
-
-Name: es-CR-JuanNeural
-Gender: Male
-
-Name: es-CR-MariaNeural
-Gender: Female
-
-Name: es-CU-BelkysNeural
-Gender: Female
-
-Name: es-CU-ManuelNeural
-Gender: Male
-
-Name: es-DO-EmilioNeural
-Gender: Male
-
-Name: es-DO-RamonaNeural
-Gender: Female
-
-Name: es-EC-AndreaNeural
-Gender: Female
-
-Name: es-EC-LuisNeural
-Gender: Male
-
-Name: es-ES-AlvaroNeural
-Gender: Male
-
-Name: es-ES-ElviraNeural
-Gender: Female
-
-Name: es-ES-XimenaNeural
-Gender: Female
-
-Name: es-GQ-JavierNeural
-Gender: Male
-
-Name: es-GQ-TeresaNeural
-Gender: Female
-
-Name: es-GT-AndresNeural
-Gender: Male
-
-Name: es-GT-MartaNeural
-Gender: Female
-
-Name: es-HN-CarlosNeural
-Gender: Male
-
-Name: es-HN-KarlaNeural
-Gender: Female
-
-Name: es-MX-DaliaNeural
-Gender: Female
-
-Name: es-MX-JorgeNeural
-Gender: Male
-
-Name: es-NI-FedericoNeural
-Gender: Male
-
-Name: es-NI-YolandaNeural
-Gender: Female
-
-Name: es-PA-MargaritaNeural
-Gender: Female
-
-Name: es-PA-RobertoNeural
-Gender: Male
-
-Name: es-PE-AlexNeural
-Gender: Male
-
-Name: es-PE-CamilaNeural
-Gender: Female
-
-Name: es-PR-KarinaNeural
-Gender: Female
-
-Name: es-PR-VictorNeural
-Gender: Male
-
-Name: es-PY-MarioNeural
-Gender: Male
-
-Name: es-PY-TaniaNeural
-Gender: Female
-
-Name: es-SV-LorenaNeural
-Gender: Female
-
-Name: es-SV-RodrigoNeural
-Gender: Male
-
-Name: es-US-AlonsoNeural
-Gender: Male
-
-Name: es-US-PalomaNeural
-Gender: Female
-
-Name: es-UY-MateoNeural
-Gender: Male
-
-Name: es-UY-ValentinaNeural
-Gender: Female
-
-Name: es-VE-PaolaNeural
-Gender: Female
-
-Name: es-VE-SebastianNeural
-Gender: Male
-
-Name: et-EE-AnuNeural
-Gender: Female
-
-Name: et-EE-KertNeural
-Gender: Male
-
-Name: fa-IR-DilaraNeural
-Gender: Female
-
-Name: fa-IR-FaridNeural
-Gender: Male
-
-Name: fi-FI-HarriNeural
-Gender: Male
-
-Name: fi-FI-NooraNeural
-Gender: Female
-
-Name: fil-PH-AngeloNeural
-Gender: Male
-
-Name: fil-PH-BlessicaNeural
-Gender: Female
-
-Name: fr-BE-CharlineNeural
-Gender: Female
-
-Name: fr-BE-GerardNeural
-Gender: Male
-
-Name: fr-CA-AntoineNeural
-Gender: Male
-
-Name: fr-CA-JeanNeural
-Gender: Male
-
-Name: fr-CA-SylvieNeural
-Gender: Female
-
-Name: fr-CA-ThierryNeural
-Gender: Male
-
-Name: fr-CH-ArianeNeural
-Gender: Female
-
-Name: fr-CH-FabriceNeural
-Gender: Male
-
-Name: fr-FR-DeniseNeural
-Gender: Female
-
-Name: fr-FR-EloiseNeural
-Gender: Female
-
-Name: fr-FR-HenriNeural
-Gender: Male
-
-Name: fr-FR-RemyMultilingualNeural
-Gender: Male
-
-Name: fr-FR-VivienneMultilingualNeural
-Gender: Female
-
-Name: ga-IE-ColmNeural
-Gender: Male
-
-Name: ga-IE-OrlaNeural
-Gender: Female
-
-Name: gl-ES-RoiNeural
-Gender: Male
-
-Name: gl-ES-SabelaNeural
-Gender: Female
-
-Name: gu-IN-DhwaniNeural
-Gender: Female
-
-Name: gu-IN-NiranjanNeural
-Gender: Male
-
-Name: he-IL-AvriNeural
-Gender: Male
-
-Name: he-IL-HilaNeural
-Gender: Female
-
-Name: hi-IN-MadhurNeural
-Gender: Male
-
-Name: hi-IN-SwaraNeural
-Gender: Female
-
-Name: hr-HR-GabrijelaNeural
-Gender: Female
-
-Name: hr-HR-SreckoNeural
-Gender: Male
-
-Name: hu-HU-NoemiNeural
-Gender: Female
-
-Name: hu-HU-TamasNeural
-Gender: Male
-
-Name: id-ID-ArdiNeural
-Gender: Male
-
-Name: id-ID-GadisNeural
-Gender: Female
-
-Name: is-IS-GudrunNeural
-Gender: Female
-
-Name: is-IS-GunnarNeural
-Gender: Male
-
-Name: it-IT-DiegoNeural
-Gender: Male
-
-Name: it-IT-ElsaNeural
-Gender: Female
-
-Name: it-IT-GiuseppeMultilingualNeural
-Gender: Male
-
-Name: it-IT-IsabellaNeural
-Gender: Female
-
-Name: iu-Cans-CA-SiqiniqNeural
-Gender: Female
-
-Name: iu-Cans-CA-TaqqiqNeural
-Gender: Male
-
-Name: iu-Latn-CA-SiqiniqNeural
-Gender: Female
-
-Name: iu-Latn-CA-TaqqiqNeural
-Gender: Male
-
-Name: ja-JP-KeitaNeural
-Gender: Male
-
-Name: ja-JP-NanamiNeural
-Gender: Female
-
-Name: jv-ID-DimasNeural
-Gender: Male
-
-Name: jv-ID-SitiNeural
-Gender: Female
-
-Name: ka-GE-EkaNeural
-Gender: Female
-
-Name: ka-GE-GiorgiNeural
-Gender: Male
-
-Name: kk-KZ-AigulNeural
-Gender: Female
-
-Name: kk-KZ-DauletNeural
-Gender: Male
-
-Name: km-KH-PisethNeural
-Gender: Male
-
-Name: km-KH-SreymomNeural
-Gender: Female
-
-Name: kn-IN-GaganNeural
-Gender: Male
-
-Name: kn-IN-SapnaNeural
-Gender: Female
-
-Name: ko-KR-HyunsuMultilingualNeural
-Gender: Male
-
-Name: ko-KR-InJoonNeural
-Gender: Male
-
-Name: ko-KR-SunHiNeural
-Gender: Female
-
-Name: lo-LA-ChanthavongNeural
-Gender: Male
-
-Name: lo-LA-KeomanyNeural
-Gender: Female
-
-Name: lt-LT-LeonasNeural
-Gender: Male
-
-Name: lt-LT-OnaNeural
-Gender: Female
-
-Name: lv-LV-EveritaNeural
-Gender: Female
-
-Name: lv-LV-NilsNeural
-Gender: Male
-
-Name: mk-MK-AleksandarNeural
-Gender: Male
-
-Name: mk-MK-MarijaNeural
-Gender: Female
-
-Name: ml-IN-MidhunNeural
-Gender: Male
-
-Name: ml-IN-SobhanaNeural
-Gender: Female
-
-Name: mn-MN-BataaNeural
-Gender: Male
-
-Name: mn-MN-YesuiNeural
-Gender: Female
-
-Name: mr-IN-AarohiNeural
-Gender: Female
-
-Name: mr-IN-ManoharNeural
-Gender: Male
-
-Name: ms-MY-OsmanNeural
-Gender: Male
-
-Name: ms-MY-YasminNeural
-Gender: Female
-
-Name: mt-MT-GraceNeural
-Gender: Female
-
-Name: mt-MT-JosephNeural
-Gender: Male
-
-Name: my-MM-NilarNeural
-Gender: Female
-
-Name: my-MM-ThihaNeural
-Gender: Male
-
-Name: nb-NO-FinnNeural
-Gender: Male
-
-Name: nb-NO-PernilleNeural
-Gender: Female
-
-Name: ne-NP-HemkalaNeural
-Gender: Female
-
-Name: ne-NP-SagarNeural
-Gender: Male
-
-Name: nl-BE-ArnaudNeural
-Gender: Male
-
-Name: nl-BE-DenaNeural
-Gender: Female
-
-Name: nl-NL-ColetteNeural
-Gender: Female
-
-Name: nl-NL-FennaNeural
-Gender: Female
-
-Name: nl-NL-MaartenNeural
-Gender: Male
-
-Name: pl-PL-MarekNeural
-Gender: Male
-
-Name: pl-PL-ZofiaNeural
-Gender: Female
-
-Name: ps-AF-GulNawazNeural
-Gender: Male
-
-Name: ps-AF-LatifaNeural
-Gender: Female
-
-Name: pt-BR-AntonioNeural
-Gender: Male
-
-Name: pt-BR-FranciscaNeural
-Gender: Female
-
-Name: pt-BR-ThalitaMultilingualNeural
-Gender: Female
-
-Name: pt-PT-DuarteNeural
-Gender: Male
-
-Name: pt-PT-RaquelNeural
-Gender: Female
-
-Name: ro-RO-AlinaNeural
-Gender: Female
-
-Name: ro-RO-EmilNeural
-Gender: Male
-
-Name: ru-RU-DmitryNeural
-Gender: Male
-
-Name: ru-RU-SvetlanaNeural
-Gender: Female
-
-Name: si-LK-SameeraNeural
-Gender: Male
-
-Name: si-LK-ThiliniNeural
-Gender: Female
-
-Name: sk-SK-LukasNeural
-Gender: Male
-
-Name: sk-SK-ViktoriaNeural
-Gender: Female
-
-Name: sl-SI-PetraNeural
-Gender: Female
-
-Name: sl-SI-RokNeural
-Gender: Male
-
-Name: so-SO-MuuseNeural
-Gender: Male
-
-Name: so-SO-UbaxNeural
-Gender: Female
-
-Name: sq-AL-AnilaNeural
-Gender: Female
-
-Name: sq-AL-IlirNeural
-Gender: Male
-
-Name: sr-RS-NicholasNeural
-Gender: Male
-
-Name: sr-RS-SophieNeural
-Gender: Female
-
-Name: su-ID-JajangNeural
-Gender: Male
-
-Name: su-ID-TutiNeural
-Gender: Female
-
-Name: sv-SE-MattiasNeural
-Gender: Male
-
-Name: sv-SE-SofieNeural
-Gender: Female
-
-Name: sw-KE-RafikiNeural
-Gender: Male
-
-Name: sw-KE-ZuriNeural
-Gender: Female
-
-Name: sw-TZ-DaudiNeural
-Gender: Male
-
-Name: sw-TZ-RehemaNeural
-Gender: Female
-
-Name: ta-IN-PallaviNeural
-Gender: Female
-
-Name: ta-IN-ValluvarNeural
-Gender: Male
-
-Name: ta-LK-KumarNeural
-Gender: Male
-
-Name: ta-LK-SaranyaNeural
-Gender: Female
-
-Name: ta-MY-KaniNeural
-Gender: Female
-
-Name: ta-MY-SuryaNeural
-Gender: Male
-
-Name: ta-SG-AnbuNeural
-Gender: Male
-
-Name: ta-SG-VenbaNeural
-Gender: Female
-
-Name: te-IN-MohanNeural
-Gender: Male
-
-Name: te-IN-ShrutiNeural
-Gender: Female
-
-Name: th-TH-NiwatNeural
-Gender: Male
-
-Name: th-TH-PremwadeeNeural
-Gender: Female
-
-Name: tr-TR-AhmetNeural
-Gender: Male
-
-Name: tr-TR-EmelNeural
-Gender: Female
-
-Name: uk-UA-OstapNeural
-Gender: Male
-
-Name: uk-UA-PolinaNeural
-Gender: Female
-
-Name: ur-IN-GulNeural
-Gender: Female
-
-Name: ur-IN-SalmanNeural
-Gender: Male
-
-Name: ur-PK-AsadNeural
-Gender: Male
-
-Name: ur-PK-UzmaNeural
-Gender: Female
-
-Name: uz-UZ-MadinaNeural
-Gender: Female
-
-Name: uz-UZ-SardorNeural
-Gender: Male
-
-Name: vi-VN-HoaiMyNeural
-Gender: Female
-
-Name: vi-VN-NamMinhNeural
-Gender: Male
-
-Name: zh-CN-XiaoxiaoNeural
-Gender: Female
-
-Name: zh-CN-XiaoyiNeural
-Gender: Female
-
-Name: zh-CN-YunjianNeural
-Gender: Male
-
-Name: zh-CN-YunxiNeural
-Gender: Male
+    catalog = voice_catalog.get_catalog()
+    return [
+        v.id for v in catalog.filter(prefixes=filter_locals)
+        if v.provider != voice_catalog.PROVIDER_SILICONFLOW
+    ]
 
-Name: zh-CN-YunxiaNeural
-Gender: Male
 
-Name: zh-CN-YunyangNeural
-Gender: Male
+def parse_voice_name(name: str):
+    # zh-CN-XiaoyiNeural-Female
+    # zh-CN-YunxiNeural-Male
+    # zh-CN-XiaoxiaoMultilingualNeural-V2-Female
+    name = name.replace("-Female", "").replace("-Male", "").strip()
+    return name
 
-Name: zh-CN-liaoning-XiaobeiNeural
-Gender: Female
 
-Name: zh-CN-shaanxi-XiaoniNeural
-Gender: Female
+def is_azure_v2_voice(voice_name: str):
+    voice_name = parse_voice_name(voice_name)
+    if voice_name.endswith("-V2"):
+        return voice_name.replace("-V2", "").strip()
+    return ""
 
-Name: zh-HK-HiuGaaiNeural
-Gender: Female
 
-Name: zh-HK-HiuMaanNeural
-Gender: Female
+def is_siliconflow_voice(voice_name: str):
+    """Check if this is a SiliconFlow voice"""
+    return voice_name.startswith("siliconflow:")
 
-Name: zh-HK-WanLungNeural
-Gender: Male
 
-Name: zh-TW-HsiaoChenNeural
-Gender: Female
+def get_tts_provider(voice_name: str) -> str:
+    if is_azure_v2_voice(voice_name):
+        return "azure_v2"
+    if is_siliconflow_voice(voice_name):
+        return "siliconflow"
+    return "edge"
 
-Name: zh-TW-HsiaoYuNeural
-Gender: Female
 
-Name: zh-TW-YunJheNeural
-Gender: Male
+def get_tts_semaphore(provider: str) -> threading.Semaphore:
+    """
+    Limits concurrent requests to one TTS provider across all running tasks
+    """
+    with _tts_lock:
+        if provider not in _tts_semaphores:
+            _tts_semaphores[provider] = threading.Semaphore(
+                config.app.get("tts_concurrency", 4)
+            )
+        return _tts_semaphores[provider]
 
-Name: zu-ZA-ThandoNeural
-Gender: Female
 
-Name: zu-ZA-ThembaNeural
-Gender: Male
+def split_text_into_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    Split text at sentence boundaries into chunks of at most max_chars,
+    a single sentence longer than max_chars becomes its own chunk
 
+    Past half of max_chars a chunk also ends after any sentence whose hash
+    picks it as a boundary. Boundaries then depend on the sentences around
+    them rather than on everything before them, so editing one sentence
+    changes one chunk and the TTS cache still hits for the others.
+    """
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text] if text else []
+
+    chunks = []
+    chunk = ""
+    for sentence in _SENTENCE.findall(text):
+        if chunk.strip() and len(chunk) + len(sentence) > max_chars:
+            chunks.append(chunk.strip())
+            chunk = ""
+        chunk += sentence
+        if len(chunk) >= max_chars // 2 and int(utils.md5(sentence.strip())[:4], 16) % 4 == 0:
+            chunks.append(chunk.strip())
+            chunk = ""
+    if chunk.strip():
+        chunks.append(chunk.strip())
+    return chunks
 
-Name: en-US-AvaMultilingualNeural-V2
-Gender: Female
 
-Name: en-US-AndrewMultilingualNeural-V2
-Gender: Male
+def tts(
+    text: str,
+    voice_name: str,
+    voice_rate: float,
+    voice_file: str,
+    voice_volume: float = 1.0,
+) -> Union[SubMaker, None]:
+    chunks = split_text_into_chunks(text, config.app.get("tts_chunk_size", 800))
+    if len(chunks) > 1:
+        return chunked_tts(chunks, voice_name, voice_rate, voice_file, voice_volume)
+    return synthesize(text, voice_name, voice_rate, voice_file, voice_volume)
 
-Name: en-US-EmmaMultilingualNeural-V2
-Gender: Female
 
-Name: en-US-BrianMultilingualNeural-V2
-Gender: Male
+def synthesize(
+    text: str,
+    voice_name: str,
+    voice_rate: float,
+    voice_file: str,
+    voice_volume: float = 1.0,
+) -> Union[SubMaker, None]:
+    provider = get_tts_provider(voice_name)
+    cache = get_tts_cache()
+    if cache is None:
+        with get_tts_semaphore(provider):
+            return _synthesize(text, voice_name, voice_rate, voice_file, voice_volume)
+
+    key = make_key(provider, voice_name, voice_rate, voice_volume, utils.md5(text.strip()))
+    suffix = os.path.splitext(voice_file)[1] or ".mp3"
+    sub_maker = load_cached_tts(cache, key, voice_file, suffix)
+    if sub_maker is not None:
+        logger.info(f"tts cache hit, output file: {voice_file}")
+        return sub_maker
+
+    with get_tts_semaphore(provider):
+        sub_maker = _synthesize(text, voice_name, voice_rate, voice_file, voice_volume)
+    if sub_maker is not None:
+        try:
+            store_cached_tts(cache, key, voice_file, suffix, sub_maker)
+        except Exception as e:
+            logger.warning(f"failed to cache tts audio: {str(e)}")
+    return sub_maker
 
-Name: de-DE-FlorianMultilingualNeural-V2
-Gender: Male
 
-Name: de-DE-SeraphinaMultilingualNeural-V2
-Gender: Female
+def get_tts_cache() -> Union[FileCache, None]:
+    global _tts_cache
+    if not config.app.get("enable_tts_cache", True):
+        return None
+    if _tts_cache is None:
+        with _tts_lock:
+            if _tts_cache is None:
+                _tts_cache = FileCache("cache_tts", config.app.get("tts_cache_max_size_mb", 512))
+    return _tts_cache
 
-Name: fr-FR-RemyMultilingualNeural-V2
-Gender: Male
 
-Name: fr-FR-VivienneMultilingualNeural-V2
-Gender: Female
+def sub_maker_to_dict(sub_maker: SubMaker) -> dict:
+    return {"subs": sub_maker.subs, "offset": sub_maker.offset}
 
-Name: zh-CN-XiaoxiaoMultilingualNeural-V2
-Gender: Female
-    """.strip()
-    voices = []
-    pattern = re.compile(r"Name:\s*(.+)\s*Gender:\s*(.+)\s*", re.MULTILINE)
-    matches = pattern.findall(azure_voices_str)
 
-    for name, gender in matches:
-        if filter_locals and any(
-            name.lower().startswith(fl.lower()) for fl in filter_locals
-        ):
-            voices.append(f"{name}-{gender}")
-        elif not filter_locals:
-            voices.append(f"{name}-{gender}")
+def sub_maker_from_dict(boundaries: dict) -> SubMaker:
+    from edge_tts import SubMaker
 
-    voices.sort()
-    return voices
+    sub_maker = SubMaker()
+    sub_maker.subs = boundaries["subs"]
+    sub_maker.offset = [tuple(offset) for offset in boundaries["offset"]]
+    return sub_maker
 
 
-def parse_voice_name(name: str):
-    # zh-CN-XiaoyiNeural-Female
-    # zh-CN-YunxiNeural-Male
-    # zh-CN-XiaoxiaoMultilingualNeural-V2-Female
-    name = name.replace("-Female", "").replace("-Male", "").strip()
-    return name
+def load_cached_tts(cache: FileCache, key: str, voice_file: str, suffix: str) -> Union[SubMaker, None]:
+    """
+    Copy cached audio to voice_file and return its word boundaries
+    """
+    boundaries_file = cache.get(key, ".json")
+    audio_file = cache.get(key, suffix)
+    if not boundaries_file or not audio_file:
+        return None
 
+    try:
+        with open(boundaries_file, "r", encoding="utf-8") as f:
+            boundaries = json.load(f)
+        shutil.copyfile(audio_file, voice_file)
+    except Exception as e:
+        logger.warning(f"invalid tts cache entry {key}: {str(e)}")
+        return None
 
-def is_azure_v2_voice(voice_name: str):
-    voice_name = parse_voice_name(voice_name)
-    if voice_name.endswith("-V2"):
-        return voice_name.replace("-V2", "").strip()
-    return ""
+    return sub_maker_from_dict(boundaries)
 
 
-def is_siliconflow_voice(voice_name: str):
-    """Check if this is a SiliconFlow voice"""
-    return voice_name.startswith("siliconflow:")
+def store_cached_tts(cache: FileCache, key: str, voice_file: str, suffix: str, sub_maker: SubMaker):
+    boundaries_file = f"{voice_file}.{utils.getUuid(True)}.json"
+    with open(boundaries_file, "w", encoding="utf-8") as f:
+        json.dump(sub_maker_to_dict(sub_maker), f, ensure_ascii=False)
+    # audio first, a boundaries file without its audio is never read
+    cache.put(key, voice_file, suffix=suffix, move=False)
+    cache.put(key, boundaries_file, suffix=".json")
 
 
-def tts(
+def _synthesize(
     text: str,
     voice_name: str,
     voice_rate: float,
@@ -1097,6 +240,61 @@ def tts(
     return azure_tts_v1(text, voice_name, voice_rate, voice_file)
 
 
+def chunked_tts(
+    chunks: List[str],
+    voice_name: str,
+    voice_rate: float,
+    voice_file: str,
+    voice_volume: float = 1.0,
+) -> Union[SubMaker, None]:
+    """
+    Synthesize the chunks concurrently and stitch them into one audio file
+
+    Each chunk has its own retries, so a transient failure only repeats that
+    chunk. The audio is joined without re-encoding and the word boundaries
+    of every chunk are shifted by the duration of the audio before it.
+    """
+    base, ext = os.path.splitext(voice_file)
+    chunk_files = [f"{base}-chunk-{i}{ext}" for i in range(len(chunks))]
+    logger.info(f"synthesizing {len(chunks)} chunks, voice name: {voice_name}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(len(chunks), config.app.get("tts_concurrency", 4))) as executor:
+            sub_makers = list(
+                executor.map(
+                    lambda args: synthesize(args[0], voice_name, voice_rate, args[1], voice_volume),
+                    zip(chunks, chunk_files),
+                )
+            )
+
+        if any(sub_maker is None for sub_maker in sub_makers):
+            logger.error("failed, some chunks could not be synthesized")
+            return None
+
+        if not FFmpegWrapper.concat_audio(chunk_files, voice_file):
+            return None
+
+        from edge_tts import SubMaker
+
+        merged = SubMaker()
+        shift = 0
+        for chunk_file, sub_maker in zip(chunk_files, sub_makers):
+            for (start, end), sub in zip(sub_maker.offset, sub_maker.subs):
+                merged.offset.append((start + shift, end + shift))
+                merged.subs.append(sub)
+            shift += int(probe_cache.media_info(chunk_file).duration * 10000000)
+
+        logger.info(f"completed, output file: {voice_file}")
+        return merged
+    except Exception as e:
+        logger.error(f"failed, error: {str(e)}")
+        return None
+    finally:
+        for chunk_file in chunk_files:
+            if os.path.exists(chunk_file):
+                os.remove(chunk_file)
+
+
 def convert_rate_to_percent(rate: float) -> str:
     if rate == 1.0:
         return "+0%"
@@ -1117,6 +315,8 @@ def azure_tts_v1(
         try:
             logger.info(f"start, voice name: {voice_name}, try: {i + 1}")
 
+            import edge_tts
+
             async def _do() -> SubMaker:
                 communicate = edge_tts.Communicate(text, voice_name, rate=rate_str)
                 sub_maker = edge_tts.SubMaker()
@@ -1201,14 +401,12 @@ def siliconflow_tts(
                 with open(voice_file, "wb") as f:
                     f.write(response.content)
 
+                from edge_tts import SubMaker
+
                 sub_maker = SubMaker()
 
                 try:
-                    from moviepy import AudioFileClip
-
-                    audio_clip = AudioFileClip(voice_file)
-                    audio_duration = audio_clip.duration
-                    audio_clip.close()
+                    audio_duration = probe_cache.media_info(voice_file).duration
 
                     audio_duration_100ns = int(audio_duration * 10000000)
 
@@ -1290,6 +488,7 @@ def azure_tts_v2(text: str, voice_name: str, voice_file: str) -> Union[SubMaker,
             logger.info(f"start, voice name: {voice_name}, try: {i + 1}")
 
             import azure.cognitiveservices.speech as speechsdk
+            from edge_tts import SubMaker
 
             sub_maker = SubMaker()
 
@@ -1365,10 +564,12 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
     """
     Optimize subtitle file
     1. Split subtitle file into multiple lines by punctuation
-    2. Match subtitle file text line by line
+    2. Align the TTS word boundaries to the lines
     3. Generate new subtitle file
     """
 
+    from edge_tts.submaker import mktimestamp
+
     text = _format_text(text)
 
     def formatter(idx: int, start_time: float, end_time: float, sub_text: str) -> str:
@@ -1381,72 +582,53 @@ def create_subtitle(sub_maker: submaker.SubMaker, text: str, subtitle_file: str)
         end_t = mktimestamp(end_time).replace(".", ",")
         return f"{idx}\n{start_t} --> {end_t}\n{sub_text}\n"
 
-    start_time = -1.0
-    sub_items = []
-    sub_index = 0
-
     script_lines = utils.splitStringByPunctuations(text)
-
-    def match_line(_sub_line: str, _sub_index: int):
-        if len(script_lines) <= _sub_index:
-            return ""
-
-        _line = script_lines[_sub_index]
-        if _sub_line == _line:
-            return script_lines[_sub_index].strip()
-
-        _sub_line_ = re.sub(r"[^\w\s]", "", _sub_line)
-        _line_ = re.sub(r"[^\w\s]", "", _line)
-        if _sub_line_ == _line_:
-            return _line_.strip()
-
-        _sub_line_ = re.sub(r"\W+", "", _sub_line)
-        _line_ = re.sub(r"\W+", "", _line)
-        if _sub_line_ == _line_:
-            return _line.strip()
-
-        return ""
-
-    sub_line = ""
+    if not script_lines or not sub_maker.subs:
+        logger.warning(
+            f"failed, subs len: {len(sub_maker.subs)}, script_lines len: {len(script_lines)}"
+        )
+        return
 
     try:
-        for _, (offset, sub) in enumerate(zip(sub_maker.offset, sub_maker.subs)):
-            _start_time, end_time = offset
-            if start_time < 0:
-                start_time = _start_time
-
-            sub = unescape(sub)
-            sub_line += sub
-            sub_text = match_line(sub_line, sub_index)
-            if sub_text:
-                sub_index += 1
-                line = formatter(
-                    idx=sub_index,
+        words = [unescape(sub) for sub in sub_maker.subs]
+        line_indexes = alignment.align_words_to_lines(words, script_lines)
+
+        # first word start and last word end of every line
+        timings = [None] * len(script_lines)
+        for (start_time, end_time), line_index in zip(sub_maker.offset, line_indexes):
+            if timings[line_index] is None:
+                timings[line_index] = [start_time, end_time]
+            else:
+                timings[line_index][1] = end_time
+
+        # lines no word was matched to fill the gap between their neighbours
+        previous_end = 0
+        for i, timing in enumerate(timings):
+            if timing is None:
+                next_start = next(
+                    (t[0] for t in timings[i + 1:] if t is not None), previous_end
+                )
+                timings[i] = [previous_end, max(previous_end, next_start)]
+            previous_end = timings[i][1]
+
+        sub_items = []
+        for i, (line, (start_time, end_time)) in enumerate(zip(script_lines, timings)):
+            sub_items.append(
+                formatter(
+                    idx=i + 1,
                     start_time=start_time,
                     end_time=end_time,
-                    sub_text=sub_text,
+                    sub_text=line.strip(),
                 )
-                sub_items.append(line)
-                start_time = -1.0
-                sub_line = ""
-
-        if len(sub_items) == len(script_lines):
-            with open(subtitle_file, "w", encoding="utf-8") as file:
-                file.write("\n".join(sub_items) + "\n")
-            try:
-                sbs = subtitles.file_to_subtitles(subtitle_file, encoding="utf-8")
-                duration = max([tb for ((ta, tb), txt) in sbs])
-                logger.info(
-                    f"completed, subtitle file created: {subtitle_file}, duration: {duration}"
-                )
-            except Exception as e:
-                logger.error(f"failed, error: {str(e)}")
-                os.remove(subtitle_file)
-        else:
-            logger.warning(
-                f"failed, sub_items len: {len(sub_items)}, script_lines len: {len(script_lines)}"
             )
 
+        with open(subtitle_file, "w", encoding="utf-8") as file:
+            file.write("\n".join(sub_items) + "\n")
+        duration = max(end_time for _, end_time in timings) / 10000000
+        logger.info(
+            f"completed, subtitle file created: {subtitle_file}, duration: {duration}"
+        )
+
     except Exception as e:
         logger.error(f"failed, error: {str(e)}")
 
@@ -0,0 +1,239 @@
+"""
+Whisper Pool Module - Shared pool of faster-whisper model instances
+Models are loaded once per process, optionally at startup, and handed out to
+concurrent transcriptions one instance at a time
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as timer
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+if TYPE_CHECKING:
+    from faster_whisper import WhisperModel
+
+
+class WhisperModelPool:
+    """
+    Bounded pool of WhisperModel instances
+    """
+
+    def __init__(self, model_size: str = "large-v3", device: str = "cpu",
+                 compute_type: str = "int8", size: int = 1, cpu_threads: int = 0,
+                 num_workers: int = 1):
+        """
+        Args:
+            model_size: Model name, or the name of a folder under models/
+            device: "cpu", "cuda" or "auto"
+            compute_type: CTranslate2 compute type
+            size: Maximum number of loaded instances
+            cpu_threads: CPU threads per instance, 0 splits the cores evenly
+            num_workers: Parallel transcriptions each instance accepts
+        """
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.size = max(1, size)
+        self.cpu_threads = cpu_threads or max(1, (os.cpu_count() or 1) // self.size)
+        self.num_workers = num_workers
+
+        self.idle: List["WhisperModel"] = []
+        # guards every counter, waiters re-check the pool whenever a model is
+        # returned or a load finishes or fails
+        self.lock = threading.Condition()
+        self.loaded = 0
+        self.loading = 0
+        self.waiting = 0
+        self.failures = 0
+        self.load_error: Optional[BaseException] = None
+        self.load_seconds = []
+
+    def _model_path(self) -> str:
+        model_path = f"{utils.rootDir()}/models/whisper-{self.model_size}"
+        model_bin_file = f"{model_path}/model.bin"
+        if not os.path.isdir(model_path) or not os.path.isfile(model_bin_file):
+            model_path = self.model_size
+        return model_path
+
+    def _load(self) -> "WhisperModel":
+        # faster-whisper pulls in ctranslate2 and onnxruntime, only pay for it when a model is needed
+        from faster_whisper import WhisperModel
+
+        model_path = self._model_path()
+        logger.info(
+            f"loading model: {model_path}, device: {self.device}, compute_type: {self.compute_type}, "
+            f"cpu_threads: {self.cpu_threads}"
+        )
+        start = timer()
+        try:
+            model = WhisperModel(
+                model_size_or_path=model_path,
+                device=self.device,
+                compute_type=self.compute_type,
+                cpu_threads=self.cpu_threads,
+                num_workers=self.num_workers,
+            )
+        except Exception as e:
+            logger.error(
+                f"failed to load model: {e} \n\n"
+                f"********************************************\n"
+                f"this may be caused by network issue. \n"
+                f"please download the model manually and put it in the 'models' folder. \n"
+                f"see [README.md FAQ](https://github.com/GiladLeef/ShortsTurbo) for more details.\n"
+                f"********************************************\n\n"
+            )
+            raise
+
+        elapsed = timer() - start
+        self.load_seconds.append(elapsed)
+        logger.info(f"model loaded in {elapsed:.2f} s, instances: {self.loaded + 1}/{self.size}")
+        return model
+
+    def _grow(self) -> Optional["WhisperModel"]:
+        """
+        Load one more instance if the pool is not full
+
+        Returns:
+            The new instance, or None when the pool is full
+        """
+        with self.lock:
+            if self.loaded + self.loading >= self.size:
+                return None
+            self.loading += 1
+        return self._finish_load()
+
+    def _finish_load(self) -> "WhisperModel":
+        # the caller has already counted this load in self.loading
+        try:
+            model = self._load()
+        except BaseException as e:
+            with self.lock:
+                self.loading -= 1
+                self.failures += 1
+                self.load_error = e
+                self.lock.notify_all()
+            raise
+
+        with self.lock:
+            self.loading -= 1
+            self.loaded += 1
+            self.lock.notify_all()
+        return model
+
+    def _release(self, model: "WhisperModel"):
+        with self.lock:
+            self.idle.append(model)
+            self.lock.notify_all()
+
+    def preload(self, count: Optional[int] = None):
+        """
+        Load instances ahead of the first transcription
+
+        Args:
+            count: Number of instances to load, defaults to the pool size
+        """
+        for _ in range(min(count or self.size, self.size)):
+            model = self._grow()
+            if model is None:
+                break
+            self._release(model)
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a model instance, loading a new one when all are busy and the
+        pool still has room, otherwise waiting for one to be returned
+
+        Raises:
+            The load error when a load this caller was waiting on failed
+        """
+        model = None
+        load = False
+        with self.lock:
+            failures = self.failures
+            waited = False
+            try:
+                while model is None and not load:
+                    if self.idle:
+                        model = self.idle.pop()
+                    elif self.failures != failures:
+                        # a load failed while we waited, retrying it here would
+                        # only make every waiter pay for the same error again
+                        raise self.load_error
+                    elif self.loaded + self.loading < self.size:
+                        self.loading += 1
+                        load = True
+                    else:
+                        if not waited:
+                            waited = True
+                            self.waiting += 1
+                            logger.info(f"all whisper models are busy, queue depth: {self.waiting}")
+                        self.lock.wait()
+            finally:
+                if waited:
+                    self.waiting -= 1
+
+        if load:
+            model = self._finish_load()
+
+        try:
+            yield model
+        finally:
+            self._release(model)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "size": self.size,
+                "loaded": self.loaded,
+                "busy": self.loaded - len(self.idle),
+                "waiting": self.waiting,
+                "load_seconds": list(self.load_seconds),
+            }
+
+
+_pool: Optional[WhisperModelPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> WhisperModelPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WhisperModelPool(
+                    model_size=config.whisper.get("model_size", "large-v3"),
+                    device=config.whisper.get("device", "cpu"),
+                    compute_type=config.whisper.get("compute_type", "int8"),
+                    size=config.whisper.get("pool_size", 1),
+                    cpu_threads=config.whisper.get("cpu_threads", 0),
+                    num_workers=config.whisper.get("num_workers", 1),
+                )
+    return _pool
+
+
+def preload_in_background() -> Optional[threading.Thread]:
+    """
+    Start loading the whisper models if [whisper] preload is enabled
+
+    Returns:
+        The loader thread, or None when preloading is disabled
+    """
+    if not config.whisper.get("preload", False):
+        return None
+
+    def _preload():
+        try:
+            get_pool().preload(config.whisper.get("preload_count", None))
+        except Exception as e:
+            logger.error(f"failed to preload whisper models: {str(e)}")
+
+    thread = threading.Thread(target=_preload, name="whisper-preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,160 @@
+"""
+Queue Check - Exercises the leased Redis task queue against a live server
+
+Run with: python -m app.utils.queue_check [--redis-url redis://localhost:6379/0]
+
+The checks use their own queue name and delete its keys afterwards, so they
+can run next to a deployment. They cover the claim order, the requeue of a
+task whose lease expired, the global running cap and the task list of
+RedisState sharing the db with the queue. Exits non-zero when a check fails
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from typing import List
+from urllib.parse import urlparse
+
+from app.controllers.manager import redis_manager
+from app.models import const
+from app.services.state import RedisState
+
+
+class CheckTaskManager(redis_manager.RedisTaskManager):
+    def __init__(self, queueName: str, redisUrl: str, **kwargs):
+        self.queueName = queueName
+        super().__init__(1, redisUrl, startWorkers=False, **kwargs)
+
+    def createQueue(self):
+        return self.queueName
+
+
+def addTask(manager: CheckTaskManager, taskId: str, priority: int):
+    # never executed, the checks only move it through the queue
+    manager.addTask(redis_manager.FUNC_MAP["start"], task_id=taskId, priority=priority)
+
+
+def taskIdOf(taskInfo) -> str:
+    return taskInfo["kwargs"]["task_id"] if taskInfo else ""
+
+
+def checkClaim(redisUrl: str, queueName: str) -> List[str]:
+    errors = []
+    manager = CheckTaskManager(queueName, redisUrl)
+    addTask(manager, "low", const.TASK_PRIORITY_LOW)
+    addTask(manager, "high", const.TASK_PRIORITY_HIGH)
+
+    first = manager.dequeue()
+    if taskIdOf(first) != "high":
+        errors.append(f"claim: expected the high priority task first, got {taskIdOf(first) or None}")
+    if first and manager.redisClient.zscore(manager.leasesKey, first["raw"]) is None:
+        errors.append("claim: the claimed task holds no lease")
+    if manager.redisClient.llen(manager.processingKey) != 1:
+        errors.append("claim: the claimed task is not in the processing list")
+
+    second = manager.dequeue()
+    for taskInfo in (first, second):
+        if taskInfo:
+            manager.ack(taskInfo, failed=False)
+    if manager.redisClient.zcard(manager.leasesKey) or manager.redisClient.llen(manager.processingKey):
+        errors.append("claim: ack left a lease or a processing entry behind")
+    return errors
+
+
+def checkRequeue(redisUrl: str, queueName: str) -> List[str]:
+    errors = []
+    crashed = CheckTaskManager(queueName, redisUrl, visibilityTimeout=1)
+    survivor = CheckTaskManager(queueName, redisUrl, visibilityTimeout=1)
+    addTask(crashed, "orphan", const.TASK_PRIORITY_NORMAL)
+
+    # the crashed worker claims the task and never beats again
+    if taskIdOf(crashed.dequeue()) != "orphan":
+        return ["requeue: the task could not be claimed"]
+    time.sleep(2.1)
+    survivor.heartbeat()
+
+    taskInfo = survivor.dequeue()
+    if taskIdOf(taskInfo) != "orphan":
+        errors.append("requeue: the task with the expired lease was not requeued")
+    elif survivor.redisClient.hget(survivor.attemptsKey, taskInfo["id"]) != b"1":
+        errors.append("requeue: the attempt was not counted")
+    if taskInfo:
+        survivor.ack(taskInfo, failed=False)
+    return errors
+
+
+def checkGlobalCap(redisUrl: str, queueName: str) -> List[str]:
+    errors = []
+    first = CheckTaskManager(queueName, redisUrl, maxGlobalTasks=1)
+    second = CheckTaskManager(queueName, redisUrl, maxGlobalTasks=1)
+    addTask(first, "a", const.TASK_PRIORITY_NORMAL)
+    addTask(first, "b", const.TASK_PRIORITY_NORMAL)
+
+    running = first.dequeue()
+    if second.dequeue():
+        errors.append("global cap: a second task was claimed while the cluster was full")
+    if running:
+        first.ack(running, failed=False)
+    taskInfo = second.dequeue()
+    if not taskInfo:
+        errors.append("global cap: no task was claimed after the running one finished")
+    else:
+        second.ack(taskInfo, failed=False)
+    return errors
+
+
+def checkTaskList(redisUrl: str, queueName: str) -> List[str]:
+    url = urlparse(redisUrl)
+    state = RedisState(
+        host=url.hostname or "localhost",
+        port=url.port or 6379,
+        db=int(url.path.lstrip("/") or 0),
+        password=url.password or None,
+    )
+    manager = CheckTaskManager(queueName, redisUrl, visibilityTimeout=60)
+    addTask(manager, "listed", const.TASK_PRIORITY_NORMAL)
+    taskInfo = manager.dequeue()
+    # leaves a lease, a processing entry and an attempts hash next to the task hash
+    manager.redisClient.hset(manager.attemptsKey, "listed", 1)
+
+    taskId = f"queue-check-{uuid.uuid4().hex}"
+    state.update_task(taskId, const.TASK_STATE_PROCESSING)
+    try:
+        tasks, _ = state.get_all_tasks(1, 1_000_000)
+        if taskId not in [task.get("task_id") for task in tasks]:
+            return ["task list: the task hash is missing"]
+    except Exception as e:
+        return [f"task list: {str(e)}"]
+    finally:
+        state.delete_task(taskId)
+        if taskInfo:
+            manager.ack(taskInfo, failed=False)
+    return []
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--redis-url", default=redis_manager.getRedisUrl())
+    args = parser.parse_args(argv)
+
+    failed = False
+    for check in (checkClaim, checkRequeue, checkGlobalCap, checkTaskList):
+        queueName = f"queue_check_{uuid.uuid4().hex[:8]}"
+        try:
+            errors = check(args.redis_url, queueName)
+        finally:
+            client = redis_manager.redis.Redis.from_url(args.redis_url)
+            keys = list(client.scan_iter(f"{queueName}:*"))
+            if keys:
+                client.delete(*keys)
+        print(f"{check.__name__}: {'failed' if errors else 'ok'}")
+        for error in errors:
+            print(f"  {error}")
+        failed = failed or bool(errors)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Startup Benchmark - Import-time profile of the API and worker entry points
+
+Run with: python -m app.utils.startup [--module app.asgi] [--budget-ms 1500]
+
+Each run imports the module in a fresh interpreter with -X importtime, prints
+the slowest imports, and exits non-zero when the import takes longer than the
+budget or when a heavy library that should load lazily was imported
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Libraries only specific code paths need, they must not load at startup
+HEAVY_MODULES = [
+    "faster_whisper",
+    "ctranslate2",
+    "edge_tts",
+    "aiohttp",
+    "azure.cognitiveservices.speech",
+    "redis",
+    "moviepy",
+    "numpy",
+    "torch",
+]
+
+
+def profileImport(module: str) -> Tuple[float, List[Tuple[float, str]], List[str]]:
+    """
+    Import a module in a fresh interpreter
+
+    Returns:
+        Total import time in ms, (cumulative ms, module) of every import
+        and the loaded modules
+    """
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+
+    timings = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        ms = int(cumulative) / 1000
+        timings.append((ms, name.strip()))
+        if name.strip() == module:
+            total = ms
+
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, timings, loaded
+
+
+def loadedHeavyModules(loaded: List[str]) -> List[str]:
+    loaded = set(loaded)
+    return [m for m in HEAVY_MODULES if m in loaded]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", action="append", help="module to import, may be repeated")
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.module or ["app.asgi", "app.services.task"]:
+        runs: Dict[float, Tuple[List[Tuple[float, str]], List[str]]] = {}
+        for _ in range(max(1, args.runs)):
+            total, timings, loaded = profileImport(module)
+            runs[total] = (timings, loaded)
+
+        # the fastest run is the least disturbed by disk cache and scheduling noise
+        best = min(runs)
+        timings, loaded = runs[best]
+        heavy = loadedHeavyModules(loaded)
+
+        print(f"{module}: {best:.0f} ms (budget {args.budget_ms:.0f} ms)")
+        for ms, name in sorted(timings, reverse=True)[:args.top]:
+            print(f"  {ms:8.1f} ms  {name}")
+        if heavy:
+            print(f"  eagerly imported: {', '.join(heavy)}")
+
+        if best > args.budget_ms or heavy:
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
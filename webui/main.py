@@ -21,6 +21,7 @@ from app.models.schema import (
     VideoTransitionMode,
 )
 from app.services import voice
+from app.services import voice_catalog
 from app.services import task as tm
 from app.utils import utils
 
@@ -438,24 +439,10 @@ with middle_panel:
         selected_tts_server = tts_servers[selected_tts_server_index][0]
         config.ui["tts_server"] = selected_tts_server
 
-        filtered_voices = []
-
-        if selected_tts_server == "siliconflow":
-
-            filtered_voices = voice.get_siliconflow_voices()
-        else:
-
-            all_voices = voice.get_all_azure_voices(filter_locals=None)
-
-            for v in all_voices:
-                if selected_tts_server == "azure-tts-v2":
-
-                    if "V2" in v:
-                        filtered_voices.append(v)
-                else:
-
-                    if "V2" not in v:
-                        filtered_voices.append(v)
+        filtered_voices = [
+            v.id
+            for v in voice_catalog.get_catalog().filter(provider=selected_tts_server)
+        ]
 
         friendly_names = {
             v: v.replace("Female", "Female")
@@ -663,15 +650,17 @@ if start_button:
         st.info(f"Starting batch processing of {len(script_files)} script files...")
         progress_bar = st.progress(0)
 
-        results = []
-        for i, script_file in enumerate(script_files):
+        # every script is queued on the stage pipeline first, so one task's
+        # transcription and encoding overlap the others' synthesis and downloads,
+        # and their whisper fallbacks share batched transcriptions
+        submitted = []
+        for script_file in script_files:
             task_id = str(uuid4())
             script_content = script_file.getvalue().decode("utf-8")
 
             processed_content, keywords = extract_keywords_from_script(script_content, script_file.name)
 
             filename = script_file.name
-            base_filename = os.path.splitext(filename)[0]
 
             batch_params = VideoParams(
                 video_subject="",
@@ -712,7 +701,15 @@ if start_button:
                         batch_params.video_materials.append(m)
 
             try:
-                result = tm.start(task_id=task_id, params=batch_params)
+                submitted.append((filename, task_id, tm.submit(task_id, batch_params)))
+            except Exception as e:
+                logger.error(f"Error processing {filename}: {str(e)}")
+
+        results = []
+        for i, (filename, task_id, future) in enumerate(submitted):
+            base_filename = os.path.splitext(filename)[0]
+            try:
+                result = future.result()
                 if result and "videos" in result:
                     video_files = result.get("videos", [])
                     if video_files:
@@ -728,7 +725,7 @@ if start_button:
             except Exception as e:
                 logger.error(f"Error processing {filename}: {str(e)}")
 
-            progress_bar.progress((i + 1) / len(script_files))
+            progress_bar.progress((i + 1) / len(submitted))
 
         if results:
             st.success(f"Generated videos for {len(results)}/{len(script_files)} scripts")
@@ -813,7 +810,7 @@ if start_button:
         logger.info(utils.toJson(params))
         scroll_to_bottom()
 
-        result = tm.start(task_id=task_id, params=params)
+        result = tm.start(taskId=task_id, params=params)
         if not result or "videos" not in result:
             st.error("Video Generation Failed")
             logger.error("Video Generation Failed")
@@ -0,0 +1,33 @@
+import signal
+import threading
+
+from loguru import logger
+
+from app.config import config
+
+if __name__ == "__main__":
+    if not config.app.get("enable_redis", False):
+        raise SystemExit("worker.py needs enable_redis = true, tasks and their state are shared through redis")
+
+    from app.controllers.manager import redis_manager
+    from app.services import whisper_pool
+
+    whisper_pool.preload_in_background()
+    taskManager = redis_manager.fromConfig(startWorkers=True)
+    logger.info(
+        f"Worker {taskManager.workerId} started, slots: {taskManager.maxConcurrentTasks}"
+    )
+
+    stopped = threading.Event()
+
+    def onSignal(signum, frame):
+        logger.info("Stopping, waiting for the running tasks to finish")
+        stopped.set()
+
+    signal.signal(signal.SIGINT, onSignal)
+    signal.signal(signal.SIGTERM, onSignal)
+
+    stopped.wait()
+    # tasks still running after the grace period are requeued by another worker once their lease expires
+    if not taskManager.drain(timeout=config.app.get("worker_shutdown_timeout", 600)):
+        logger.warning("Running tasks did not finish in time, exiting")